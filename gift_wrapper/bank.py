@@ -0,0 +1,463 @@
+import io
+import json
+import pathlib
+
+from . import core
+from . import remote
+from . import colors
+from . import errors
+from . import journal
+from . import loader
+from . import parsing
+from . import validator
+from . import sources
+
+
+class Bank:
+	"""
+	A bank of questions that can be modified and rendered (to GIFT or Moodle XML) over and over, e.g., from a notebook.
+
+	The connection to the remote host, the files already compiled/transferred and the questions already rendered are
+	kept between calls, so that rendering again after modifying a question only takes rendering that question.
+	"""
+
+	def __init__(
+			self, pictures_base_directory: str = '.', categories: list | None = None,
+			parameters: str | pathlib.Path | dict | None = 'parameters.yaml', directory: str | pathlib.Path | None = None,
+			local_run: bool = False, no_checks: bool = False, embed_images: bool = False, strict: bool = False,
+			check_sampling: float = 0., jobs: int | None = None, keep_going: bool = False,
+			output_format: str = 'gift', merge_tex: bool = False) -> None:
+		"""
+		Initializer.
+
+		Parameters
+		----------
+		pictures_base_directory : str
+			Base directory for the images in the remote host.
+		categories : list, optional
+			Categories (along with their questions) as in the questions file.
+		parameters : str, pathlib.Path, dict or None
+			Parameters file or the parameters themselves (if `None`, images are embedded).
+		directory : str or pathlib.Path, optional
+			Directory relative to which files referenced in the questions are found (the current one by default).
+		local_run : bool
+			If `True`, images are not copied over to a server
+		no_checks : bool
+			If `True`, LaTeX formulas are not checked
+		embed_images : bool
+			If `True`, images are embedded
+		strict : bool
+			If `True`, every LaTeX formula is compiled
+		check_sampling : float
+			Fraction of the LaTeX formulas that are compiled even if proven fine without compiling them
+		jobs : int, optional
+			Number of TeX files compiled simultaneously (the number of processors by default)
+		keep_going : bool
+			If `True`, questions with errors are skipped (and the errors are available in `errors` after rendering)
+		output_format : str
+			Either "gift" or "xml" (Moodle XML)
+		merge_tex : bool
+			If `True`, TeX files with the same preamble (and directory) are compiled at once, as the pages of a single
+			document
+
+		"""
+
+		self.pictures_base_directory = pictures_base_directory
+		self.categories = []
+
+		# (parameters are only needed for hosting images, which is not done in Moodle XML)
+		self.parameters = core.read_parameters(parameters) if (
+			(parameters is not None) and (output_format == 'gift')) else None
+
+		self.directory = pathlib.Path(directory or '.').resolve()
+		self.local_run = local_run
+		self.no_checks = no_checks
+		self.embed_images = embed_images or (self.parameters is None)
+		self.strict = strict
+		self.check_sampling = check_sampling
+		self.jobs = jobs
+		self.keep_going = keep_going
+		self.output_format = output_format
+		self.merge_tex = merge_tex
+
+		# files already compiled/transferred, along with their modification times when that happened
+		self.history = {'already compiled': set(), 'already transferred': set()}
+		self.modification_times = {}
+
+		# (pre) processing objects, (post) processing objects and connection, set up in the first rendering
+		self.transforms = None
+
+		# every question rendered as (position of its category, name) -> (settings, stamps of the files referenced, text)
+		self.rendered_questions = {}
+
+		# settings and stamps of the questions being rendered
+		self.pending = {}
+
+		# errors found in the last rendering (in "keep going" mode)
+		self.errors = errors.Report()
+
+		# anything in the last rendering (in GIFT) that would break, or be mangled by, a Moodle import
+		self.problems = errors.Report()
+
+		for cat in (categories or []):
+
+			for q in cat['questions']:
+
+				self.add(cat['name'], q)
+
+	@classmethod
+	def from_dict(cls, data: dict, **kwargs) -> 'Bank':
+		"""
+		Builds a bank from a dictionary.
+
+		Parameters
+		----------
+		data : dict
+			Questions, with the same structure as the questions file ("pictures base directory" and "categories").
+		**kwargs
+			Any other parameter accepted by the initializer.
+
+		Returns
+		-------
+		out: Bank
+			The bank.
+
+		"""
+
+		# files included in the questions are relative to the directory of the bank
+		data, _ = loader.resolve(data, kwargs.get('directory') or '.')
+
+		return cls(data.get('pictures base directory', '.'), data.get('categories'), **kwargs)
+
+	@classmethod
+	def from_yaml(cls, questions_file: str | pathlib.Path, **kwargs) -> 'Bank':
+		"""
+		Builds a bank from a questions file.
+
+		Parameters
+		----------
+		questions_file : str or pathlib.Path
+			Questions file (files referenced in it are relative to its directory unless `directory` is passed).
+		**kwargs
+			Any other parameter accepted by the initializer.
+
+		Returns
+		-------
+		out: Bank
+			The bank.
+
+		"""
+
+		questions_file = pathlib.Path(questions_file)
+
+		data, _ = loader.load(questions_file)
+
+		kwargs.setdefault('directory', questions_file.parent)
+
+		return cls.from_dict(data, **kwargs)
+
+	@staticmethod
+	def category_key(name: str | list | None) -> str | None:
+
+		# (as in the reports of errors, nested names are joined by "/")
+		if isinstance(name, list):
+
+			return '/'.join(str(c) for c in name) if name else None
+
+		return None if name is None else str(name)
+
+	def find_category(self, name: str | list | None) -> dict | None:
+
+		key = self.category_key(name)
+
+		for cat in self.categories:
+
+			if self.category_key(cat['name']) == key:
+
+				return cat
+
+		return None
+
+	def position(self, cat: dict) -> int:
+
+		# (the category itself, rather than an equal one)
+		return next(i for i, c in enumerate(self.categories) if c is cat)
+
+	def drop_category(self, cat: dict):
+
+		i_category = self.position(cat)
+
+		del self.categories[i_category]
+
+		# questions rendered in the categories after this one are kept, but moved up one position
+		self.rendered_questions = {
+			(i - (i > i_category), name): entry for (i, name), entry in self.rendered_questions.items()
+			if i != i_category}
+
+	def find_question(self, category: str | list | None, name: str) -> tuple[dict, int]:
+
+		cat = self.find_category(category)
+
+		if cat is not None:
+
+			for i, q in enumerate(cat['questions']):
+
+				if q.get('name') == name:
+
+					return cat, i
+
+		raise KeyError(f'there is no question "{name}" in category "{self.category_key(category)}"')
+
+	def question(self, category: str | list | None, name: str) -> dict:
+		"""
+		Returns the settings of a question.
+
+		Parameters
+		----------
+		category : str, list or None
+			Category (either its name, or the list of its nested names).
+		name : str
+			Name of the question.
+
+		Returns
+		-------
+		out: dict
+			Settings of the question.
+
+		"""
+
+		cat, i = self.find_question(category, name)
+
+		return cat['questions'][i]
+
+	def add(self, category: str | list | None, settings: dict):
+		"""
+		Adds a question (at the end of its category, which is created if needed).
+
+		Parameters
+		----------
+		category : str, list or None
+			Category (either its name, or the list of its nested names).
+		settings : dict
+			Settings of the question (as in the questions file).
+
+		"""
+
+		cat = self.find_category(category)
+
+		if cat is None:
+
+			cat = {'name': category, 'questions': []}
+
+			self.categories.append(cat)
+
+		if any(q.get('name') == settings.get('name') for q in cat['questions']):
+
+			raise ValueError(
+				f'there is already a question "{settings.get("name")}" in category "{self.category_key(category)}"')
+
+		# (a copy so that the one passed can be modified without affecting the bank)
+		cat['questions'].append(dict(settings))
+
+	def update(self, category: str | list | None, name: str, settings: dict | None = None, **changes):
+		"""
+		Modifies a question.
+
+		Parameters
+		----------
+		category : str, list or None
+			Category (either its name, or the list of its nested names).
+		name : str
+			Name of the question.
+		settings : dict, optional
+			New settings for the question (otherwise, they are kept).
+		**changes
+			Individual settings to be changed (e.g., `statement='...'`).
+
+		"""
+
+		cat, i = self.find_question(category, name)
+
+		settings = dict(cat['questions'][i] if settings is None else settings)
+		settings.update(changes)
+
+		# the name can be changed, as long as there is no other question with the new one
+		if any((q.get('name') == settings.get('name')) and (j != i) for j, q in enumerate(cat['questions'])):
+
+			raise ValueError(
+				f'there is already a question "{settings.get("name")}" in category "{self.category_key(category)}"')
+
+		cat['questions'][i] = settings
+
+		self.rendered_questions.pop((self.position(cat), name), None)
+
+	def remove(self, category: str | list | None, name: str | None = None):
+		"""
+		Removes a question, or a whole category.
+
+		Parameters
+		----------
+		category : str, list or None
+			Category (either its name, or the list of its nested names).
+		name : str, optional
+			Name of the question (if not passed, the whole category is removed).
+
+		"""
+
+		if name is None:
+
+			cat = self.find_category(category)
+
+			if cat is None:
+
+				raise KeyError(f'there is no category "{self.category_key(category)}"')
+
+			self.drop_category(cat)
+
+			return
+
+		cat, i = self.find_question(category, name)
+
+		del cat['questions'][i]
+
+		self.rendered_questions.pop((self.position(cat), name), None)
+
+		# a category left with no questions is gone
+		if not cat['questions']:
+
+			self.drop_category(cat)
+
+	def rendered(self, i_category: int, name: str) -> str | None:
+		"""
+		Returns the text of a question rendered before, as long as it is still up to date (or `None`).
+		"""
+
+		entry = self.rendered_questions.get((i_category, name))
+
+		if (entry is None) or (entry[:2] != self.pending.get((i_category, name))):
+
+			return None
+
+		return entry[2]
+
+	def record_question(self, i_category: int, name: str, text: str):
+
+		self.rendered_questions[(i_category, name)] = (*self.pending[(i_category, name)], text)
+
+	def render(self) -> str:
+		"""
+		Renders the bank (only the questions modified since the last time are actually processed).
+
+		Returns
+		-------
+		out: str
+			GIFT-ready text (or Moodle XML).
+
+		"""
+
+		output = io.StringIO()
+
+		self.write(output)
+
+		return output.getvalue()
+
+	def write(self, output: str | pathlib.Path | io.TextIOBase) -> str | pathlib.Path | io.TextIOBase:
+		"""
+		Renders the bank into a file.
+
+		Parameters
+		----------
+		output : str, pathlib.Path or file object
+			Output file (if a path, relative to the current directory).
+
+		Returns
+		-------
+		out: str, pathlib.Path or file object
+			The output.
+
+		"""
+
+		if isinstance(output, (str, pathlib.Path)):
+
+			with open(output, 'w') as f:
+
+				self.write(f)
+
+			return output
+
+		# (the output is put together in memory so that it can be checked before it is written)
+		text = io.StringIO()
+
+		# files referenced in the questions are relative to the directory of the bank (the current one is left alone)
+		with sources.relative_to(self.directory):
+
+			self.build(text)
+
+		# the output is checked for anything that would break, or be mangled by, a Moodle import (as in `core.wrap`)
+		self.problems = validator.validate(text.getvalue().encode()) if self.output_format == 'gift' else errors.Report()
+
+		if self.problems:
+
+			self.problems.print()
+
+			print(
+				f'\n{colors.error}the output is not valid GIFT (Moodle would fail to import it, or mangle some '
+				f'questions)')
+
+		output.write(text.getvalue())
+
+		return output
+
+	def build(self, f: io.TextIOBase):
+
+		# every file modified since it was processed is processed again
+		journal.forget_modified(self.history, self.modification_times)
+
+		if self.transforms is None:
+
+			self.transforms = core.make_transforms(
+				self.parameters, self.pictures_base_directory, self.history, self.local_run, self.no_checks,
+				self.embed_images, strict_checks=self.strict, checks_sampling=self.check_sampling,
+				output_format=self.output_format)
+
+		pre_transforms, post_transforms, connection = self.transforms
+
+		# if the connection was dropped in the meantime...
+		if isinstance(connection, remote.Connection) and (not connection.is_active()):
+
+			# ...it is established again (and the transformers using it set up anew)
+			self.transforms = pre_transforms, post_transforms, connection = core.make_transforms(
+				self.parameters, self.pictures_base_directory, self.history, self.local_run, self.no_checks,
+				self.embed_images, connection, self.strict, self.check_sampling, self.output_format)
+
+		# TeX files that could not be compiled are tried again (they might have been fixed)
+		core.tex_compiler(pre_transforms).failures.clear()
+
+		# a question rendered before is only reused if neither its settings nor the files it refers to have changed
+		self.pending = {
+			(i_category, q.get('name')): (
+				json.dumps(q, sort_keys=True, default=str), journal.stamps(parsing.strings_in(q)))
+			for i_category, cat in enumerate(self.categories) for q in cat['questions']}
+
+		self.errors = errors.Report()
+
+		core.compile_figures(
+			self.categories, core.tex_compiler(pre_transforms), self.jobs, self.keep_going, self.merge_tex)
+
+		core.write_categories(
+			self.categories, pre_transforms, post_transforms, f, self.errors if self.keep_going else None, self,
+			self.output_format)
+
+		if connection is not None:
+
+			connection.flush()
+
+		journal.record_modification_times(self.history, self.modification_times)
+
+	@property
+	def connection(self) -> remote.Connection | remote.LocalConnection | remote.FakeConnection | None:
+		"""
+		The connection used to copy the images (`None` if they are embedded or nothing has been rendered yet).
+		"""
+
+		return None if self.transforms is None else self.transforms[2]
@@ -0,0 +1,467 @@
+import os
+import re
+import json
+import time
+import atexit
+import pathlib
+import argparse
+import threading
+import collections
+
+# file locking is only available in Unix
+try:
+
+	import fcntl
+
+except ImportError:
+
+	fcntl = None
+
+from . import colors
+from . import workspace
+
+# environment variable that can be used to set the directory of the cache
+root_variable = 'GIFT_WRAPPER_CACHE'
+
+# environment variable that can be used to set the maximum size of the cache (e.g., "500M")
+max_size_variable = 'GIFT_WRAPPER_CACHE_SIZE'
+
+default_max_size = '1G'
+
+# entries used this recently (in seconds) are never evicted, since another process might be using them
+grace_period = 60
+
+# temporary files (see `workspace.publish`) older than this (in seconds) were left behind by a process that died
+stale_temporary_age = 3600
+
+# hits and misses of every kind of entry in this process (added to those of previous processes at exit)
+counters = collections.defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+# bytes stored by this process (if any, the size of the cache is checked at exit)
+stored = 0
+
+# entries can be looked up and stored from different threads
+lock = threading.Lock()
+
+
+def root() -> pathlib.Path:
+	"""
+	Returns the directory in which files that are worth keeping across runs are stored.
+
+	Returns
+	-------
+	out: pathlib.Path
+		The directory given by the environment variable `root_variable` if set, or "gift-wrapper" within the user's
+		cache directory (`XDG_CACHE_HOME`, by default "~/.cache") otherwise.
+
+	"""
+
+	if root_variable in os.environ:
+
+		return pathlib.Path(os.environ[root_variable]).expanduser()
+
+	return pathlib.Path(os.environ.get('XDG_CACHE_HOME', '~/.cache')).expanduser() / 'gift-wrapper'
+
+
+def parse_size(size: str | int) -> int:
+	"""
+	Turns a size with an optional (binary) unit, e.g., "500M", into a number of bytes.
+	"""
+
+	m = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*', str(size), re.IGNORECASE)
+
+	if m is None:
+
+		raise ValueError(f'"{size}" is not a valid size (e.g., "500M" or "2G")')
+
+	return int(float(m.group(1)) * 1024 ** ' KMGT'.index(m.group(2).upper() or ' '))
+
+
+def max_size() -> int:
+	"""
+	Returns the maximum size (in bytes) of the cache, as given by the environment variable `max_size_variable`.
+	"""
+
+	return parse_size(os.environ.get(max_size_variable, default_max_size))
+
+
+def path(kind: str, key: str) -> pathlib.Path:
+	"""
+	Returns the path of an entry in the cache (whether it exists or not).
+
+	Parameters
+	----------
+	kind : str
+		Kind of entry (every kind gets its own subdirectory).
+	key : str
+		Name of the entry (e.g., a hash of the content it was obtained from).
+
+	Returns
+	-------
+	out: pathlib.Path
+		Path.
+
+	"""
+
+	return root() / kind / key
+
+
+def lookup(kind: str, key: str) -> pathlib.Path | None:
+	"""
+	Looks for an entry in the cache, taking note of its use.
+
+	Parameters
+	----------
+	kind : str
+		Kind of entry.
+	key : str
+		Name of the entry.
+
+	Returns
+	-------
+	out: pathlib.Path or None
+		The entry, or `None` if it is not in the cache.
+
+	"""
+
+	entry = path(kind, key)
+
+	try:
+
+		# the modification time of an entry (which never changes its content) is the last time it was used
+		os.utime(entry)
+
+		hit = True
+
+	except FileNotFoundError:
+
+		hit = False
+
+	with lock:
+
+		counters[kind]['hits' if hit else 'misses'] += 1
+
+	return entry if hit else None
+
+
+def store(source: str | pathlib.Path, kind: str, key: str) -> pathlib.Path:
+	"""
+	Puts a file in the cache (atomically, so that concurrent runs never see it half-written).
+
+	Parameters
+	----------
+	source : str or pathlib.Path
+		File.
+	kind : str
+		Kind of entry.
+	key : str
+		Name of the entry.
+
+	Returns
+	-------
+	out: pathlib.Path
+		The entry.
+
+	"""
+
+	destination = path(kind, key)
+
+	destination.parent.mkdir(parents=True, exist_ok=True)
+
+	workspace.publish(source, destination)
+
+	took_note(destination)
+
+	return destination
+
+
+def store_bytes(content: bytes, kind: str, key: str) -> pathlib.Path:
+	"""
+	Puts some content in the cache (atomically).
+
+	Parameters
+	----------
+	content : bytes
+		Content.
+	kind : str
+		Kind of entry.
+	key : str
+		Name of the entry.
+
+	Returns
+	-------
+	out: pathlib.Path
+		The entry.
+
+	"""
+
+	destination = path(kind, key)
+
+	destination.parent.mkdir(parents=True, exist_ok=True)
+
+	# (as in `workspace.publish`)
+	temporary = destination.with_name(f'.{destination.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+
+	temporary.write_bytes(content)
+
+	os.replace(temporary, destination)
+
+	took_note(destination)
+
+	return destination
+
+
+def took_note(entry: pathlib.Path):
+
+	global stored
+
+	with lock:
+
+		stored += entry.stat().st_size
+
+
+def entries() -> list[tuple[str, pathlib.Path, os.stat_result]]:
+	"""
+	Lists every entry in the cache.
+
+	Returns
+	-------
+	out: list
+		Kind, path and status (size, modification time...) of every entry.
+
+	"""
+
+	res = []
+
+	if not root().is_dir():
+
+		return res
+
+	for directory in root().iterdir():
+
+		if not directory.is_dir():
+
+			continue
+
+		for entry in directory.iterdir():
+
+			try:
+
+				res.append((directory.name, entry, entry.stat()))
+
+			# it might have been removed by another process in the meantime
+			except FileNotFoundError:
+
+				continue
+
+	return res
+
+
+def collect_garbage(size: int | None = None) -> tuple[int, int]:
+	"""
+	Evicts the least recently used entries until the cache fits in a given size.
+
+	Parameters
+	----------
+	size : int, optional
+		Maximum size in bytes (by default, that given by `max_size`).
+
+	Returns
+	-------
+	n_entries: int
+		Number of entries removed.
+	n_bytes: int
+		Number of bytes freed.
+
+	"""
+
+	size = max_size() if size is None else size
+
+	now = time.time()
+
+	n_entries, n_bytes = 0, 0
+
+	live = []
+
+	for kind, entry, status in entries():
+
+		# temporary files are only removed if they were clearly left behind
+		if entry.name.startswith('.'):
+
+			if now - status.st_mtime > stale_temporary_age:
+
+				entry.unlink(missing_ok=True)
+
+			continue
+
+		live.append((status.st_mtime, status.st_size, entry))
+
+	total = sum(s for _, s, _ in live)
+
+	# least recently used first
+	for last_used, n, entry in sorted(live):
+
+		if (total <= size) or (now - last_used < grace_period):
+
+			break
+
+		entry.unlink(missing_ok=True)
+
+		total -= n
+		n_entries += 1
+		n_bytes += n
+
+	return n_entries, n_bytes
+
+
+def statistics() -> dict:
+	"""
+	Gathers the hits and misses (of every process so far) and the current size of every kind of entry.
+
+	Returns
+	-------
+	out: dict
+		For every kind, "hits", "misses", "entries" and "bytes".
+
+	"""
+
+	res = collections.defaultdict(lambda: {'hits': 0, 'misses': 0, 'entries': 0, 'bytes': 0})
+
+	for kind, counts in read_counters().items():
+
+		res[kind].update(counts)
+
+	for kind, entry, status in entries():
+
+		# (temporary files are not entries yet)
+		if entry.name.startswith('.'):
+
+			continue
+
+		res[kind]['entries'] += 1
+		res[kind]['bytes'] += status.st_size
+
+	return dict(res)
+
+
+def read_counters() -> dict:
+
+	try:
+
+		return json.loads((root() / 'stats.json').read_text())
+
+	except (OSError, ValueError):
+
+		return {}
+
+
+def save_counters():
+	"""
+	Adds the hits and misses of this process to those saved (by previous processes) in the cache.
+	"""
+
+	with lock:
+
+		if not counters:
+
+			return
+
+		pending = {kind: dict(counts) for kind, counts in counters.items()}
+
+		counters.clear()
+
+	root().mkdir(parents=True, exist_ok=True)
+
+	# concurrent processes take turns
+	with open(root() / '.lock', 'w') as lock_file:
+
+		if fcntl is not None:
+
+			fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+		saved = read_counters()
+
+		for kind, counts in pending.items():
+
+			for name, n in counts.items():
+
+				saved.setdefault(kind, {}).setdefault(name, 0)
+				saved[kind][name] += n
+
+		temporary = root() / f'.stats.json.{os.getpid()}.tmp'
+
+		temporary.write_text(json.dumps(saved))
+
+		os.replace(temporary, root() / 'stats.json')
+
+
+@atexit.register
+def tidy_up():
+	"""
+	Saves the hits and misses of this process and, if anything was stored, evicts entries in case the cache grew
+	beyond its maximum size.
+	"""
+
+	try:
+
+		save_counters()
+
+		if stored:
+
+			collect_garbage()
+
+	# (nothing that goes wrong here is worth stopping, or even bothering, the user)
+	except (OSError, ValueError):
+
+		pass
+
+
+def main(arguments: list[str] | None = None):
+	"""Processes command-line arguments for inspecting (`stats`) and tidying up (`gc`) the cache.
+	"""
+
+	parser = argparse.ArgumentParser(
+		prog='gift-wrapper cache', description=f'Inspect or tidy up the cache (currently at {root()})')
+
+	subparsers = parser.add_subparsers(dest='command', required=True)
+
+	subparsers.add_parser('stats', help='report hits, misses, entries and bytes for every kind of entry')
+
+	gc_parser = subparsers.add_parser('gc', help='evict the least recently used entries')
+
+	gc_parser.add_argument(
+		'--max-size', default=None,
+		help=f'size the cache must fit in, e.g., "500M" (default: ${max_size_variable} or {default_max_size})')
+
+	command_line_arguments = parser.parse_args(arguments)
+
+	if command_line_arguments.command == 'gc':
+
+		size = max_size() if command_line_arguments.max_size is None else parse_size(command_line_arguments.max_size)
+
+		n_entries, n_bytes = collect_garbage(size)
+
+		print(
+			f'{colors.info}removed {colors.reset}{n_entries}{colors.info} entries ({colors.reset}{n_bytes}'
+			f'{colors.info} bytes) from {colors.reset}{root()}')
+
+		return
+
+	stats = statistics()
+
+	print(f'{colors.info}cache at {colors.reset}{root()}{colors.info} (maximum size {colors.reset}{max_size()}'
+		f'{colors.info} bytes)')
+
+	print(f'{"kind":>12} {"entries":>8} {"bytes":>12} {"hits":>8} {"misses":>8} {"hit rate":>9}')
+
+	for kind, s in sorted(stats.items()):
+
+		lookups = s['hits'] + s['misses']
+
+		rate = f'{s["hits"] / lookups:>9.1%}' if lookups else f'{"-":>9}'
+
+		print(f'{kind:>12} {s["entries"]:>8} {s["bytes"]:>12} {s["hits"]:>8} {s["misses"]:>8} {rate}')
+
+	print(
+		f'{"total":>12} {sum(s["entries"] for s in stats.values()):>8} '
+		f'{sum(s["bytes"] for s in stats.values()):>12}')
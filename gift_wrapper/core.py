@@ -1,21 +1,61 @@
+import re
+import sys
+import time
 import argparse
+import io
+import fnmatch
 import pathlib
+import contextvars
 import collections
+import concurrent.futures
 
 import yaml
 from tqdm.autonotebook import tqdm
 
 from . import question
+from . import cache
 from . import remote
 from . import gift
 from . import colors
 from . import transformer
-
-def main():
-	"""Processes command-line arguments and feeds them to `wrap`.
+from . import errors
+from . import journal
+from . import payload
+from . import preflight
+from . import loader
+from . import validator
+from . import plan
+from . import moodle_xml
+from . import image
+from . import latex
+from . import parsing
+from . import workspace
+from . import server
+
+def main(arguments: list[str] | None = None):
+	"""Processes command-line arguments and feeds them to `wrap` (or the requested subcommand).
 	"""
 
-	parser = argparse.ArgumentParser(description='Build GIFT files (Moodle) from a simple specification')
+	if arguments is None:
+
+		arguments = sys.argv[1:]
+
+	# subcommands
+	if arguments and (arguments[0] == 'serve'):
+
+		server.main(arguments[1:])
+
+		return
+
+	if arguments and (arguments[0] == 'cache'):
+
+		cache.main(arguments[1:])
+
+		return
+
+	parser = argparse.ArgumentParser(
+		description='Build GIFT files (Moodle) from a simple specification',
+		epilog='run "%(prog)s serve -h" for a long-running build service, or "%(prog)s cache -h" for managing the cache')
 
 	parser.add_argument(
 		'-p', '--parameters_file', default='parameters.yaml', help='parameters file',
@@ -30,20 +70,98 @@ def main():
 	parser.add_argument(
 		'-n', '--no-checks', default=False, action='store_true', help="don't check LaTeX formulas (much faster)")
 
+	parser.add_argument(
+		'--strict', default=False, action='store_true',
+		help='compile every LaTeX formula (rather than only those that cannot be proven fine without compiling them)')
+
+	parser.add_argument(
+		'--check-sampling', default=0., type=float,
+		help='fraction of the LaTeX formulas proven fine that are compiled anyway (default: 0)')
+
+	parser.add_argument(
+		'-j', '--jobs', default=None, type=int,
+		help='number of TeX files compiled simultaneously (default: number of processors)')
+
+	parser.add_argument(
+		'--merge-tex', default=False, action='store_true',
+		help='compile TeX files with the same preamble (and directory) at once, as the pages of a single document')
+
+	parser.add_argument(
+		'-w', '--workspace', default=None,
+		help='directory in which TeX files are compiled (default: a memory-backed one if available)')
+
+	parser.add_argument(
+		'-k', '--keep-going', default=False, action='store_true',
+		help='rather than stopping at the first error, skip the question and report every error in the end')
+
+	parser.add_argument(
+		'-r', '--resume', default=False, action='store_true',
+		help='resume the last (interrupted or failed) run, unless the inputs have changed since')
+
+	parser.add_argument(
+		'--only-category', default=None, action='append', metavar='PATTERN',
+		help='only process categories whose name matches the given (glob) pattern (it can be repeated)')
+
+	parser.add_argument(
+		'--only-question', default=None, action='append', metavar='PATTERN',
+		help='only process questions whose name matches the given (glob) pattern (it can be repeated)')
+
+	parser.add_argument(
+		'--payload', default=False, action='store_true',
+		help='report the size of the heaviest questions and of every category (split into images, formulas and text)')
+
+	parser.add_argument(
+		'--question-budget', default=None, type=int, metavar='BYTES',
+		help='maximum size of a question in the output')
+
+	parser.add_argument(
+		'--bank-budget', default=None, type=int, metavar='BYTES',
+		help='maximum size of all the questions together in the output')
+
+	parser.add_argument(
+		'--over-budget', default='fail', choices=['fail', 'link'],
+		help='what to do with a question over budget: fail, or link (rather than inline) its images, largest first, '
+		'until it fits (default: fail)')
+
+	parser.add_argument(
+		'--plan', default=False, action='store_true',
+		help="don't build anything, but report the work to be done (formulas to be checked, TeX files to be compiled, "
+		"bytes to be copied, questions to be rendered) and how long it should take according to previous runs")
+
+	parser.add_argument(
+		'-f', '--format', default='gift', choices=['gift', 'xml'],
+		help='output format: GIFT, or Moodle XML with the images attached to the questions (default: gift)')
+
 	parser.add_argument(
 		'-e', '--embed-images', default=False, action='store_true',
 		help='embed the images rather than link to them')
 
-	command_line_arguments = parser.parse_args()
-	
+	command_line_arguments = parser.parse_args(arguments)
+
+	if command_line_arguments.workspace:
+
+		workspace.configure(command_line_arguments.workspace)
+
 	wrap(
 		parameters=command_line_arguments.parameters_file,
 		questions_file=command_line_arguments.input_file, local_run=command_line_arguments.local,
 		no_checks=command_line_arguments.no_checks,
-		embed_images=command_line_arguments.embed_images)
-
-
-def wrap(parameters: str, questions_file: str, local_run: bool, no_checks: bool, embed_images: bool):
+		embed_images=command_line_arguments.embed_images, strict=command_line_arguments.strict,
+		check_sampling=command_line_arguments.check_sampling, jobs=command_line_arguments.jobs,
+		keep_going=command_line_arguments.keep_going, only_categories=command_line_arguments.only_category,
+		only_questions=command_line_arguments.only_question, resume=command_line_arguments.resume,
+		output_format=command_line_arguments.format, payload_report=command_line_arguments.payload,
+		question_budget=command_line_arguments.question_budget, bank_budget=command_line_arguments.bank_budget,
+		over_budget=command_line_arguments.over_budget, merge_tex=command_line_arguments.merge_tex,
+		plan_only=command_line_arguments.plan)
+
+
+def wrap(
+		parameters: str, questions_file: str, local_run: bool, no_checks: bool, embed_images: bool,
+		strict: bool = False, check_sampling: float = 0., jobs: int | None = None, keep_going: bool = False,
+		only_categories: list[str] | None = None, only_questions: list[str] | None = None, resume: bool = False,
+		output_format: str = 'gift', payload_report: bool = False, question_budget: int | None = None,
+		bank_budget: int | None = None, over_budget: str = 'fail', merge_tex: bool = False, plan_only: bool = False):
 	"""Builds a gift file.
 
 	Parameters
@@ -58,10 +176,359 @@ def wrap(parameters: str, questions_file: str, local_run: bool, no_checks: bool,
 		If `True`, LaTeX formulas are not checked
 	embed_images : bool
 		If `True`, images are embedded
+	strict : bool
+		If `True`, every LaTeX formula is compiled
+	check_sampling : float
+		Fraction of the LaTeX formulas that are compiled even if proven fine without compiling them
+	jobs : int, optional
+		Number of TeX files compiled simultaneously (the number of processors by default)
+	keep_going : bool
+		If `True`, questions with errors are skipped, and all the errors are reported in the end
+	only_categories : list, optional
+		If passed, only the categories matching any of these (glob) patterns are processed
+	only_questions : list, optional
+		If passed, only the questions matching any of these (glob) patterns are processed
+	resume : bool
+		If `True`, the work done in the last run (as recorded in its journal) is not done again
+	output_format : str
+		Either "gift" or "xml" (Moodle XML)
+	payload_report : bool
+		If `True`, the size of the heaviest questions and of every category is reported
+	question_budget : int, optional
+		Maximum size (in bytes) of a question in the output
+	bank_budget : int, optional
+		Maximum size (in bytes) of all the questions together in the output
+	over_budget : str
+		Either "fail" or "link" (images of a question over budget are linked rather than inlined until it fits)
+	merge_tex : bool
+		If `True`, TeX files with the same preamble are compiled at once, as the pages of a single document
+	plan_only : bool
+		If `True`, nothing is built, but rather the work to be done (and an estimate of the time it takes) is reported
 	"""
 
 	# ================================= parameters' reading
 
+	# in Moodle XML images are attached to the questions, and hence parameters (about hosting them) are not needed
+	parameters = read_parameters(parameters) if output_format == 'gift' else None
+
+	# if a parameters file is NOT present...
+	if parameters is None:
+
+		# ...images are embedded
+		embed_images = True
+
+	input_file = pathlib.Path(questions_file)
+
+	# if the questions file doesn't exist...
+	if not input_file.exists():
+
+		raise SystemExit(
+			f'"{input_file}" {colors.error}cannot be found: you can download a sample from{colors.reset} '
+			r'https://raw.githubusercontent.com/manuvazquez/gift-wrapper/master/bank.yaml'
+			)
+
+	# ================================= questions' reading
+
+	# the file containing the questions is read, along with every file it includes
+	input_data, input_files = loader.load(input_file, jobs)
+
+	# only the questions to be built are considered (a broken question elsewhere doesn't get in the way)...
+	input_data = selected(input_data, only_categories, only_questions)
+
+	# ...and they are checked (in a flash) before any actual work is done
+	# (in a local run, images that are not embedded are only listed to be copied, and need not exist)
+	findings = preflight.check(input_data, svg_files=embed_images or not local_run)
+
+	# ...and every problem found is reported at once
+	if findings:
+
+		findings.print()
+
+		print(f'\n{colors.error}nothing was built: fix the above in {colors.reset}{input_file}')
+
+		sys.exit(1)
+
+	categories = input_data['categories']
+	pictures_base_directory = input_data['pictures base directory']
+
+	# if only a plan was requested, that's it
+	if plan_only:
+
+		print(f'{colors.info}plan for {colors.reset}{input_file}{colors.info}:')
+
+		plan.print_plan(plan.make(categories, no_checks, strict, check_sampling, not (embed_images or local_run)))
+
+		return
+
+	# ================================= behavior
+
+	# everything that determines the result
+	options = dict(
+		local_run=local_run, no_checks=no_checks, embed_images=embed_images, strict=strict,
+		check_sampling=check_sampling, only_categories=only_categories, only_questions=only_questions,
+		output_format=output_format, question_budget=question_budget, bank_budget=bank_budget, over_budget=over_budget)
+
+	# if only some of the questions are built, the output for the whole bank is not overwritten
+	subset = '.subset' if (only_categories is not None) or (only_questions is not None) else ''
+
+	# output file has the same name as the input with the ".gift.txt" (or ".xml") suffix
+	output_file = input_file.with_suffix(subset + ('.gift.txt' if output_format == 'gift' else '.xml'))
+
+	# progress is recorded as it goes (in the cache) so that an interrupted run can be resumed
+	checkpoints = journal.Journal(
+		journal.location(output_file),
+		journal.fingerprint(input_files, parameters, options, list(parsing.strings_in(categories))), resume)
+
+	# to keep track of files already compiled/transferred (every one of them is recorded in the journal)...
+	history = {
+		'already compiled': journal.JournaledSet(checkpoints.compiled, checkpoints, 'compiled', deferrable=False),
+		'already transferred': journal.JournaledSet(checkpoints.transferred, checkpoints, 'transferred')}
+
+	# ...but in a local run nothing is actually transferred
+	if local_run:
+
+		history['already transferred'] = set()
+
+	pre_transforms, post_transforms, connection = make_transforms(
+		parameters, pictures_base_directory, history, local_run, no_checks, embed_images,
+		strict_checks=strict, checks_sampling=check_sampling, output_format=output_format)
+
+	# sizes are only measured if needed
+	if payload_report or (question_budget is not None) or (bank_budget is not None):
+
+		sizes, link_connection = make_payload(
+			parameters, pictures_base_directory, history, local_run, embed_images, output_format, question_budget,
+			bank_budget, over_budget)
+
+	else:
+
+		sizes, link_connection = None, None
+
+	# in bulk mode, files are not actually copied until the end, and neither are the corresponding questions done
+	checkpoints.deferred = getattr(connection, 'bulk', False) or getattr(link_connection, 'bulk', False)
+
+	# ================================= processing
+
+	# errors are only collected if requested
+	report = errors.Report() if keep_going else None
+
+	# the work done in every stage, along with the time it took, is measured (for the estimates of `--plan`)
+	started, compiled = time.perf_counter(), len(history['already compiled'])
+
+	tex_to_svg = tex_compiler(pre_transforms)
+
+	# every TeX file is compiled beforehand
+	compile_figures(categories, tex_to_svg, jobs, keep_going, merge_tex)
+
+	# (compilations in parallel overlap, and hence the wall-clock time is what counts, rather than `tex_to_svg.seconds`)
+	figures, compiling = time.perf_counter() - started, tex_to_svg.seconds
+
+	started, formulas = time.perf_counter(), dict(latex.compiled_formulas)
+
+	with open(output_file, 'w') as f:
+
+		# (in a local run, questions are rendered again so that the list of files to be copied is complete)
+		write_categories(
+			categories, pre_transforms, post_transforms, f, report, None if local_run else checkpoints, output_format,
+			sizes)
+
+	# (formulas are compiled, and images copied unless in bulk mode, while rendering)
+	sent = [c.sent for c in (connection, link_connection) if hasattr(c, 'sent')]
+
+	# (unless compiled in parallel, TeX files are compiled while rendering)
+	compiled_while_rendering = tex_to_svg.seconds - compiling
+
+	timings = {
+		'figures': (len(history['already compiled']) - compiled, figures + compiled_while_rendering),
+		'formulas': (
+			latex.compiled_formulas['count'] - formulas['count'],
+			latex.compiled_formulas['seconds'] - formulas['seconds'])}
+
+	timings['render'] = (
+		sum(len(cat['questions']) for cat in categories),
+		time.perf_counter() - started - timings['formulas'][1] - sum(s['seconds'] for s in sent) -
+		compiled_while_rendering)
+
+	# files still pending (if any) are copied
+	for c in (connection, link_connection):
+
+		if c is not None:
+
+			c.flush()
+
+	timings['uploads'] = (sum(s['bytes'] for s in sent), sum(s['seconds'] for s in sent))
+
+	plan.record(timings)
+
+	checkpoints.commit()
+
+	print(f'{colors.info}file "{colors.reset}{output_file}{colors.info}" created')
+
+	# the output is checked (in a single pass) for anything that would break, or be mangled by, a Moodle import
+	problems = validator.validate_file(output_file) if output_format == 'gift' else errors.Report()
+
+	if problems:
+
+		problems.print()
+
+		print(
+			f'\n{colors.reset}{output_file}{colors.error} is not valid GIFT (Moodle would fail to import it, or mangle '
+			f'some questions)')
+
+	# every file to be copied (in a "local" run) by hand, if any
+	files_to_copy = [
+		(*f, c.host) for c in (connection, link_connection) if isinstance(c, remote.FakeConnection)
+		for f in c.files_to_copy]
+
+	# if this is a "local" run (fake connection), and there are files to be copied...
+	if files_to_copy:
+
+		print(f'{colors.info}you *should* copy:')
+
+		for source, remote_directory, remote_name, host in files_to_copy:
+
+			# if the file is to be renamed...
+			as_name = f'{colors.info} as {colors.reset}{remote_name}' if remote_name != source.name else ''
+
+			print(
+				f'{source}{colors.info} to '
+				f'{colors.reset}{remote_directory}{as_name}{colors.info} in {colors.reset}{host}')
+
+	if payload_report:
+
+		sizes.print()
+
+	# if any error was found along the way...
+	if report:
+
+		report.print()
+
+		print(f'\n{colors.error}questions with errors were left out of {colors.reset}{output_file}')
+
+		print(f'{colors.info}(run again with {colors.reset}--resume{colors.info} to retry only those)')
+
+		sys.exit(1)
+
+	if problems:
+
+		sys.exit(1)
+
+	# the build is complete
+	checkpoints.remove()
+
+
+def selected(
+		input_data: dict, only_categories: list[str] | None = None, only_questions: list[str] | None = None) -> dict:
+	"""
+	Picks a subset of the questions in a bank (see `select`), as long as the bank is well-formed (otherwise, it is
+	returned untouched for `preflight.check` to report the problems).
+
+	Parameters
+	----------
+	input_data : dict
+		Questions (as read from the questions file).
+	only_categories : list, optional
+		Glob patterns for the names of the categories to be kept (all of them if `None`).
+	only_questions : list, optional
+		Glob patterns for the names of the questions to be kept (all of them if `None`).
+
+	Returns
+	-------
+	out: dict
+		Questions, with only the selected categories (and questions).
+
+	"""
+
+	well_formed = isinstance(input_data, dict) and isinstance(input_data.get('categories'), list) and all(
+		isinstance(cat, dict) and ('name' in cat) and isinstance(cat.get('questions'), list) and all(
+			isinstance(q, dict) for q in cat['questions']) for cat in input_data['categories'])
+
+	if not well_formed:
+
+		return input_data
+
+	return dict(input_data, categories=select(input_data['categories'], only_categories, only_questions))
+
+
+def select(
+		categories: list, only_categories: list[str] | None = None, only_questions: list[str] | None = None) -> list:
+	"""
+	Picks a subset of the questions.
+
+	Parameters
+	----------
+	categories : list
+		Categories (as read from the input file).
+	only_categories : list, optional
+		Glob patterns (e.g., "Chapter ?") for the names of the categories to be kept (all of them if `None`). A
+		category with several (nested) names is kept if any of them, or all of them joined by "/", matches.
+	only_questions : list, optional
+		Glob patterns for the names of the questions to be kept (all of them if `None`).
+
+	Returns
+	-------
+	out: list
+		Categories with only the selected questions (those left with no questions are dropped).
+
+	"""
+
+	# if no filter was requested...
+	if (only_categories is None) and (only_questions is None):
+
+		# ...the categories are returned untouched
+		return categories
+
+	def matches(names: list, patterns: list[str] | None) -> bool:
+
+		return (patterns is None) or any(fnmatch.fnmatchcase(n, p) for n in names for p in patterns)
+
+	res = []
+
+	for cat in categories:
+
+		names = cat['name'] if isinstance(cat['name'], list) else [cat['name']]
+		names = [str(n) for n in names if n]
+
+		if not matches(names + ['/'.join(names)], only_categories):
+
+			continue
+
+		questions = [q for q in cat['questions'] if matches([str(q.get('name'))], only_questions)]
+
+		if questions:
+
+			# (the original category is not modified)
+			res.append({**cat, 'questions': questions})
+
+	if not res:
+
+		raise errors.BuildError(
+			'settings', None, f'{colors.error}no question matches the requested categories/questions')
+
+	n_questions = sum(len(cat['questions']) for cat in res)
+
+	print(f'{colors.info}only processing {colors.reset}{n_questions}{colors.info} question(s) in '
+		f'{colors.reset}{len(res)}{colors.info} category(ies)')
+
+	return res
+
+
+def read_parameters(parameters: str | pathlib.Path | dict) -> dict | None:
+	"""
+	Reads the parameters.
+
+	Parameters
+	----------
+	parameters : str, pathlib.Path or dict
+		Parameters file or the parameters themselves.
+
+	Returns
+	-------
+	out: dict or None
+		Parameters, or `None` if the parameters file cannot be found (and hence images are to be embedded).
+
+	"""
+
 	# if a file name was passed, either as a string or wrapped in a `Pathlib`,...
 	if isinstance(parameters, (str, pathlib.Path)):
 
@@ -70,9 +537,6 @@ def wrap(parameters: str, questions_file: str, local_run: bool, no_checks: bool,
 
 		# if a parameters file is NOT present...
 		if not parameters.exists():
-			
-			# ...images are embedded
-			embed_images = True
 
 			print(
 				f'"{parameters}"{colors.info} not found: embedding the images (`-e`). If you\'d like to host your images in a remote server you can download the sample parameters file{colors.reset} '
@@ -80,8 +544,7 @@ def wrap(parameters: str, questions_file: str, local_run: bool, no_checks: bool,
 				' and tweak it to your needs'
 				)
 
-			# it shouldn't be used anywhere, but just in case...
-			parameters = None
+			return None
 		
 		# if a parameters file IS present...
 		else:
@@ -97,45 +560,91 @@ def wrap(parameters: str, questions_file: str, local_run: bool, no_checks: bool,
 		# ...then it should be a dictionary
 		assert isinstance(parameters, dict), 'passed `parameters` is not a file nor a dictionary'
 
-	input_file = pathlib.Path(questions_file)
+	return parameters
 
-	# if the questions file doesn't exist...
-	if not input_file.exists():
 
-		raise SystemExit(
-			f'"{input_file}" {colors.error}cannot be found: you can download a sample from{colors.reset} '
-			r'https://raw.githubusercontent.com/manuvazquez/gift-wrapper/master/bank.yaml'
-			)
+def make_transforms(
+		parameters: dict | None, pictures_base_directory: str, history: dict, local_run: bool, no_checks: bool,
+		embed_images: bool, connection: remote.Connection | None = None, strict_checks: bool = False,
+		checks_sampling: float = 0., output_format: str = 'gift') -> tuple[list, list, remote.Connection | None]:
+	"""
+	Sets up the processing objects to be applied on every piece of text.
 
-	# ================================= questions' reading
+	Parameters
+	----------
+	parameters : dict or None
+		Parameters (irrelevant if images are embedded).
+	pictures_base_directory : str
+		Base directory for the images in the remote host.
+	history : dict
+		Files already compiled/transferred.
+	local_run : bool
+		If `True`, images are not copied over to a server
+	no_checks : bool
+		If `True`, LaTeX formulas are not checked
+	embed_images : bool
+		If `True`, images are embedded
+	connection : remote.Connection, optional
+		An already established connection to be reused (if still active).
+	strict_checks : bool
+		If `True`, every LaTeX formula is compiled
+	checks_sampling : float
+		Fraction of the LaTeX formulas that are compiled even if proven fine without compiling them
+	output_format : str
+		Either "gift" or "xml" (in the latter, images are attached to the questions and all the above about
+		hosting them is irrelevant)
+
+	Returns
+	-------
+	pre_transforms: list
+		Processing objects to be applied at the very beginning.
+	post_transforms: list
+		Processing objects to be applied at the end.
+	connection: remote.Connection, remote.FakeConnection or None
+		The connection used to copy the images (`None` if they are embedded).
 
-	# the file containing the questions is read
-	with open(input_file) as yaml_data:
+	"""
 
-		input_data = yaml.load(yaml_data, Loader=yaml.FullLoader)
+	# in Moodle XML...
+	if output_format == 'xml':
 
-	categories = input_data['categories']
-	pictures_base_directory = input_data['pictures base directory']
+		# ...images are attached...
+		pre_transforms = [transformer.TexToSvg(history), transformer.SvgToFile()]
 
-	# ================================= behavior
+		# ...and LaTeX commands are processed before formulas are adapted (they are not escaped as in GIFT)
+		post_transforms = [
+			gift.process_new_lines, transformer.LatexCommandsWithinText(), transformer.LatexFormulas(
+				not no_checks, strict_checks, checks_sampling, formatter=moodle_xml.from_latex_formula)]
 
-	# to keep track of files already compiled/transferred
-	history = {'already compiled': set(), 'already transferred': set()}
+		return pre_transforms, post_transforms, None
 
 	# lists of processing objects to be applied at the very beginning...
 	pre_transforms = [transformer.TexToSvg(history)]
 
 	# ...and at the end
 	post_transforms = [
-		gift.process_new_lines, transformer.LatexFormulas(not no_checks),
+		gift.process_new_lines, transformer.LatexFormulas(not no_checks, strict_checks, checks_sampling),
 		transformer.LatexCommandsWithinText()]
 
 	# if images are *not* to be embedded, and this is *not* a local run (i.e., if images are supposed to be hosted remotely)...
 	if (not embed_images) and (not local_run):
 
-		# an object to handle the connection with the requested host is instantiated
-		connection = remote.Connection(
-				parameters['images hosting']['copy']['host'], **parameters['images hosting']['ssh'])
+		# if no connection was passed or it was dropped...
+		if (connection is None) or (not connection.is_active()):
+
+			copy = parameters['images hosting']['copy']
+
+			# if the requested host is this very machine...
+			if copy.get('transport', 'ssh') == 'local':
+
+				# ...images are just placed in the local filesystem
+				connection = remote.LocalConnection(copy.get('host', 'localhost'), copy.get('link', 'hardlink'))
+
+			else:
+
+				# an object to handle the connection with the requested host is instantiated
+				connection = remote.Connection(
+						copy['host'], **parameters['images hosting']['ssh'], bulk=copy.get('bulk', False))
 
 		# an attempt is made...
 		try:
@@ -165,68 +674,341 @@ def wrap(parameters: str, questions_file: str, local_run: bool, no_checks: bool,
 		if local_run:
 
 			# ...a "fake" connection is instantiated
-			connection = remote.FakeConnection(parameters['images hosting']['copy']['host'])
+			connection = remote.FakeConnection(parameters['images hosting']['copy'].get('host', 'localhost'))
 
 		# an object to copy svg files to a remote location is added to the list of *pre* processors
 		pre_transforms.append(transformer.SvgToHttp(
 			history, connection, parameters['images hosting']['copy']['public filesystem root'],
-			pictures_base_directory, parameters['images hosting']['public URL']))
+			pictures_base_directory, parameters['images hosting']['public URL'],
+			parameters['images hosting']['copy'].get('content-addressed directory'),
+			parameters['images hosting']['copy'].get('precompressed', False)))
 
-	# output file has the same name as the input with the ".gift.txt" suffix
-	output_file = input_file.with_suffix('.gift.txt')
+	return pre_transforms, post_transforms, connection
 
-	# ================================= processing
 
-	with open(output_file, 'w') as f:
+def tex_compiler(pre_transforms: list) -> transformer.TexToSvg:
+	"""
+	Picks the processing object in charge of compiling TeX files (see `make_transforms`).
 
-		# for every category...
-		for cat in tqdm(categories, desc='category', leave=False):
+	Parameters
+	----------
+	pre_transforms: list
+		Processing objects to be applied at the very beginning.
 
-			# if "something" was actually provided...
-			if cat['name']:
+	Returns
+	-------
+	out: transformer.TexToSvg
+		The one compiling TeX files.
 
-				# ...if it's *not* a list...
-				if not isinstance(cat['name'], list):
+	"""
 
-					# ...it is turned into one
-					cat['name'] = [cat['name']]
+	return next(t for t in pre_transforms if isinstance(t, transformer.TexToSvg))
 
-				for c in cat['name']:
 
-					f.write(gift.from_category(c))
+def make_payload(
+		parameters: dict | None, pictures_base_directory: str, history: dict, local_run: bool, embed_images: bool,
+		output_format: str = 'gift', question_budget: int | None = None, bank_budget: int | None = None,
+		over_budget: str = 'fail') -> tuple[payload.Payload, remote.Connection | None]:
+	"""
+	Sets up the measuring of the size of every question (and the enforcement of the budgets).
 
-			# the names of *all* the questions
-			all_names = [q['name'] for q in cat['questions']]
+	Parameters
+	----------
+	parameters : dict or None
+		Parameters.
+	pictures_base_directory : str
+		Base directory for the images in the remote host.
+	history : dict
+		Files already compiled/transferred.
+	local_run : bool
+		If `True`, images are not copied over to a server
+	embed_images : bool
+		If `True`, images are embedded
+	output_format : str
+		Either "gift" or "xml" (Moodle XML).
+	question_budget : int, optional
+		Maximum size (in bytes) of a question in the output.
+	bank_budget : int, optional
+		Maximum size (in bytes) of all the questions together in the output.
+	over_budget : str
+		Either "fail" or "link" (images of a question over budget are linked rather than inlined until it fits).
+
+	Returns
+	-------
+	sizes: payload.Payload
+		Object measuring the questions.
+	connection: remote.Connection, remote.FakeConnection or None
+		The connection used to copy the images that are linked (if any).
 
-			# list with names that show up more than once
-			duplicates = [name for name, count in collections.Counter(all_names).items() if count > 1]
+	"""
 
-			# all the names should be different
-			assert not duplicates, f'{colors.error}duplicates in category {colors.reset}{cat["name"]}: {duplicates}'
+	link, connection = None, None
 
-			# for every question in the category...
-			for q in tqdm(cat['questions'], desc='question', leave=False):
+	if over_budget == 'link':
 
-				# user settings are tidied up (`q` is modified) to serve as `__init__` parameters for the returned
-				# class name...
-				class_name = question.user_settings_to_class_init(q)
+		# linking images requires hosting them...
+		if (output_format != 'gift') or (parameters is None):
 
-				# ...which should be available in the `question` module
-				question_class = getattr(question, class_name)
+			raise errors.BuildError(
+				'settings', 'over budget',
+				f'{colors.error}images can only be linked in GIFT, and with a parameters file (for hosting them)')
 
-				q = question_class(**q, pre_transforms=pre_transforms, post_transforms=post_transforms)
+		# ...and is only needed if they are inlined to begin with
+		if embed_images:
 
-				f.write(f'{q.gift}\n\n')
+			pre_transforms, _, connection = make_transforms(
+				parameters, pictures_base_directory, history, local_run, no_checks=True, embed_images=False)
 
-	print(f'{colors.info}file "{colors.reset}{output_file}{colors.info}" created')
+			# if a connection could be established...
+			if connection is not None:
 
-	# if images are *not* to be embedded, this is a "local" run (fake connection), and there are files to be copied...
-	if (not embed_images) and local_run and connection.files_to_copy:
+				svg_to_http = next(t for t in pre_transforms if isinstance(t, transformer.SvgToHttp))
 
-		print(f'{colors.info}you *should* copy:')
+				def link(file: str, images_settings: dict | None) -> str:
 
-		for source, remote_directory in connection.files_to_copy:
+					return transformer.URLs(images_settings)(svg_to_http(file))
 
-			print(
-				f'{source}{colors.info} to '
-				f'{colors.reset}{remote_directory}{colors.info} in {colors.reset}{connection.host}')
+	return payload.Payload(output_format, question_budget, bank_budget, link), connection
+
+
+def compile_figures(
+		categories: list, tex_to_svg: transformer.TexToSvg, jobs: int | None = None, keep_going: bool = False,
+		merge: bool = False):
+	"""
+	Compiles, in parallel, every TeX file referenced in the questions.
+
+	Parameters
+	----------
+	categories : list
+		Categories as read from the questions file.
+	tex_to_svg : transformer.TexToSvg
+		Transformer in charge of the compilation (which keeps track of the files already compiled).
+	jobs : int, optional
+		Number of TeX files compiled simultaneously (the number of processors by default).
+	keep_going : bool
+		If `True`, errors are ignored here (`tex_to_svg` keeps track of them, and they are raised again when the
+		corresponding question is processed).
+	merge : bool
+		If `True`, files with the same preamble (and directory) are compiled at once, as the pages of a single
+		document, falling back to compiling them one by one if that fails.
+
+	"""
+
+	# TeX files (without suffix) in the order they show up
+	files = list(dict.fromkeys(
+		f for text in parsing.strings_in(categories) for f in re.findall(parsing.tex_file_name, text)))
+
+	# if there is nothing to be done in parallel (nor merged)...
+	if ((jobs == 1) and not merge) or (len(files) < 2):
+
+		# ...files are compiled as they show up
+		return
+
+	groups = latex.group_by_preamble(files) if merge else [[f] for f in files]
+
+	executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+
+	# (pdf files can only be converted in parallel with PyMuPDF by means of separate processes)
+	with image.converting(jobs):
+
+		try:
+
+			# (every file is compiled within the context of the caller, e.g., regarding `sources.directory`)
+			futures = [
+				executor.submit(contextvars.copy_context().run, tex_to_svg.compile_merged, g) if len(g) > 1 else
+				executor.submit(contextvars.copy_context().run, tex_to_svg.compile, g[0])
+				for g in groups]
+
+			for future in tqdm(
+					concurrent.futures.as_completed(futures), desc='compiling', total=len(groups), leave=False):
+
+				# any error (`errors.BuildError`) is raised here...
+				try:
+
+					future.result()
+
+				except errors.BuildError:
+
+					# ...unless it is to be reported later on
+					if not keep_going:
+
+						raise
+
+		finally:
+
+			executor.shutdown(wait=False, cancel_futures=True)
+
+
+def write_categories(
+		categories: list, pre_transforms: list, post_transforms: list, f: io.TextIOBase,
+		report: errors.Report | None = None, checkpoints: journal.Journal | None = None, output_format: str = 'gift',
+		sizes: payload.Payload | None = None):
+	"""
+	Writes every category (along with its questions) in GIFT (or Moodle XML) format.
+
+	Parameters
+	----------
+	categories : list
+		Categories as read from the questions file.
+	pre_transforms: list
+		Processing objects to be applied at the very beginning.
+	post_transforms: list
+		Processing objects to be applied at the end.
+	f : file object
+		Output.
+	report : errors.Report, optional
+		If passed, errors are recorded in it (and the question skipped) rather than raised.
+	checkpoints : journal.Journal, optional
+		If passed, questions already rendered (in a previous run) are taken from it, and new ones recorded in it (every
+		question is identified by the position of its category and its name).
+	output_format : str
+		Either "gift" or "xml" (Moodle XML).
+	sizes : payload.Payload, optional
+		If passed, the size of every question is measured (and the budgets enforced).
+
+	"""
+
+	# text processed in a previous build might not be valid anymore (e.g., a TeX file was modified in the meantime)
+	question.transformed.cache_clear()
+
+	# ...and so might be the files attached in a previous build (which are registered anew as questions are rendered)
+	moodle_xml.attachments.clear()
+
+	if output_format == 'xml':
+
+		from_category, write = moodle_xml.from_category, moodle_xml.write
+
+		f.write(moodle_xml.header)
+
+	else:
+
+		# (embedded images are streamed right into the output)
+		from_category, write = gift.from_category, image.write
+
+	# for every category...
+	for i_category, cat in enumerate(tqdm(categories, desc='category', leave=False)):
+
+		# if "something" was actually provided...
+		if cat['name']:
+
+			# ...if it's *not* a list...
+			if not isinstance(cat['name'], list):
+
+				# ...it is turned into one
+				cat['name'] = [cat['name']]
+
+			for c in cat['name']:
+
+				f.write(from_category(c))
+
+		# for the sake of error reports
+		category = '/'.join(str(c) for c in cat['name']) if cat['name'] else None
+
+		# the names of *all* the questions
+		all_names = [q['name'] for q in cat['questions']]
+
+		# list with names that show up more than once
+		duplicates = [name for name, count in collections.Counter(all_names).items() if count > 1]
+
+		# all the names should be different
+		if duplicates:
+
+			error = errors.BuildError(
+				'settings', category, f'{colors.error}duplicates in category {colors.reset}{cat["name"]}: {duplicates}')
+
+			if report is None:
+
+				raise error
+
+			report.add(error, category)
+
+		# questions can only be recorded if they can be told apart by their names
+		category_checkpoints = None if duplicates else checkpoints
+
+		# for every question in the category...
+		for q in tqdm(cat['questions'], desc='question', leave=False):
+
+			try:
+
+				# if the question was already rendered in a previous run, it is simply reused...
+				# (categories are told apart by their position, since several might have the same name, or none)
+				if (not category_checkpoints) or (
+						(text := category_checkpoints.rendered(i_category, q.get('name'))) is None):
+
+					# ...and otherwise it is rendered
+					text = render_question(q, pre_transforms, post_transforms, output_format)
+
+					if category_checkpoints:
+
+						category_checkpoints.record_question(i_category, q.get('name'), text)
+
+				# (images in a question over budget might be linked rather than inlined)
+				if sizes is not None:
+
+					text = sizes.fit(text, category, q.get('name'), q.get('images_settings'))
+
+			except (errors.BuildError, AssertionError) as e:
+
+				if report is None:
+
+					raise
+
+				report.add(e, category, q.get('name'))
+
+				continue
+
+			write(f'{text}\n\n', f)
+
+	if output_format == 'xml':
+
+		f.write(moodle_xml.footer)
+
+
+def render_question(settings: dict, pre_transforms: list, post_transforms: list, output_format: str = 'gift') -> str:
+	"""
+	Builds a question in GIFT (or Moodle XML) format.
+
+	Parameters
+	----------
+	settings : dict
+		User settings for the question.
+	pre_transforms: list
+		Processing objects to be applied at the very beginning.
+	post_transforms: list
+		Processing objects to be applied at the end.
+	output_format : str
+		Either "gift" or "xml" (Moodle XML).
+
+	Returns
+	-------
+	out: str
+		GIFT-ready text (or Moodle XML).
+
+	"""
+
+	# user settings are tidied up (a copy so that the original is not modified) to serve as `__init__` parameters
+	# for the returned class name...
+	settings = dict(settings)
+	class_name = question.user_settings_to_class_init(settings)
+
+	# ...which should be available in the `question` module
+	question_class = getattr(question, class_name, None)
+
+	if not (isinstance(question_class, type) and issubclass(question_class, question.HtmlQuestion)):
+
+		raise errors.BuildError(
+			'settings', class_name, f'{colors.error}unknown class of question {colors.reset}{class_name}')
+
+	q = question_class(**settings, pre_transforms=pre_transforms, post_transforms=post_transforms)
+
+	if output_format == 'gift':
+
+		return q.gift
+
+	try:
+
+		return q.xml
+
+	except NotImplementedError as e:
+
+		raise errors.BuildError('settings', class_name, f'{colors.error}{e}') from e
@@ -0,0 +1,104 @@
+from . import colors
+
+
+class BuildError(SystemExit):
+	"""
+	Raised when something goes wrong while building a bank. Unless caught (as in "keep going" mode), it ends the
+	program just like `sys.exit` would do, printing the message.
+	"""
+
+	def __init__(self, kind: str, subject: str, message: str) -> None:
+		"""
+		Initializer.
+
+		Parameters
+		----------
+		kind : str
+			Kind of error (e.g., "compilation" or "formula").
+		subject : str
+			What the error is about (e.g., a file or a formula).
+		message : str
+			Human-readable (colored) explanation.
+		"""
+
+		# the first character is not visible due to tqdm
+		super().__init__('\n' + message)
+
+		self.kind = kind
+		self.subject = subject
+		self.message = message
+
+	def __reduce__(self):
+
+		# so that it can be passed between processes
+		return type(self), (self.kind, self.subject, self.message)
+
+
+class Report:
+	"""
+	Errors collected (rather than raised) while building a bank.
+	"""
+
+	def __init__(self) -> None:
+
+		# every error along with the category (of questions) and question in which it happened
+		self.errors = []
+
+	def __bool__(self) -> bool:
+
+		return bool(self.errors)
+
+	def __len__(self) -> int:
+
+		return len(self.errors)
+
+	def add(self, error: Exception, category: str | None = None, question: str | None = None):
+		"""
+		Records an error.
+
+		Parameters
+		----------
+		error : BuildError or AssertionError
+			Error (an `AssertionError` stems from wrong settings).
+		category : str, optional
+			Category of questions.
+		question : str, optional
+			Name of the question.
+
+		"""
+
+		if not isinstance(error, BuildError):
+
+			error = BuildError('settings', question, str(error))
+
+		self.errors.append((error, category, question))
+
+	def print(self):
+
+		print(f'\n{colors.error}{len(self.errors)} error(s) found:')
+
+		# errors are grouped by category and then by question (in the order in which they showed up)
+		categories = {}
+
+		for error, category, question in self.errors:
+
+			categories.setdefault(category, {}).setdefault(question, []).append(error)
+
+		for category, questions in categories.items():
+
+			print(f'\n{colors.info}{"(no category)" if category is None else category}:')
+
+			for question, errors in questions.items():
+
+				# (errors not related to any question in particular, e.g., duplicated names, are not nested)
+				indent = ' '
+
+				if question is not None:
+
+					print(f' {colors.extra_info}{question}{colors.reset}:')
+
+					indent = '  '
+
+				for error in errors:
+
+					print(f'{indent}{colors.info}[{error.kind}]{colors.reset} {error.message.strip()}')
@@ -0,0 +1,443 @@
+import re
+import zlib
+
+# a command (e.g., "\frac"), an escaped character (e.g., "\{"), whitespace, or any other character
+re_token = re.compile(r'\\[a-zA-Z]+|\\.|\s+|.', re.DOTALL)
+
+# commands known to be fine (at least with `latex.latex_template`) along with their number of (mandatory) arguments;
+# these include every command in the "Latex support" section of the README
+commands = {
+	# greek letters
+	**{letter: 0 for letter in [
+		'alpha', 'beta', 'gamma', 'delta', 'epsilon', 'varepsilon', 'zeta', 'eta', 'theta', 'vartheta', 'iota', 'kappa',
+		'lambda', 'mu', 'nu', 'xi', 'pi', 'varpi', 'rho', 'varrho', 'sigma', 'varsigma', 'tau', 'upsilon', 'phi',
+		'varphi', 'chi', 'psi', 'omega', 'Gamma', 'Delta', 'Theta', 'Lambda', 'Xi', 'Pi', 'Sigma', 'Upsilon', 'Phi',
+		'Psi', 'Omega']},
+	# symbols
+	**{symbol: 0 for symbol in [
+		'sim', 'approx', 'simeq', 'cong', 'equiv', 'propto', 'neq', 'ne', 'leq', 'le', 'geq', 'ge', 'll', 'gg', 'pm',
+		'mp', 'times', 'cdot', 'div', 'ast', 'star', 'circ', 'bullet', 'oplus', 'otimes', 'infty', 'partial', 'nabla',
+		'in', 'notin', 'ni', 'subset', 'subseteq', 'supset', 'supseteq', 'cup', 'cap', 'setminus', 'emptyset',
+		'forall', 'exists', 'neg', 'wedge', 'vee', 'to', 'rightarrow', 'leftarrow', 'leftrightarrow', 'Rightarrow',
+		'Leftarrow', 'Leftrightarrow', 'mapsto', 'implies', 'iff', 'mid', 'parallel', 'perp', 'angle', 'prime',
+		'ldots', 'cdots', 'vdots', 'ddots', 'dots', 'quad', 'qquad', 'top', 'hbar', 'ell', 'Re', 'Im', 'langle',
+		'rangle', 'lfloor', 'rfloor', 'lceil', 'rceil', 'vert', 'Vert']},
+	# large operators and functions
+	**{operator: 0 for operator in [
+		'sum', 'prod', 'int', 'iint', 'oint', 'lim', 'limsup', 'liminf', 'max', 'min', 'sup', 'inf', 'arg', 'det',
+		'log', 'ln', 'exp', 'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'sinh', 'cosh', 'tanh', 'deg', 'dim',
+		'gcd', 'Pr']},
+	# fonts (the first ones are *declarations* affecting what follows)
+	'cal': 0, 'rm': 0, 'bf': 0, 'it': 0,
+	**{font: 1 for font in ['mathcal', 'mathbf', 'mathrm', 'mathit', 'mathbb', 'mathsf', 'boldsymbol']},
+	# accents and decorations
+	**{accent: 1 for accent in [
+		'underline', 'overline', 'hat', 'widehat', 'bar', 'tilde', 'widetilde', 'vec', 'dot', 'ddot', 'check',
+		'overbrace', 'underbrace']},
+	'frac': 2, 'dfrac': 2, 'tfrac': 2, 'binom': 2, 'sqrt': 1,
+}
+
+# commands whose argument is text rather than a formula
+text_commands = {'text', 'textit', 'textbf', 'textrm', 'mbox'}
+
+# commands that can only follow a large operator...
+limits_commands = {'limits', 'nolimits'}
+
+# ...which is one of these
+large_operators = {'sum', 'prod', 'int', 'iint', 'oint', 'lim', 'limsup', 'liminf', 'max', 'min', 'sup', 'inf'}
+
+# commands (and characters) that can follow `\left`, `\middle` and `\right`
+delimiters = {
+	'(', ')', '[', ']', '<', '>', '|', '.', '/', r'\{', r'\}', r'\|', r'\langle', r'\rangle', r'\lfloor', r'\rfloor',
+	r'\lceil', r'\rceil', r'\vert', r'\Vert'}
+
+# escaped characters known to be fine
+escaped_characters = {r'\{', r'\}', r'\,', r'\;', r'\:', r'\!', r'\ ', r'\|', r'\%', r'\#', r'\&', r'\_', r'\$'}
+
+# characters known to be fine in a formula
+characters = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789+-=<>()[]|/,.;:!?*~\'')
+
+# environments known to be fine, in which "&" and "\\" are allowed
+environments = {
+	'bmatrix', 'pmatrix', 'vmatrix', 'Vmatrix', 'Bmatrix', 'matrix', 'smallmatrix', 'cases', 'aligned', 'gathered',
+	'split'}
+
+
+class Malformed(Exception):
+	"Raised when a formula cannot be compiled for sure"
+
+	def __init__(self, reason: str) -> None:
+
+		self.reason = reason
+
+	def __str__(self) -> str:
+
+		return self.reason
+
+
+class Undecided(Exception):
+	"Raised when a formula cannot be proven fine (nor malformed)"
+
+
+class Parser:
+	"""
+	Recursive descent parser for (a subset of) LaTeX formulas.
+	"""
+
+	def __init__(self, formula: str) -> None:
+
+		self.tokens = [t for t in re_token.findall(formula) if not t.isspace()]
+
+		# position of the next token
+		self.position = 0
+
+	def peek(self) -> str | None:
+
+		return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+	def next(self) -> str | None:
+
+		token = self.peek()
+
+		self.position += 1
+
+		return token
+
+	def parse(self):
+
+		self.sequence(closing=None, alignment=False)
+
+	def sequence(self, closing: str | None, alignment: bool):
+		"""
+		Parses tokens until `closing` is found.
+
+		Parameters
+		----------
+		closing : str or None
+			Token closing the sequence (`None` for the end of the formula).
+		alignment : bool
+			Whether alignment characters ("&" and "\\") are allowed.
+
+		"""
+
+		# the scripts (super and subscript) already attached to the last atom
+		scripts = set()
+
+		# the previous token
+		previous = None
+
+		while True:
+
+			token = self.next()
+
+			if token is None:
+
+				if closing is None:
+
+					return
+
+				raise Malformed(f'missing "{closing}"')
+
+			if token == closing:
+
+				return
+
+			if token in ('^', '_'):
+
+				if token in scripts:
+
+					raise Malformed(f'double {"super" if token == "^" else "sub"}script')
+
+				self.argument()
+
+				scripts.add(token)
+
+				continue
+
+			# a prime after a superscript is a double superscript
+			if (token == "'") and ('^' in scripts):
+
+				raise Malformed('double superscript')
+
+			scripts = set()
+
+			if token == '{':
+
+				self.sequence('}', alignment=False)
+
+			elif token in ('}', r'\right', r'\end'):
+
+				raise Malformed(f'unexpected "{token}"')
+
+			elif token == '&':
+
+				if not alignment:
+
+					raise Malformed('misplaced "&"')
+
+			elif token == '\\\\':
+
+				# outside an environment, it might still be fine
+				if not alignment:
+
+					raise Undecided
+
+			elif token in ('$', '#'):
+
+				raise Malformed(f'"{token}" not allowed in a formula')
+
+			elif token == r'\left':
+
+				self.delimiter(token)
+				self.sequence(r'\right', alignment=False)
+				self.delimiter(r'\right')
+
+			elif token == r'\middle':
+
+				# only meaningful right inside `\left`...`\right`
+				if closing != r'\right':
+
+					raise Undecided
+
+				self.delimiter(token)
+
+			elif token == r'\begin':
+
+				name = self.environment_name()
+
+				if name not in environments:
+
+					raise Undecided
+
+				self.sequence(r'\end', alignment=True)
+
+				if self.environment_name() != name:
+
+					raise Malformed(f'"\\begin{{{name}}}" ended by another environment')
+
+			elif token[1:] in limits_commands:
+
+				if (previous is None) or (previous[1:] not in large_operators):
+
+					raise Undecided
+
+			elif token.startswith('\\'):
+
+				self.command(token)
+
+			elif token not in characters:
+
+				raise Undecided
+
+			previous = token
+
+	def command(self, token: str):
+
+		# an escaped character
+		if len(token) == 2 and (not token[1].isalpha()):
+
+			if token not in escaped_characters:
+
+				raise Undecided
+
+			return
+
+		name = token[1:]
+
+		if name in text_commands:
+
+			self.text()
+
+		elif name in commands:
+
+			# optional argument of a square root
+			if (name == 'sqrt') and (self.peek() == '['):
+
+				self.next()
+
+				self.sequence(']', alignment=False)
+
+			for _ in range(commands[name]):
+
+				self.argument()
+
+		else:
+
+			raise Undecided
+
+	def argument(self):
+
+		token = self.next()
+
+		if token is None:
+
+			raise Malformed('missing argument')
+
+		if token == '{':
+
+			self.sequence('}', alignment=False)
+
+		elif token in ('}', '&', '^', '_', '$', '#'):
+
+			raise Malformed(f'missing argument before "{token}"')
+
+		elif token in (r'\left', r'\right', r'\begin', r'\end', r'\middle', '\\\\'):
+
+			raise Undecided
+
+		elif token.startswith('\\'):
+
+			self.command(token)
+
+		elif token not in characters:
+
+			raise Undecided
+
+	def text(self):
+
+		if self.next() != '{':
+
+			raise Undecided
+
+		depth = 1
+
+		while depth:
+
+			token = self.next()
+
+			if token is None:
+
+				raise Malformed('missing "}"')
+
+			if token == '{':
+
+				depth += 1
+
+			elif token == '}':
+
+				depth -= 1
+
+			# anything but plain text is not analyzed
+			elif not (token.isalnum() or token in characters or token in escaped_characters):
+
+				raise Undecided
+
+	def delimiter(self, command: str):
+
+		token = self.next()
+
+		if token is None:
+
+			raise Malformed(f'missing delimiter after "{command}"')
+
+		# (other commands might still be fine)
+		if token.startswith('\\') and (token not in delimiters):
+
+			raise Undecided
+
+		if token not in delimiters:
+
+			raise Malformed(f'"{token}" is not a valid delimiter after "{command}"')
+
+	def environment_name(self) -> str:
+
+		name = ''
+
+		if self.next() != '{':
+
+			raise Malformed('missing environment name')
+
+		while (token := self.next()) != '}':
+
+			if token is None:
+
+				raise Malformed('missing "}" in environment name')
+
+			name += token
+
+		return name
+
+
+def check(formula: str) -> bool | None:
+	"""
+	Checks (without actually compiling it) whether a LaTeX formula can be compiled.
+
+	Parameters
+	----------
+	formula : str
+		Latex formula.
+
+	Returns
+	-------
+	out: bool or None
+		`True` if the formula can be compiled for sure, `False` if it cannot, or `None` if this cannot be decided
+		(e.g., because an unknown command is used).
+
+	"""
+
+	try:
+
+		Parser(formula).parse()
+
+	except Malformed:
+
+		return False
+
+	except Undecided:
+
+		return None
+
+	return True
+
+
+def problem(formula: str) -> str | None:
+	"""
+	Explains why a LaTeX formula cannot be compiled.
+
+	Parameters
+	----------
+	formula : str
+		Latex formula.
+
+	Returns
+	-------
+	out: str or None
+		The reason why the formula cannot be compiled for sure, or `None` if there is no such reason.
+
+	"""
+
+	try:
+
+		Parser(formula).parse()
+
+	except Malformed as e:
+
+		return e.reason
+
+	except Undecided:
+
+		pass
+
+	return None
+
+
+def sampled(formula: str, rate: float) -> bool:
+	"""
+	Decides (deterministically) whether a formula is among those to be compiled anyway.
+
+	Parameters
+	----------
+	formula : str
+		Latex formula.
+	rate : float
+		Fraction (between 0 and 1) of formulas to be compiled.
+
+	Returns
+	-------
+	out: bool
+		`True` if the formula is to be compiled.
+
+	"""
+
+	# the same formula is always (not) sampled
+	return zlib.crc32(formula.encode()) < rate * 2**32
@@ -3,10 +3,13 @@ from . import latex
 
 class NotCompliantLatexFormula(Exception):
 
-	def __init__(self, formula: str) -> None:
+	def __init__(self, formula: str, reason: str | None = None) -> None:
 
 		self.formula = formula
 
+		# if known
+		self.reason = reason
+
 	def __str__(self) -> str:
 
 		return self.formula
@@ -34,7 +37,7 @@ def from_question_name(name: str) -> str:
 	return f'::{name}::'
 
 
-def from_image_url(url: str, width: int, height: int) -> str:
+def from_image_url(url: str, width: int, height: int, escape: bool = True) -> str:
 	"""
 	Generates GIFT text for a URL.
 
@@ -46,6 +49,8 @@ def from_image_url(url: str, width: int, height: int) -> str:
 		Desired width of the image.
 	height : int
 		Desired height of the image.
+	escape : bool
+		Whether characters that are special in GIFT are escaped (not needed, e.g., in Moodle XML).
 
 	Returns
 	-------
@@ -69,6 +74,10 @@ def from_image_url(url: str, width: int, height: int) -> str:
 
 	res = f'<img src="{url}" alt="" role="presentation" class="atto_image_button_text-bottom"{width_height}>'
 
+	if not escape:
+
+		return res
+
 	for to_be_escaped in [':', '~', '=']:
 
 		res = res.replace(to_be_escaped, '\\' + to_be_escaped)
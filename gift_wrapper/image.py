@@ -1,15 +1,52 @@
-import sys
+import io
+import os
+import mmap
+import uuid
+import gzip
+import codecs
+import hashlib
+import functools
 import pathlib
 import shutil
+import threading
 import subprocess
-import uuid
+import contextlib
+import multiprocessing
+import concurrent.futures
+
+# in-process conversion from pdf to svg (rather than calling `pdf2svg`) is only available if PyMuPDF is installed
+try:
+
+	import pymupdf
 
+except ImportError:
+
+	pymupdf = None
+
+from . import cache
 from . import colors
+from . import errors
 from . import latex
 from . import parsing
+from . import sources
+from . import workspace
+
+# characters that must be escaped in an embedded svg
+svg_escaping_table = str.maketrans({c: '\\' + c for c in [':', '~', '=', '#', '{', '}']})
 
+# (maximum) size of the pieces in which an svg is read
+svg_chunk_size = 2**16
 
-def tex_to_pdf(source_file: str | pathlib.Path, timeout: int = 10) -> pathlib.Path:
+# PyMuPDF (if available) is not thread-safe, and hence only one thread at a time uses it in this process...
+pymupdf_lock = threading.Lock()
+
+# ...while others can hand their files over to these worker processes (see `converting`)
+converters = None
+
+
+def tex_to_pdf(
+		source_file: str | pathlib.Path, timeout: int = 10,
+		output_directory: str | pathlib.Path | None = None) -> pathlib.Path:
 	"""
 	Turns a TeX file into a pdf.
 
@@ -19,6 +56,8 @@ def tex_to_pdf(source_file: str | pathlib.Path, timeout: int = 10) -> pathlib.Pa
 		TeX file.
 	timeout: int
 		Seconds that are given to compile the source.
+	output_directory: str or pathlib.Path, optional
+		Directory for the pdf and auxiliary files (the directory of the source by default).
 
 	Returns
 	-------
@@ -31,42 +70,145 @@ def tex_to_pdf(source_file: str | pathlib.Path, timeout: int = 10) -> pathlib.Pa
 
 	if not source_file.exists():
 
-		# first character is not visible due to tqdm
-		print(f'\n{source_file} {colors.error}does not exist')
-
-		sys.exit(1)
+		raise errors.BuildError('missing file', source_file.as_posix(), f'{source_file} {colors.error}does not exist')
 
 	try:
 
-		exit_status = latex.compile_tex(source_file, timeout=timeout)
+		exit_status = latex.compile_tex(source_file, timeout=timeout, output_directory=output_directory)
 
 	except subprocess.TimeoutExpired:
 
-		print(
+		raise errors.BuildError(
+			'compilation', source_file.as_posix(),
 			f'{colors.error}could not compile {colors.reset}{source_file}'
-			f' {colors.error}in {colors.reset}{timeout}{colors.error} seconds'
-		)
-
-		sys.exit(1)
+			f' {colors.error}in {colors.reset}{timeout}{colors.error} seconds')
 
 	if exit_status != 0:
 
-		# first character is not visible due to tqdm
-		print(f'\n{colors.error}errors were found while compiling {colors.reset}{source_file}')
+		raise errors.BuildError(
+			'compilation', source_file.as_posix(),
+			f'{colors.error}errors were found while compiling {colors.reset}{source_file}')
+
+	if output_directory is not None:
 
-		sys.exit(1)
+		return pathlib.Path(output_directory) / source_file.with_suffix('.pdf').name
 
 	return source_file.with_suffix('.pdf')
 
 
-def pdf_to_svg(input_file: str | pathlib.Path) -> pathlib.Path:
+def merged_tex_to_pdf(
+		source_files: list[str | pathlib.Path], output_directory: str | pathlib.Path, timeout: int = 10) -> pathlib.Path:
+	"""
+	Turns several TeX (standalone) files sharing the same preamble and directory into a single pdf, with one page per
+	file, in a single compilation.
+
+	Parameters
+	----------
+	source_files : list
+		TeX files.
+	output_directory: str or pathlib.Path
+		Directory for the merged source, the pdf and auxiliary files.
+	timeout: int
+		Seconds that are given to compile *every* source.
+
+	Returns
+	-------
+	out: pathlib.Path
+		The path to the compiled pdf (page `i` comes from the `i`-th file).
+
+	"""
+
+	source_files = [pathlib.Path(f).with_suffix('.tex') for f in source_files]
+
+	documents = [latex.split_standalone(f.read_text()) for f in source_files]
+
+	if any(d is None for d in documents):
+
+		raise errors.BuildError(
+			'compilation', source_files[documents.index(None)].as_posix(),
+			f'{colors.error}only standalone documents can be merged')
+
+	if len({latex.preamble_key(d[0]) for d in documents}) > 1:
+
+		raise errors.BuildError(
+			'compilation', source_files[0].parent.as_posix(),
+			f'{colors.error}only documents with the same preamble can be merged')
+
+	merged_file = pathlib.Path(output_directory) / 'merged.tex'
+
+	merged_file.write_text(
+		latex.merge_standalone(documents[0][0], [d[1] for d in documents], source_files[0].parent))
+
+	pdf = tex_to_pdf(merged_file, timeout=timeout * len(source_files), output_directory=output_directory)
+
+	# if, e.g., some file produces several pages, they cannot be told apart
+	if (n_pages := latex.pages_in_log(merged_file.with_suffix('.log'))) != len(source_files):
+
+		raise errors.BuildError(
+			'compilation', merged_file.as_posix(),
+			f'{colors.error}merging {colors.reset}{len(source_files)}{colors.error} TeX files yielded '
+			f'{colors.reset}{n_pages}{colors.error} pages')
+
+	return pdf
+
+
+@contextlib.contextmanager
+def converting(jobs: int | None = None):
+	"""
+	Lets pdf files be converted with PyMuPDF from several threads at once within a context, by means of worker
+	processes (see `pdf_to_svg_in_process`).
+
+	Parameters
+	----------
+	jobs : int, optional
+		Number of worker processes (the number of processors by default).
+
+	"""
+
+	global converters
+
+	# (if they are already there, e.g., for another bank being built at the same time, they are simply shared)
+	if (pymupdf is None) or (jobs == 1) or (converters is not None):
+
+		yield
+
+		return
+
+	# (workers are spawned rather than forked, since other threads are running)
+	converters = concurrent.futures.ProcessPoolExecutor(
+		max_workers=jobs, mp_context=multiprocessing.get_context('spawn'))
+
+	try:
+
+		yield
+
+	finally:
+
+		executor, converters = converters, None
+
+		executor.shutdown()
+
+
+@functools.cache
+def path_to_pdf2svg() -> str | None:
+
+	# (looked up only once)
+	return shutil.which('pdf2svg')
+
+
+def pdf_to_svg(
+		input_file: str | pathlib.Path, output_file: str | pathlib.Path | None = None, page: int = 1) -> pathlib.Path:
 	"""
-	Converts a pdf file into an svg.
+	Converts a pdf file into an svg, in-process (with PyMuPDF) if possible, or with `pdf2svg` otherwise.
 
 	Parameters
 	----------
 	input_file : str or pathlib.Path
 		pdf file.
+	output_file : str or pathlib.Path, optional
+		svg file (by default, same as the input but with the ".svg" suffix).
+	page : int
+		The page (starting at 1) to be converted.
 
 	Returns
 	-------
@@ -76,52 +218,323 @@ def pdf_to_svg(input_file: str | pathlib.Path) -> pathlib.Path:
 	"""
 
 	input_file = pathlib.Path(input_file)
-	output_file = input_file.with_suffix('.svg')
 
-	path_to_pdf2svg = shutil.which('pdf2svg')
+	if output_file is None:
+
+		output_file = input_file.with_suffix('.svg')
+
+	else:
+
+		output_file = pathlib.Path(output_file)
+
+	if pymupdf is not None:
+
+		pdf_to_svg_in_process(input_file, output_file, page)
 
-	if path_to_pdf2svg is None:
+		return output_file
 
-		# first character is not visible due to tqdm
-		print(f"\n{colors.error}couldn't find pdf2svg")
+	# (`pdf2svg` is run in the directory of the input file)
+	output_path = output_file.resolve().as_posix()
 
-		sys.exit(1)
+	if path_to_pdf2svg() is None:
 
-	command = [path_to_pdf2svg, input_file.name, output_file.name]
+		raise errors.BuildError('missing tool', 'pdf2svg', f"{colors.error}couldn't find pdf2svg")
+
+	command = [path_to_pdf2svg(), input_file.name, output_path, str(page)]
 
 	run_summary = subprocess.run(command, capture_output=True, cwd=input_file.parent)
 
-	assert run_summary.returncode == 0,\
-		f"{colors.error}could not convert {colors.reset}{input_file}{colors.error} to svg"
+	if run_summary.returncode != 0:
+
+		raise errors.BuildError(
+			'conversion', input_file.as_posix(),
+			f"{colors.error}could not convert {colors.reset}{input_file}{colors.error} to svg")
 
 	return output_file
 
 
+def pdf_to_svg_in_process(input_file: pathlib.Path, output_file: pathlib.Path, page: int = 1):
+	"""
+	Converts a pdf file into an svg with PyMuPDF. Since PyMuPDF is not thread-safe, the conversion is only done in
+	this process if no other thread is doing one, and otherwise in a worker process if there are any (see
+	`converting`), so that files compiled in parallel are also converted in parallel.
+
+	Parameters
+	----------
+	input_file : pathlib.Path
+		pdf file.
+	output_file : pathlib.Path
+		svg file.
+	page : int
+		The page (starting at 1) to be converted.
+
+	"""
+
+	# if another thread is already using PyMuPDF...
+	if not pymupdf_lock.acquire(blocking=False):
+
+		# ...the conversion is done in a worker process (in which the lock is always free)...
+		if (executor := converters) is not None:
+
+			try:
+
+				executor.submit(pdf_to_svg_in_process, input_file, output_file, page).result()
+
+				return
+
+			# (the workers were shut down in the meantime, or broke)
+			except RuntimeError:
+
+				pass
+
+		# ...or, failing that, once the other thread is done
+		pymupdf_lock.acquire()
+
+	try:
+
+		with pymupdf.open(input_file) as document:
+
+			if not (1 <= page <= document.page_count):
+
+				raise errors.BuildError(
+					'conversion', input_file.as_posix(),
+					f"{colors.error}there is no page {colors.reset}{page}{colors.error} in {colors.reset}{input_file}")
+
+			# text is turned into paths (as `pdf2svg` does) so that the svg does not depend on any font
+			svg = document[page - 1].get_svg_image(text_as_path=True)
+
+	except (RuntimeError, ValueError) as e:
+
+		raise errors.BuildError(
+			'conversion', input_file.as_posix(),
+			f"{colors.error}could not convert {colors.reset}{input_file}{colors.error} to svg ({e})") from e
+
+	finally:
+
+		pymupdf_lock.release()
+
+	output_file.write_text(svg, encoding='utf-8')
+
+
+def content_name(input_file: str | pathlib.Path) -> str:
+	"""
+	Builds a file name from the content of a file.
+
+	Parameters
+	----------
+	input_file : str or pathlib.Path
+		File.
+
+	Returns
+	-------
+	out: str
+		The (SHA-256) hash of the content of the file along with its suffix.
+
+	"""
+
+	input_file = pathlib.Path(input_file)
+
+	digest = hashlib.sha256()
+
+	with open(input_file, 'rb') as f:
+
+		# the file is read in chunks
+		for chunk in iter(lambda: f.read(2**16), b''):
+
+			digest.update(chunk)
+
+	return digest.hexdigest() + input_file.suffix
+
+
+def compressed(input_file: str | pathlib.Path, name: str | None = None) -> pathlib.Path:
+	"""
+	Compresses (gzip) a file, unless a file with the same content has already been compressed.
+
+	Parameters
+	----------
+	input_file : str or pathlib.Path
+		File.
+	name : str, optional
+		The name of the file after its content (see `content_name`), if already known.
+
+	Returns
+	-------
+	out: pathlib.Path
+		The compressed file (in the cache).
+
+	"""
+
+	key = (name or content_name(input_file)) + '.gz'
+
+	if (output_file := cache.lookup('compressed', key)) is not None:
+
+		return output_file
+
+	with workspace.get().job() as directory:
+
+		# `mtime` is fixed so that the same content always yields the same compressed file
+		with open(input_file, 'rb') as f, gzip.GzipFile(directory / key, 'wb', compresslevel=9, mtime=0) as g:
+
+			shutil.copyfileobj(f, g)
+
+		return cache.store(directory / key, 'compressed', key)
+
+
 def svg_to_html(input_file: str | pathlib.Path) -> str:
 	"""
+	Turns an svg file into GIFT-ready html (prefer `write_svg_as_html` for large files).
+
+	Parameters
+	----------
+	input_file : str or pathlib.Path
+		svg file.
+
+	Returns
+	-------
+	out: str
+		GIFT-ready html.
+
+	"""
+
+	res = io.StringIO()
+
+	write_svg_as_html(input_file, res)
+
+	return res.getvalue()
+
+
+def write_svg_as_html(input_file: str | pathlib.Path, f: io.TextIOBase) -> int:
+	"""
+	Writes an svg file as GIFT-ready html. The file is (memory-mapped and) processed piece by piece, and hence it is
+	never loaded in memory as a whole.
 
 	Parameters
 	----------
 	input_file : str or pathlib.Path
 		svg file.
+	f : file object
+		Output.
 
 	Returns
 	-------
+	out: int
+		The number of characters written.
 
 	"""
 
-	# input file is read
-	with open(input_file) as f:
+	written = f.write(r'<body>' + '\n')
+
+	with open(input_file, 'rb') as svg:
+
+		# an empty file cannot be memory-mapped
+		if os.fstat(svg.fileno()).st_size == 0:
+
+			return written + f.write(r'</body>')
+
+		with mmap.mmap(svg.fileno(), 0, access=mmap.ACCESS_READ) as content:
+
+			# since all the svg's are going to be put together, a unique "uuid" is prepended to every id in the file
+			ids = dict.fromkeys(m.group(1) for m in parsing.re_svg_id.finditer(content))
 
-		file_content = f.read()
+			prefix = f'{uuid.uuid1()}-'.encode()
 
-	# since all the svg's are going to be put together, a unique "uuid" is appended to every id in the file
-	for svg_id in parsing.re_svg_id.findall(file_content):
+			decoder = codecs.getincrementaldecoder('utf-8')()
 
-		file_content = file_content.replace(svg_id, f'{uuid.uuid1()}-{svg_id}')
+			def write_piece(start: int, end: int) -> int:
+
+				res = 0
+
+				# the piece is further split into chunks of bounded size
+				for chunk_start in range(start, end, svg_chunk_size):
+
+					res += f.write(decoder.decode(content[chunk_start:min(chunk_start + svg_chunk_size, end)]).translate(
+						svg_escaping_table))
+
+				return res
+
+			# the end of the last reference to an id
+			position = 0
+
+			# every reference to an id, either in its definition or when used
+			for m in parsing.re_svg_id_reference.finditer(content):
+
+				if m.group(2) in ids:
+
+					written += write_piece(position, m.start(2))
+					written += f.write((prefix + m.group(2)).decode())
+
+					position = m.end()
+
+			written += write_piece(position, len(content))
+
+	return written + f.write(r'</body>')
+
+
+def inline_svg_marker(input_file: str | pathlib.Path) -> str:
+	"""
+	Returns a placeholder for an svg file to be embedded when writing the output (see `write`).
+
+	Parameters
+	----------
+	input_file : str or pathlib.Path
+		svg file.
+
+	Returns
+	-------
+	out: str
+		Placeholder.
+
+	"""
+
+	return f'\x00svg:{pathlib.Path(input_file).as_posix()}\x00'
+
+
+def write(text: str, f: io.TextIOBase) -> int:
+	"""
+	Writes text, embedding (streaming) the svg files referred to by placeholders (see `inline_svg_marker`).
+
+	Parameters
+	----------
+	text : str
+		Input text.
+	f : file object
+		Output.
+
+	Returns
+	-------
+	out: int
+		The number of characters written.
+
+	"""
+
+	written = 0
+
+	# text (even positions) and svg files (odd positions)
+	for i, piece in enumerate(parsing.re_inline_svg_marker.split(text)):
+
+		written += write_svg_as_html(sources.path(piece), f) if i % 2 else f.write(piece)
+
+	return written
+
+
+def resolve(text: str) -> str:
+	"""
+	Replaces the placeholders in some text with the svg files they refer to (see `write`), in memory.
+
+	Parameters
+	----------
+	text : str
+		Input text (e.g., a question as returned by `question.HtmlQuestion.gift`).
+
+	Returns
+	-------
+	out: str
+		Text with every svg file embedded.
+
+	"""
 
-	for to_be_escaped in [':', '~', '=', '#', '{', '}']:
+	output = io.StringIO()
 
-		file_content = file_content.replace(to_be_escaped, '\\' + to_be_escaped)
+	write(text, output)
 
-	return r'<body>' + '\n' + file_content + r'</body>'
+	return output.getvalue()
@@ -0,0 +1,373 @@
+import os
+import re
+import json
+import hashlib
+import pathlib
+import threading
+
+from . import cache
+from . import parsing
+from . import sources
+from . import colors
+
+
+def modification_time(file: str | pathlib.Path) -> int | None:
+	"""
+	Returns the modification time of a file referenced in the questions.
+
+	Parameters
+	----------
+	file : str or pathlib.Path
+		File (see `sources.path`).
+
+	Returns
+	-------
+	out: int or None
+		Modification time in nanoseconds, or `None` if the file doesn't exist.
+
+	"""
+
+	try:
+
+		return os.stat(sources.path(file)).st_mtime_ns
+
+	except FileNotFoundError:
+
+		return None
+
+
+def location(output_file: str | pathlib.Path) -> pathlib.Path:
+	"""
+	Returns the journal file of a build.
+
+	Parameters
+	----------
+	output_file : str or pathlib.Path
+		Output file of the build.
+
+	Returns
+	-------
+	out: pathlib.Path
+		A file in the cache (rather than next to the input, where it would be left behind if the build failed) named
+		after the (absolute) path of the output file.
+
+	"""
+
+	key = hashlib.sha256(pathlib.Path(output_file).resolve().as_posix().encode()).hexdigest()
+
+	return cache.path('journals', key)
+
+
+def stamps(referenced) -> dict:
+	"""
+	Takes note of the size and modification time of every file (TeX and svg) referenced in some strings.
+
+	Parameters
+	----------
+	referenced : iterable
+		Strings (e.g., every piece of text in the questions) in which files might be referenced.
+
+	Returns
+	-------
+	out: dict
+		Size and modification time (or `None` if the file doesn't exist) of every file.
+
+	"""
+
+	files = set()
+
+	for text in referenced:
+
+		files.update(f + '.tex' for f in re.findall(parsing.tex_file_name, text))
+		files.update(re.findall(parsing.url_less_svg_file, text))
+
+	res = {}
+
+	for f in sorted(files):
+
+		try:
+
+			stat = sources.path(f).stat()
+
+			res[f] = [stat.st_size, stat.st_mtime_ns]
+
+		except OSError:
+
+			res[f] = None
+
+	return res
+
+
+def fingerprint(
+		input_files: list[str | pathlib.Path], parameters: dict | None, options: dict, referenced: list[str]) -> str:
+	"""
+	Summarizes everything a build depends on.
+
+	Parameters
+	----------
+	input_files : list
+		Questions file, along with every file it includes.
+	parameters : dict or None
+		Parameters.
+	options : dict
+		Options of the build (e.g., whether images are embedded).
+	referenced : list
+		Strings (e.g., every piece of text in the questions) in which files (TeX and svg) might be referenced.
+
+	Returns
+	-------
+	out: str
+		A hash that changes whenever any of the above (including the size or modification time of the referenced
+		files) does.
+
+	"""
+
+	digest = hashlib.sha256()
+
+	for f in input_files:
+
+		digest.update(hashlib.sha256(pathlib.Path(f).read_bytes()).digest())
+
+	digest.update(json.dumps([parameters, options, stamps(referenced)], sort_keys=True, default=str).encode())
+
+	return digest.hexdigest()
+
+
+def forget_modified(history: dict, modification_times: dict):
+	"""
+	Forgets about every file in a history (files already compiled/transferred) that has been modified since it was
+	processed.
+
+	Parameters
+	----------
+	history : dict
+		Files already compiled/transferred.
+	modification_times : dict
+		Modification time of every file in `history` when it was processed (see `record_modification_times`).
+
+	"""
+
+	# every TeX file that has been modified since it was compiled...
+	for f in [
+			f for f in history['already compiled']
+			if modification_times.get(f + '.tex') != modification_time(f + '.tex')]:
+
+		# ...has to be compiled again, and the resulting svg transferred again
+		history['already compiled'].discard(f)
+		history['already transferred'].discard(f + '.svg')
+
+	# every svg that has been modified since it was transferred has to be transferred again
+	for f in [f for f in history['already transferred'] if modification_times.get(f) != modification_time(f)]:
+
+		history['already transferred'].discard(f)
+
+
+def record_modification_times(history: dict, modification_times: dict):
+	"""
+	Takes note of the modification time of every file in a history that is processed for the first time.
+
+	Parameters
+	----------
+	history : dict
+		Files already compiled/transferred.
+	modification_times : dict
+		Modification times (updated in-place).
+
+	"""
+
+	for f in history['already compiled']:
+
+		modification_times.setdefault(f + '.tex', modification_time(f + '.tex'))
+
+	for f in history['already transferred']:
+
+		modification_times.setdefault(f, modification_time(f))
+
+
+class Journal:
+	"""
+	Keeps track, in a file, of the progress of a build (files compiled and transferred, and questions rendered) so
+	that it can be resumed if interrupted.
+
+	Every entry is written (appended) as soon as it is recorded, unless entries are *deferred*, in which case they are
+	held until `commit` (e.g., files to be copied in bulk mode are not actually copied until the very end).
+	"""
+
+	def __init__(self, file: str | pathlib.Path, fingerprint: str, resume: bool, deferred: bool = False) -> None:
+		"""
+		Initializer.
+
+		Parameters
+		----------
+		file : str or pathlib.Path
+			Journal file.
+		fingerprint : str
+			Fingerprint (see `fingerprint`) of the build.
+		resume : bool
+			If `True`, the progress recorded in the file (if any) is loaded, as long as the fingerprint matches.
+		deferred : bool
+			If `True`, transferred files and rendered questions are only written in `commit`.
+
+		"""
+
+		self.file = pathlib.Path(file)
+		self.deferred = deferred
+
+		self.file.parent.mkdir(parents=True, exist_ok=True)
+
+		# progress loaded from the file
+		self.compiled = set()
+		self.transferred = set()
+		self.questions = {}
+
+		# entries waiting for `commit`
+		self.pending = []
+
+		# entries can be recorded from different threads (e.g., compilations)
+		self.lock = threading.Lock()
+
+		if resume:
+
+			self.load(fingerprint)
+
+		# the file is (re)written from scratch with whatever is still valid
+		self.f = open(self.file, 'w')
+
+		self.write({'fingerprint': fingerprint})
+
+		for f in self.compiled:
+
+			self.write({'compiled': f})
+
+		for f in self.transferred:
+
+			self.write({'transferred': f})
+
+		for (i_category, name), text in self.questions.items():
+
+			self.write({'question': [i_category, name], 'gift': text})
+
+	def load(self, fingerprint: str):
+
+		if not self.file.exists():
+
+			print(f'{colors.info}nothing to resume: starting from scratch')
+
+			return
+
+		with open(self.file) as f:
+
+			entries = []
+
+			for line in f:
+
+				try:
+
+					entries.append(json.loads(line))
+
+				# the last line might be incomplete if the program was killed while writing it
+				except json.JSONDecodeError:
+
+					break
+
+		if (not entries) or (entries[0].get('fingerprint') != fingerprint):
+
+			print(f'{colors.info}the inputs have changed since the last run: starting from scratch')
+
+			return
+
+		for entry in entries[1:]:
+
+			if 'compiled' in entry:
+
+				# (the svg might have been removed in the meantime)
+				if sources.path(entry['compiled'] + '.svg').exists():
+
+					self.compiled.add(entry['compiled'])
+
+			elif 'transferred' in entry:
+
+				self.transferred.add(entry['transferred'])
+
+			elif 'question' in entry:
+
+				self.questions[tuple(entry['question'])] = entry['gift']
+
+		print(
+			f'{colors.info}resuming: {colors.reset}{len(self.compiled)}{colors.info} file(s) already compiled, '
+			f'{colors.reset}{len(self.transferred)}{colors.info} transferred and {colors.reset}{len(self.questions)}'
+			f'{colors.info} question(s) rendered')
+
+	def write(self, entry: dict):
+
+		self.f.write(json.dumps(entry) + '\n')
+
+		# so that it survives the program being killed
+		self.f.flush()
+
+	def record(self, entry: dict, deferrable: bool = True):
+
+		with self.lock:
+
+			if self.deferred and deferrable:
+
+				self.pending.append(entry)
+
+			else:
+
+				self.write(entry)
+
+	def record_question(self, i_category: int, name: str, text: str):
+
+		self.questions[(i_category, name)] = text
+
+		self.record({'question': [i_category, name], 'gift': text})
+
+	def rendered(self, i_category: int, name: str) -> str | None:
+		"""
+		Returns the text of a question (given the position of its category and its name) rendered in a previous run
+		(or `None`).
+		"""
+
+		return self.questions.get((i_category, name))
+
+	def commit(self):
+
+		with self.lock:
+
+			for entry in self.pending:
+
+				self.write(entry)
+
+			self.pending = []
+
+	def remove(self):
+		"""
+		Gets rid of the journal (when the build is complete).
+		"""
+
+		self.f.close()
+
+		self.file.unlink(missing_ok=True)
+
+
+class JournaledSet(set):
+	"""
+	A set (e.g., of files already compiled) that records in a journal every element added.
+	"""
+
+	def __init__(self, elements, journal: Journal, kind: str, deferrable: bool = True) -> None:
+
+		super().__init__(elements)
+
+		self.journal = journal
+		self.kind = kind
+		self.deferrable = deferrable
+
+	def add(self, element):
+
+		if element not in self:
+
+			super().add(element)
+
+			self.journal.record({self.kind: element}, self.deferrable)
@@ -1,17 +1,23 @@
+import time
+import hashlib
+import functools
 import pathlib
 import shutil
 import subprocess
 import string
 import re
-import sys
-import tempfile
 
+from . import cache
 from . import parsing
+from . import sources
 from . import colors
+from . import errors
+from . import workspace
 
 
 def compile_tex(
-		source_file: str | pathlib.Path, timeout: int | None, options: list[str] = ['halt-on-error']) -> int:
+		source_file: str | pathlib.Path, timeout: int | None, options: list[str] = ['halt-on-error'],
+		output_directory: str | pathlib.Path | None = None) -> int:
 	"""
 	Compiles a TeX file.
 
@@ -23,6 +29,8 @@ def compile_tex(
 		Seconds that are given to compile the source.
 	options: list of str
 		Options to be passed to `pdflatex`.
+	output_directory: str or pathlib.Path, optional
+		Directory for the output (pdf) and auxiliary files (the directory of the source by default).
 
 	Returns
 	-------
@@ -37,9 +45,11 @@ def compile_tex(
 
 	if path_to_compiler is None:
 
-		print(f'{colors.error}cannot find pdflatex')
+		raise errors.BuildError('missing tool', 'pdflatex', f'{colors.error}cannot find pdflatex')
 
-		sys.exit(1)
+	if output_directory is not None:
+
+		options = options + [f'output-directory={pathlib.Path(output_directory).resolve().as_posix()}']
 
 	command = [path_to_compiler] + [f'-{o}' for o in options] + [source_file.name]
 
@@ -63,6 +73,21 @@ $$
 ''')
 
 
+# formulas compiled in this process, and the time (in seconds) it took
+compiled_formulas = {'count': 0, 'seconds': 0.}
+
+
+def formula_key(formula: str) -> str:
+	"""
+	Returns the name of the entry in the cache (of kind "formulas") for the verdict on a formula.
+	"""
+
+	return hashlib.sha256(latex_template.substitute(formula=formula).encode()).hexdigest()
+
+
+# results are cached since the same formula often shows up many times (in a run or, in a long-running process, across
+# runs)
+@functools.lru_cache(maxsize=4096)
 def formula_can_be_compiled(formula: str) -> bool:
 	"""
 	Checks whether a latex formula can be compiled with the above template, `latex_template`.
@@ -79,18 +104,161 @@ def formula_can_be_compiled(formula: str) -> bool:
 
 	"""
 
-	tex_source_code = latex_template.substitute(formula=formula)
+	# the verdict is also kept across processes
+	key = formula_key(formula)
+
+	if (verdict := cache.lookup('formulas', key)) is not None:
+
+		return verdict.read_bytes() == b'1'
+
+	started = time.perf_counter()
 
-	with tempfile.NamedTemporaryFile(mode='w+t', suffix='.tex') as temp:
+	# the source and every file produced by the compiler are removed afterwards
+	with workspace.get().job() as directory:
 
-		temp.write(tex_source_code)
-		temp.flush()
+		source_file = directory / 'formula.tex'
 
-		exit_status = compile_tex(temp.name, timeout=10, options=['halt-on-error', 'draftmode'])
+		source_file.write_text(latex_template.substitute(formula=formula))
+
+		exit_status = compile_tex(source_file, timeout=10, options=['halt-on-error', 'draftmode'])
+
+	compiled_formulas['count'] += 1
+	compiled_formulas['seconds'] += time.perf_counter() - started
+
+	cache.store_bytes(b'1' if exit_status == 0 else b'0', 'formulas', key)
 
 	return exit_status == 0
 
 
+def split_standalone(source_code: str) -> tuple[str, str] | None:
+	"""
+	Splits the source of a `standalone` document into its preamble and its body.
+
+	Parameters
+	----------
+	source_code : str
+		TeX source code.
+
+	Returns
+	-------
+	out: tuple or None
+		Preamble (with the class of the document set up for several pages) and body (what is in between
+		`\begin{document}` and `\end{document}`), or `None` if this is not a `standalone` document.
+
+	"""
+
+	m = parsing.re_standalone_document.search(source_code)
+
+	if m is None:
+
+		return None
+
+	# (options of the class are kept, since they affect every page)
+	document_class = r'\documentclass[' + ','.join(o for o in [m.group('options'), 'multi=true'] if o) + ']{standalone}'
+
+	return source_code[:m.start()] + document_class + m.group('preamble'), m.group('body')
+
+
+def preamble_key(preamble: str) -> str:
+	"""
+	Normalizes a preamble so that preambles that only differ in comments or blanks are deemed the same.
+	"""
+
+	return ' '.join(parsing.re_tex_comment.sub('', preamble).split())
+
+
+def group_by_preamble(files: list[str]) -> list[list[str]]:
+	"""
+	Groups TeX files that can be merged into a single document (see `merge_standalone`).
+
+	Parameters
+	----------
+	files : list
+		TeX files *without* the ".tex" suffix.
+
+	Returns
+	-------
+	out: list
+		Groups of files (in the order they show up) in the same directory and with the same preamble. Files that
+		cannot be merged with any other (e.g., they are not standalone documents, or don't exist) make up a group by
+		themselves.
+
+	"""
+
+	groups = {}
+
+	for f in files:
+
+		try:
+
+			document = split_standalone(sources.path(f + '.tex').read_text())
+
+		except OSError:
+
+			document = None
+
+		key = f if document is None else (pathlib.Path(f).parent.as_posix(), preamble_key(document[0]))
+
+		groups.setdefault(key, []).append(f)
+
+	return list(groups.values())
+
+
+def merge_standalone(preamble: str, bodies: list[str], directory: str | pathlib.Path) -> str:
+	"""
+	Puts together several documents sharing the same preamble into a single one, every one of them in a separate page.
+
+	Parameters
+	----------
+	preamble : str
+		Preamble (as returned by `split_standalone`).
+	bodies : list
+		Body of every document.
+	directory : str or pathlib.Path
+		Directory of the original documents (files they refer to are relative to it).
+
+	Returns
+	-------
+	out: str
+		TeX source code.
+
+	"""
+
+	# the document is compiled somewhere else, but files are still looked for in the original directory
+	input_path = r'\makeatletter\def\input@path{{' + pathlib.Path(directory).resolve().as_posix() + r'/}}\makeatother'
+
+	pages = ''.join(f'\\begin{{standalone}}\n{body}\n\\end{{standalone}}\n' for body in bodies)
+
+	return f'{input_path}\n{preamble}\n\\begin{{document}}\n{pages}\\end{{document}}\n'
+
+
+def pages_in_log(log_file: str | pathlib.Path) -> int | None:
+	"""
+	Finds out, from the log of a compilation, the number of pages of the resulting pdf.
+
+	Parameters
+	----------
+	log_file : str or pathlib.Path
+		Log file written by `pdflatex`.
+
+	Returns
+	-------
+	out: int or None
+		Number of pages, or `None` if it cannot be found out.
+
+	"""
+
+	try:
+
+		m = parsing.re_pages_in_log.search(pathlib.Path(log_file).read_text(errors='replace'))
+
+	except OSError:
+
+		return None
+
+	return None if m is None else int(m.group(1))
+
+
 def replace_and_replace_only_in_formulas(
 		pattern: str, replacement: str, formula_pattern: str, formula_replacement: str, text: str) -> str:
 	"""
@@ -0,0 +1,369 @@
+import copy
+import glob
+import json
+import functools
+import hashlib
+import pathlib
+import collections
+import concurrent.futures
+
+import yaml
+
+from . import cache
+from . import colors
+from . import errors
+
+# key of the directive that brings in the content of other files
+directive = 'include'
+
+# parsed content of the files most recently read in this process (along with their hashes)
+parsed = collections.OrderedDict()
+
+# the most files kept in `parsed`
+parsed_limit = 256
+
+
+def parse(content: bytes):
+
+	return yaml.load(content, Loader=yaml.FullLoader)
+
+
+def serialized(content) -> bytes | None:
+	"""
+	Turns the parsed content of a file into JSON, as long as nothing is lost on the way.
+
+	Parameters
+	----------
+	content : object
+		Parsed content of a file.
+
+	Returns
+	-------
+	out: bytes or None
+		JSON, or `None` if the content cannot be recovered from it as is (e.g., it includes dates or keys that are not
+		strings).
+
+	"""
+
+	try:
+
+		res = json.dumps(content)
+
+	except (TypeError, ValueError):
+
+		return None
+
+	return res.encode() if json.loads(res) == content else None
+
+
+def keep(key: str, content):
+
+	parsed[key] = content
+
+	parsed.move_to_end(key)
+
+	# the least recently used files are forgotten
+	while len(parsed) > parsed_limit:
+
+		parsed.popitem(last=False)
+
+
+def read_files(files: list[pathlib.Path], jobs: int | None = None) -> dict:
+	"""
+	Reads several YAML files, parsing (in parallel) only those whose content has never been parsed before, in this or
+	any previous run.
+
+	Parameters
+	----------
+	files : list
+		YAML files.
+	jobs : int, optional
+		Number of files parsed simultaneously (the number of processors by default).
+
+	Returns
+	-------
+	out: dict
+		The content of every file.
+
+	"""
+
+	keys = {}
+
+	# hash -> parsed content, for every file
+	res = {}
+
+	# hash -> file, for the files that must be parsed
+	pending = {}
+
+	for f in files:
+
+		try:
+
+			content = f.read_bytes()
+
+		except FileNotFoundError:
+
+			raise errors.BuildError(
+				'missing file', f.as_posix(), f'{colors.error}file {colors.reset}{f}{colors.error} does not exist')
+
+		keys[f] = key = hashlib.sha256(content).hexdigest()
+
+		if key in parsed:
+
+			parsed.move_to_end(key)
+
+			res[key] = parsed[key]
+
+			continue
+
+		# (JSON rather than, e.g., pickle, since loading it cannot run any code even if the cache was tampered with)
+		if (entry := cache.lookup('parsed', key)) is not None:
+
+			try:
+
+				res[key] = json.loads(entry.read_bytes())
+
+				keep(key, res[key])
+
+				continue
+
+			# (e.g., it was cut short)
+			except ValueError:
+
+				pass
+
+		pending[key] = (f, content)
+
+	# a pool of processes is only worth it for several files
+	if (len(pending) > 1) and (jobs != 1):
+
+		with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+
+			outcomes = {key: executor.submit(parse, content).result for key, (_, content) in pending.items()}
+
+	else:
+
+		outcomes = {key: functools.partial(parse, content) for key, (_, content) in pending.items()}
+
+	for key, outcome in outcomes.items():
+
+		try:
+
+			result = outcome()
+
+		except yaml.YAMLError as e:
+
+			f = pending[key][0]
+
+			raise errors.BuildError(
+				'settings', f.as_posix(), f'{colors.error}cannot parse {colors.reset}{f}{colors.error}: {e}')
+
+		keep(key, result)
+
+		# content that JSON cannot hold is simply parsed again every time
+		if (serialization := serialized(result)) is not None:
+
+			cache.store_bytes(serialization, 'parsed', key)
+
+		res[key] = result
+
+	# (copies, so that whatever is done with them does not affect those kept)
+	return {f: copy.deepcopy(res[key]) for f, key in keys.items()}
+
+
+def is_directive(item) -> bool:
+
+	return isinstance(item, dict) and (set(item) == {directive})
+
+
+def included_files(item: dict, directory: pathlib.Path) -> list[pathlib.Path]:
+	"""
+	Lists the files an "include" directive refers to.
+
+	Parameters
+	----------
+	item : dict
+		Directive, whose value is a file, a glob pattern (e.g., "chapters/*.yaml") or a list of them.
+	directory : pathlib.Path
+		Directory relative to which files are found (that of the file with the directive).
+
+	Returns
+	-------
+	out: list
+		Files (those matching a pattern in alphabetical order).
+
+	"""
+
+	res = []
+
+	for pattern in (item[directive] if isinstance(item[directive], list) else [item[directive]]):
+
+		if glob.has_magic(str(pattern)):
+
+			res.extend(sorted(f.resolve() for f in directory.glob(str(pattern)) if f.is_file()))
+
+		else:
+
+			res.append((directory / str(pattern)).resolve())
+
+	return res
+
+
+def directives_in(data) -> list[dict]:
+
+	if is_directive(data):
+
+		return [data]
+
+	if isinstance(data, dict):
+
+		data = list(data.values())
+
+	if isinstance(data, list):
+
+		return [d for item in data for d in directives_in(item)]
+
+	return []
+
+
+def load(
+		input_file: str | pathlib.Path, jobs: int | None = None,
+		root: pathlib.Path | None = None) -> tuple[dict, list[pathlib.Path]]:
+	"""
+	Reads a questions file, along with every file it includes.
+
+	Parameters
+	----------
+	input_file : str or pathlib.Path
+		Questions file.
+	jobs : int, optional
+		Number of files parsed simultaneously (the number of processors by default).
+	root : pathlib.Path, optional
+		If passed, directory outside of which no file can be included.
+
+	Returns
+	-------
+	data: dict
+		Questions, with every "include" directive replaced by the content of the corresponding files.
+	files: list
+		Every file read (starting with the questions file).
+
+	"""
+
+	input_file = pathlib.Path(input_file).resolve()
+
+	data = read_files([input_file], jobs)[input_file]
+
+	data, files = resolve(data, input_file.parent, jobs, input_file, root)
+
+	return data, [input_file] + files
+
+
+def resolve(
+		data: dict, directory: str | pathlib.Path = '.', jobs: int | None = None,
+		source: pathlib.Path | None = None, root: pathlib.Path | None = None) -> tuple[dict, list[pathlib.Path]]:
+	"""
+	Replaces every "include" directive in some questions with the content of the corresponding files.
+
+	A directive, i.e., `{include: <file>}` (or a glob pattern, or a list of them), can show up in the list of
+	categories, where each file should contain a category or a list of them, and in the list of questions of a
+	category, where each file should contain a question or a list of them. Included files can in turn include others
+	(relative to their own directory). All the files (in every level of inclusion) are read at once (see
+	`read_files`).
+
+	Parameters
+	----------
+	data : dict
+		Questions (as read from the questions file).
+	directory : str or pathlib.Path
+		Directory relative to which included files are found.
+	jobs : int, optional
+		Number of files parsed simultaneously (the number of processors by default).
+	source : pathlib.Path, optional
+		The file the questions were read from (if any).
+	root : pathlib.Path, optional
+		If passed, directory outside of which no file can be included.
+
+	Returns
+	-------
+	data: dict
+		Questions without directives.
+	files: list
+		Every file included (directly or not).
+
+	"""
+
+	directory = pathlib.Path(directory).resolve()
+
+	# if there is nothing to be included, questions are returned untouched
+	if not isinstance(data, dict) or not directives_in(data.get('categories')):
+
+		return data, []
+
+	documents = {}
+
+	# every level of inclusion is read in one go
+	level = [(d, directory) for d in directives_in(data.get('categories'))]
+
+	while level:
+
+		new = sorted({f for d, at in level for f in included_files(d, at)} - documents.keys())
+
+		if root is not None:
+
+			for f in new:
+
+				if not f.is_relative_to(root.resolve()):
+
+					raise errors.BuildError(
+						'settings', f.as_posix(),
+						f'{colors.error}file {colors.reset}{f}{colors.error} is outside of {colors.reset}{root}')
+
+		documents.update(read_files(new, jobs))
+
+		level = [(d, f.parent) for f in new for d in directives_in(documents[f])]
+
+	def expand(items, at: pathlib.Path, kind: str, chain: list[pathlib.Path]) -> list:
+
+		# e.g., `questions: {include: questions.yaml}`
+		if is_directive(items):
+
+			items = [items]
+
+		if not isinstance(items, list):
+
+			return items
+
+		res = []
+
+		for item in items:
+
+			if not is_directive(item):
+
+				# the questions of a category can be included too
+				if (kind == 'categories') and isinstance(item, dict) and ('questions' in item):
+
+					item = dict(item, questions=expand(item['questions'], at, 'questions', chain))
+
+				res.append(item)
+
+				continue
+
+			for f in included_files(item, at):
+
+				if f in chain:
+
+					raise errors.BuildError(
+						'settings', f.as_posix(),
+						f'{colors.error}file {colors.reset}{f}{colors.error} includes itself (through '
+						f'{colors.reset}{" -> ".join(c.name for c in chain + [f])}{colors.error})')
+
+				content = documents[f]
+
+				res.extend(expand(content if isinstance(content, list) else [content], f.parent, kind, chain + [f]))
+
+		return res
+
+	data = dict(data, categories=expand(data['categories'], directory, 'categories', [source or directory]))
+
+	return data, list(documents)
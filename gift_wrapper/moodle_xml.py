@@ -0,0 +1,304 @@
+import io
+import base64
+import pathlib
+import xml.sax.saxutils
+
+from . import image
+from . import parsing
+from . import sources
+
+# how files attached to a question are referred to in its text
+plugin_file = '@@PLUGINFILE@@/'
+
+# name of every attached file (as referred to in the questions) along with the corresponding local file
+attachments = {}
+
+header = '<?xml version="1.0" encoding="UTF-8"?>\n<quiz>\n\n'
+
+footer = '</quiz>\n'
+
+
+def attach(file: str | pathlib.Path) -> str:
+	"""
+	Registers a (local) file to be attached to questions.
+
+	Parameters
+	----------
+	file : str or pathlib.Path
+		File.
+
+	Returns
+	-------
+	out: str
+		The name of the file in Moodle (its relative path if possible, or a name made after its content otherwise).
+
+	"""
+
+	file = pathlib.PurePosixPath(file)
+
+	if file.is_absolute() or ('..' in file.parts):
+
+		name = image.content_name(sources.path(file))
+
+	else:
+
+		name = file.as_posix()
+
+	attachments[name] = file.as_posix()
+
+	return name
+
+
+def from_question_name(name: str) -> str:
+	"""
+	Generates Moodle XML for a question name.
+
+	Parameters
+	----------
+	name : str
+		Name of a question.
+
+	Returns
+	-------
+	out: str
+		Moodle XML.
+
+	"""
+
+	return f'<name><text>{xml.sax.saxutils.escape(str(name))}</text></name>'
+
+
+def text_and_files(text: str) -> str:
+	"""
+	Generates Moodle XML for a piece of (html) text, along with the files it refers to.
+
+	Parameters
+	----------
+	text : str
+		Html text.
+
+	Returns
+	-------
+	out: str
+		Moodle XML, with placeholders for the files to be attached (see `write`).
+
+	"""
+
+	# every attached file is only included once (even if it is referred to several times)
+	files = dict.fromkeys(parsing.re_plugin_file.findall(text))
+
+	markers = ''.join(f'\x00file:{name}\x00{attachments.get(name, name)}\x00' for name in files)
+
+	# (a CDATA section cannot contain "]]>")
+	text = text.replace(']]>', ']]]]><![CDATA[>')
+
+	return f'<text><![CDATA[{text}]]></text>{markers}'
+
+
+def from_text(text: str, tag: str) -> str:
+	"""
+	Generates a Moodle XML element for a piece of (html) text.
+
+	Parameters
+	----------
+	text : str
+		Html text.
+	tag : str
+		Name of the XML element (e.g., "questiontext").
+
+	Returns
+	-------
+	out: str
+		Moodle XML.
+
+	"""
+
+	return f'<{tag} format="html">{text_and_files(text)}</{tag}>'
+
+
+def from_category(name: str, within_the_course: bool = True) -> str:
+	"""
+	Generates Moodle XML for a category.
+
+	Parameters
+	----------
+	name : str
+		Category name.
+	within_the_course: bool
+		If True, the category will belong to the course in which the questions are imported.
+
+	Returns
+	-------
+	out: str
+		Moodle XML.
+
+	"""
+
+	name = xml.sax.saxutils.escape(('$course$/' if within_the_course else '') + name)
+
+	return f'<question type="category">\n\t<category><text>{name}</text></category>\n</question>\n\n'
+
+
+def from_question(kind: str, name: str, statement: str, feedback: str | None, answer: str) -> str:
+	"""
+	Generates Moodle XML for a question.
+
+	Parameters
+	----------
+	kind : str
+		Type of the question in Moodle (e.g., "numerical").
+	name : str
+		Name of the question.
+	statement : str
+		Html text of the question.
+	feedback : str, optional
+		Html text of the general feedback.
+	answer : str
+		Moodle XML for the answer(s) and any other settings specific to the type of question.
+
+	Returns
+	-------
+	out: str
+		Moodle XML.
+
+	"""
+
+	feedback = ('\n\t' + from_text(feedback, 'generalfeedback')) if feedback else ''
+
+	return (
+		f'<question type="{kind}">\n\t{from_question_name(name)}\n\t{from_text(statement, "questiontext")}{feedback}'
+		f'\n{answer}\n</question>')
+
+
+def from_answer(text: str, fraction: float | int) -> str:
+	"""
+	Generates Moodle XML for an answer of a multiple-choice question.
+
+	Parameters
+	----------
+	text : str
+		Html text of the answer.
+	fraction : float or int
+		The worth or grade (in percentage).
+
+	Returns
+	-------
+	out: str
+		Moodle XML.
+
+	"""
+
+	return f'\t<answer fraction="{fraction}" format="html">{text_and_files(text)}</answer>'
+
+
+def from_numerical_solution(solution: float | int | str, error: float | int | str | None = None) -> str:
+	"""
+	Generates Moodle XML from the solution and, optionally, error of a numerical question.
+
+	Parameters
+	----------
+	solution : int or float
+		Value of the solution.
+	error : int or float or str, optional
+		Value of the error.
+
+	Returns
+	-------
+	out: str
+		Moodle XML.
+
+	"""
+
+	return f'\t<answer fraction="100"><text>{solution}</text><tolerance>{error or 0}</tolerance></answer>'
+
+
+def from_latex_formula(text: str) -> str:
+	"""
+	Adapts a LaTeX formula to (html in) Moodle XML.
+
+	Parameters
+	----------
+	text: str
+		Naked (no $'s) LaTeX formula.
+
+	Returns
+	-------
+	res: str
+		Html text.
+
+	"""
+
+	# (as in GIFT, only "&" is escaped)
+	return r'\(' + text.replace('&', '&amp;') + r'\)'
+
+
+def write_attached_file(name: str, input_file: str | pathlib.Path, f: io.TextIOBase) -> int:
+	"""
+	Writes (streams) a file encoded in base64 as a Moodle XML attachment.
+
+	Parameters
+	----------
+	name : str
+		Name of the file in Moodle (it can include directories).
+	input_file : str or pathlib.Path
+		Local file.
+	f : file object
+		Output.
+
+	Returns
+	-------
+	out: int
+		The number of characters written.
+
+	"""
+
+	name = pathlib.PurePosixPath(name)
+
+	directory = '/' if name.parent == pathlib.PurePosixPath('.') else f'/{name.parent.as_posix()}/'
+
+	written = f.write(
+		f'<file name={xml.sax.saxutils.quoteattr(name.name)} path={xml.sax.saxutils.quoteattr(directory)}'
+		' encoding="base64">')
+
+	with open(input_file, 'rb') as source:
+
+		# (chunks with a size multiple of 3 so that no padding is introduced in between)
+		for chunk in iter(lambda: source.read(3 * 2**14), b''):
+
+			written += f.write(base64.b64encode(chunk).decode('ascii'))
+
+	return written + f.write('</file>')
+
+
+def write(text: str, f: io.TextIOBase) -> int:
+	"""
+	Writes Moodle XML, attaching (streaming) the files referred to by placeholders (see `from_text`).
+
+	Parameters
+	----------
+	text : str
+		Input text.
+	f : file object
+		Output.
+
+	Returns
+	-------
+	out: int
+		The number of characters written.
+
+	"""
+
+	pieces = parsing.re_attached_file_marker.split(text)
+
+	written = 0
+
+	# text, name and local file, text, name and local file...
+	for i in range(0, len(pieces), 3):
+
+		written += f.write(pieces[i])
+
+		if i + 2 < len(pieces):
+
+			written += write_attached_file(pieces[i + 1], sources.path(pieces[i + 2]), f)
+
+	return written
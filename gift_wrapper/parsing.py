@@ -19,8 +19,97 @@ url_less_svg_file = (
 		fr'(?<!{regex_filename_valid_character})(?!http)'
 		fr'({regex_filename_valid_character}+\.svg)(?!{regex_filename_valid_character})')
 
-re_svg_id = re.compile(r'id="([\w-]+)"')
+# (to be applied on the raw bytes of a file)
+re_svg_id = re.compile(rb'id="([\w-]+)"')
+
+# an id, either being defined or referred to (e.g., `href="#id"` or `url(#id)`)
+re_svg_id_reference = re.compile(rb'(id="|#)([\w-]+)')
+
+# placeholder for an svg file to be embedded in the output
+re_inline_svg_marker = re.compile('\x00svg:([^\x00]*)\x00')
+
+# ---------- GIFT (to be applied on the raw bytes of a file)
+
+# a character that is special in GIFT and not preceded by a single backslash (a character preceded by two or more
+# is escaped only if their number is odd); matching single characters makes searching fast
+re_gift_special = re.compile(rb'[{}=~#](?:(?<!\\[{}=~#])|(?<=\\\\[{}=~#]))')
+
+# what can show up between questions: blanks, comments and categories
+re_gift_between = re.compile(rb'(?:\s+|//[^\n]*|\$CATEGORY:[^\n]*)*')
+
+re_gift_category = re.compile(rb'\$CATEGORY:(?:\s*\$course\$/)?([^\n]*)')
+
+re_gift_question_name = re.compile(rb'::(.*?)::')
+
+# the answer of a numerical question: an optional grade, and a value with an optional error (or a range)
+re_gift_numerical_answer = re.compile(
+	rb'\s*(?:%-?\d+(?:\.\d+)?%)?\s*[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+	rb'(?:(?:\\?:|\.\.)\s*[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)?\s*')
+
+re_gift_grade = re.compile(rb'\s*%-?\d+(?:\.\d+)?%')
+
+# answers of a true/false question
+re_gift_true_false = re.compile(rb'\s*(?:T|F|TRUE|FALSE)\s*')
+
+# ---------- Moodle XML
+
+# a file attached to a question, as referred to in the text
+re_plugin_file = re.compile(fr'@@PLUGINFILE@@/({regex_url_valid_character}+)')
+
+# placeholder for a file to be attached (name and local file) in the output
+re_attached_file_marker = re.compile('\x00file:([^\x00]*)\x00([^\x00]*)\x00')
 
 # ---------- latex
 
 latex_formula_with_no_capturing = r'\$[^\$]*\$'
+
+# a document of class "standalone" split into the options of the class, the preamble and the body
+re_standalone_document = re.compile(
+	r'\\documentclass\s*(?:\[(?P<options>[^\]]*)\])?\s*\{standalone\}(?P<preamble>.*?)'
+	r'\\begin\{document\}(?P<body>.*)\\end\{document\}', re.DOTALL)
+
+# a comment in TeX (a "%" that is not escaped)
+re_tex_comment = re.compile(r'(?<!\\)%.*')
+
+# the number of pages, as reported in the log of `pdflatex`
+re_pages_in_log = re.compile(r'Output written on .*?\((\d+) pages?')
+
+# a formula once rendered: "\\(...\\)" in GIFT (backslashes are escaped) and "\(...\)" in Moodle XML
+re_rendered_formula = {
+	'gift': re.compile(r'\\\\\(.*?\\\\\)', re.DOTALL),
+	'xml': re.compile(r'\\\(.*?\\\)', re.DOTALL)}
+
+# ---------- settings
+
+
+def strings_in(settings: list | dict | str):
+	"""
+	Goes through every string in (possibly nested) lists and dictionaries.
+
+	Parameters
+	----------
+	settings : list, dict or str
+		Settings.
+
+	Yields
+	------
+	out: str
+		Every string.
+
+	"""
+
+	if isinstance(settings, str):
+
+		yield settings
+
+	elif isinstance(settings, dict):
+
+		for value in settings.values():
+
+			yield from strings_in(value)
+
+	elif isinstance(settings, list):
+
+		for value in settings:
+
+			yield from strings_in(value)
@@ -0,0 +1,236 @@
+import os
+import io
+from typing import Callable
+
+from . import image
+from . import colors
+from . import errors
+from . import parsing
+from . import sources
+from . import moodle_xml
+
+
+class Counter(io.TextIOBase):
+	"""
+	A (fake) output that only counts the bytes (UTF-8) written to it.
+	"""
+
+	def __init__(self) -> None:
+
+		super().__init__()
+
+		self.n_bytes = 0
+
+	def write(self, text: str) -> int:
+
+		self.n_bytes += len(text.encode())
+
+		return len(text)
+
+
+class Payload:
+	"""
+	Measures the size of every question in the output, split into images (inlined or attached), formulas and (the rest
+	of the) text, and enforces (optional) budgets on it.
+	"""
+
+	parts = ['images', 'formulas', 'text']
+
+	def __init__(
+			self, output_format: str = 'gift', question_budget: int | None = None, bank_budget: int | None = None,
+			link: Callable[[str, dict | None], str] | None = None) -> None:
+		"""
+		Initializer.
+
+		Parameters
+		----------
+		output_format : str
+			Either "gift" or "xml" (Moodle XML).
+		question_budget : int, optional
+			Maximum number of bytes of a question.
+		bank_budget : int, optional
+			Maximum number of bytes of all the questions together.
+		link : Callable[[str, dict | None], str], optional
+			Function turning an (inlined) svg file into GIFT text linking to it, given the settings of the images in
+			the question. If passed, images of questions over budget are linked (largest first) rather than inlined
+			until the question fits, and only if it doesn't, the budget is deemed exceeded (only meaningful in GIFT).
+
+		"""
+
+		self.output_format = output_format
+		self.question_budget = question_budget
+		self.bank_budget = bank_budget
+		self.link = link
+
+		# category, name and size of every part of every question (in the order they are written)
+		self.questions = []
+
+		# number of bytes of all of them
+		self.total = 0
+
+		# size (in the output) of every image, along with its modification time when it was measured
+		self.image_sizes = {}
+
+		# images that were linked rather than inlined to meet the budget
+		self.linked = set()
+
+		if output_format == 'xml':
+
+			self.re_image, self.write_image = parsing.re_attached_file_marker, self.write_attached_file
+
+		else:
+
+			self.re_image, self.write_image = parsing.re_inline_svg_marker, image.write_svg_as_html
+
+	@staticmethod
+	def write_attached_file(name: str, f: io.TextIOBase) -> int:
+
+		return moodle_xml.write_attached_file(name, sources.path(moodle_xml.attachments.get(name, name)), f)
+
+	def image_size(self, file: str) -> int:
+		"""
+		Returns the number of bytes an image takes in the output.
+		"""
+
+		modification_time = os.stat(sources.path(moodle_xml.attachments.get(file, file))).st_mtime_ns
+
+		# the image is (fully) read only the first time it shows up, or if it was modified since
+		if self.image_sizes.get(file, (None,))[0] != modification_time:
+
+			counter = Counter()
+
+			self.write_image(file, counter)
+
+			self.image_sizes[file] = (modification_time, counter.n_bytes)
+
+		return self.image_sizes[file][1]
+
+	def measure(self, text: str) -> dict:
+		"""
+		Measures the size of a question.
+
+		Parameters
+		----------
+		text : str
+			Question (with the placeholders for its images, as returned by `core.render_question`).
+
+		Returns
+		-------
+		out: dict
+			Number of bytes of every part (images, formulas and text) of the question in the output.
+
+		"""
+
+		pieces = self.re_image.split(text)
+
+		# (in Moodle XML the name of the file and the local file are captured, but only the name is needed)
+		step = self.re_image.groups + 1
+
+		images = sum(self.image_size(pieces[i]) for i in range(1, len(pieces), step))
+
+		text = ''.join(pieces[::step])
+
+		formulas = sum(len(m.group(0).encode()) for m in parsing.re_rendered_formula[self.output_format].finditer(text))
+
+		return {'images': images, 'formulas': formulas, 'text': len(text.encode()) - formulas}
+
+	def fit(self, text: str, category: str | None, name: str, images_settings: dict | None = None) -> str:
+		"""
+		Takes note of the size of a question, making it fit within the budgets if possible.
+
+		Parameters
+		----------
+		text : str
+			Question (with the placeholders for its images).
+		category : str or None
+			Category of the question.
+		name : str
+			Name of the question.
+		images_settings : dict, optional
+			Settings of the images in the question (needed for linking them).
+
+		Returns
+		-------
+		out: str
+			The question, with some images linked rather than inlined if that was needed to meet the budget.
+
+		"""
+
+		sizes = self.measure(text)
+
+		# the most this question can take
+		budgets = [self.question_budget, None if self.bank_budget is None else self.bank_budget - self.total]
+		budget = min((b for b in budgets if b is not None), default=None)
+
+		if (budget is not None) and (sum(sizes.values()) > budget) and self.link:
+
+			# every image inlined in the question, largest first
+			files = sorted(set(parsing.re_inline_svg_marker.findall(text)), key=self.image_size, reverse=True)
+
+			for f in files:
+
+				text = text.replace(image.inline_svg_marker(f), self.link(f, images_settings))
+
+				self.linked.add(f)
+
+				sizes = self.measure(text)
+
+				if sum(sizes.values()) <= budget:
+
+					break
+
+		if (budget is not None) and (sum(sizes.values()) > budget):
+
+			which = 'question' if budget == self.question_budget else 'bank (what is left of it)'
+
+			raise errors.BuildError(
+				'budget', name,
+				f'{colors.error}question {colors.reset}{name}{colors.error} takes {colors.reset}{sum(sizes.values())}'
+				f'{colors.error} bytes ({colors.reset}{sizes["images"]}{colors.error} of them images), but the budget of'
+				f' the {which} is {colors.reset}{budget}')
+
+		self.questions.append((category, name, sizes))
+
+		self.total += sum(sizes.values())
+
+		return text
+
+	def print(self, top: int = 10):
+
+		def row(sizes: dict, where: str) -> str:
+
+			split = ''.join(f'{sizes[p]:>10}' for p in self.parts)
+
+			return f' {sum(sizes.values()):>10}{split}  {colors.extra_info}{where}'
+
+		header = ''.join(f'{p:>10}' for p in self.parts)
+
+		print(f'\n{colors.info}heaviest questions (in bytes):\n {"total":>10}{header}')
+
+		for category, name, sizes in sorted(self.questions, key=lambda q: sum(q[2].values()), reverse=True)[:top]:
+
+			print(row(sizes, ' / '.join(str(w) for w in (category, name) if w is not None)))
+
+		categories = {}
+
+		for category, _, sizes in self.questions:
+
+			totals = categories.setdefault(category, dict.fromkeys(self.parts, 0))
+
+			for p in self.parts:
+
+				totals[p] += sizes[p]
+
+		print(f'\n{colors.info}categories (in bytes):\n {"total":>10}{header}')
+
+		for category, sizes in sorted(categories.items(), key=lambda c: sum(c[1].values()), reverse=True):
+
+			print(row(sizes, str(category)))
+
+		print(f'\n{colors.info}all the questions take {colors.reset}{self.total}{colors.info} bytes')
+
+		if self.linked:
+
+			print(
+				f'{colors.reset}{len(self.linked)}{colors.info} image(s) were linked rather than inlined to meet the '
+				f'budget')
@@ -0,0 +1,183 @@
+import os
+import re
+import json
+import pathlib
+
+from . import cache
+from . import colors
+from . import formula
+from . import latex
+from . import parsing
+from . import transformer
+
+# stages of a build, along with the unit in which the work in each one is measured
+stages = {'formulas': 'formulas', 'figures': 'TeX files', 'uploads': 'bytes', 'render': 'questions'}
+
+
+def timings_file() -> pathlib.Path:
+
+	return cache.root() / 'timings.json'
+
+
+def previous() -> dict:
+	"""
+	Returns the timings of previous runs.
+
+	Returns
+	-------
+	out: dict
+		For every stage, the "units" of work done and the "seconds" it took in the last run in which there was any.
+
+	"""
+
+	try:
+
+		return json.loads(timings_file().read_text())
+
+	except (OSError, ValueError):
+
+		return {}
+
+
+def record(measured: dict):
+	"""
+	Saves the timings of a run (stages in which no work was done are left as they were).
+
+	Parameters
+	----------
+	measured : dict
+		For every stage, the units of work done and the seconds it took.
+
+	"""
+
+	timings = previous()
+
+	# (a stage measured by subtracting the others from the total might come out slightly negative)
+	timings.update(
+		{stage: {'units': units, 'seconds': max(seconds, 0.)} for stage, (units, seconds) in measured.items() if units})
+
+	try:
+
+		timings_file().parent.mkdir(parents=True, exist_ok=True)
+
+		# (atomically, since other runs might be doing the same)
+		temporary = timings_file().with_name(f'.timings.json.{os.getpid()}.tmp')
+
+		temporary.write_text(json.dumps(timings))
+
+		os.replace(temporary, timings_file())
+
+	# (not worth stopping the build)
+	except OSError:
+
+		pass
+
+
+def make(
+		categories: list, no_checks: bool = False, strict: bool = False, check_sampling: float = 0.,
+		upload: bool = True) -> dict:
+	"""
+	Works out (without actually doing anything) what a build involves, given the state of the cache and the timings
+	of previous runs.
+
+	Parameters
+	----------
+	categories : list
+		Categories (along with their questions) to be built.
+	no_checks : bool
+		If `True`, LaTeX formulas are not checked
+	strict : bool
+		If `True`, every LaTeX formula is compiled
+	check_sampling : float
+		Fraction of the LaTeX formulas that are compiled even if proven fine without compiling them
+	upload : bool
+		Whether images are copied to a remote host
+
+	Returns
+	-------
+	out: dict
+		For every stage, the number of "units" of work to be done, and the estimated "seconds" (`None` if unknown).
+
+	"""
+
+	texts = list(parsing.strings_in(categories))
+
+	res = {stage: {'units': 0, 'seconds': None} for stage in stages}
+
+	# ---------- formulas
+
+	if not no_checks:
+
+		formulas = dict.fromkeys(
+			f for text in texts for f in re.findall(transformer.LatexFormulas.latex_formula, text))
+
+		for f in formulas:
+
+			# (as in `transformer.LatexFormulas`)
+			verdict = None if strict else formula.check(f)
+
+			compiled = (verdict is None) or (verdict and formula.sampled(f, check_sampling))
+
+			# a formula is only compiled if its verdict is not known already
+			if compiled and not cache.path('formulas', latex.formula_key(f)).exists():
+
+				res['formulas']['units'] += 1
+
+	# ---------- figures
+
+	tex_files = list(dict.fromkeys(f for text in texts for f in re.findall(parsing.tex_file_name, text)))
+
+	res['figures']['units'] = len(tex_files)
+
+	# ---------- uploads
+
+	if upload:
+
+		svg_files = dict.fromkeys(
+			[f + '.svg' for f in tex_files] + [f for text in texts for f in re.findall(parsing.url_less_svg_file, text)])
+
+		# (the svg of a TeX file that was never compiled does not count)
+		res['uploads']['units'] = sum(os.path.getsize(f) for f in svg_files if os.path.exists(f))
+
+	# ---------- render
+
+	res['render']['units'] = sum(len(cat['questions']) for cat in categories)
+
+	# every estimate is based on the rate of the last run in which there was work to be done in the same stage
+	for stage, timing in previous().items():
+
+		if (stage in res) and timing['units']:
+
+			res[stage]['seconds'] = res[stage]['units'] * timing['seconds'] / timing['units']
+
+	return res
+
+
+def print_plan(plan: dict):
+	"""
+	Prints a plan (see `make`).
+	"""
+
+	print(f'{colors.info}{"stage":>10} {"work":>22} {"estimated":>12}')
+
+	for stage, p in plan.items():
+
+		if not p['units']:
+
+			seconds = '-'
+
+		else:
+
+			seconds = '?' if p['seconds'] is None else f'{p["seconds"]:.1f} s'
+
+		print(f'{stage:>10} {p["units"]:>12} {stages[stage]:<9} {seconds:>12}')
+
+	known = [p['seconds'] for p in plan.values() if p['units'] and (p['seconds'] is not None)]
+
+	unknown = [stage for stage, p in plan.items() if p['units'] and (p['seconds'] is None)]
+
+	print(f'{"total":>10} {"":>22} {sum(known):>10.1f} s')
+
+	if unknown:
+
+		print(f'{colors.info}(no previous timings for {colors.reset}{", ".join(unknown)}{colors.info})')
@@ -0,0 +1,136 @@
+import re
+import collections
+
+from . import question
+from . import colors
+from . import errors
+from . import parsing
+from . import sources
+
+
+def check(input_data: dict, svg_files: bool = True) -> errors.Report:
+	"""
+	Walks the whole bank looking for problems that can be found without actually building anything (wrong settings,
+	repeated names, unknown classes of questions, missing files...), so that they show up (all at once) before any
+	expensive work is done.
+
+	Parameters
+	----------
+	input_data : dict
+		Questions (as read from the questions file).
+	svg_files : bool
+		Whether svg files referenced in the questions are required to exist (they are not, e.g., in a local run, in
+		which they are only listed to be copied).
+
+	Returns
+	-------
+	out: errors.Report
+		Every problem found.
+
+	"""
+
+	res = errors.Report()
+
+	def add(kind: str, subject: str | None, message: str, category: str | None = None, name: str | None = None):
+
+		res.add(errors.BuildError(kind, subject, f'{colors.error}{message}'), category, name)
+
+	if not isinstance(input_data, dict):
+
+		add('settings', None, 'the questions file should contain "pictures base directory" and "categories"')
+
+		return res
+
+	if 'pictures base directory' not in input_data:
+
+		add('settings', 'pictures base directory', '"pictures base directory" missing')
+
+	if not isinstance(input_data.get('categories'), list):
+
+		add('settings', 'categories', '"categories" missing (or not a list)')
+
+		return res
+
+	for cat in input_data['categories']:
+
+		if not (isinstance(cat, dict) and ('name' in cat) and isinstance(cat.get('questions'), list)):
+
+			add('settings', None, f'a category should have a "name" and a list of "questions", not {cat}')
+
+			continue
+
+		# as in error reports
+		names = cat['name'] if isinstance(cat['name'], list) else [cat['name']]
+		category = '/'.join(str(c) for c in names) if cat['name'] else None
+
+		# list with names that show up more than once
+		duplicates = [
+			name for name, count in collections.Counter(
+				q.get('name') for q in cat['questions'] if isinstance(q, dict)).items() if count > 1]
+
+		if duplicates:
+
+			add('settings', category, f'duplicates in category {colors.reset}{cat["name"]}: {duplicates}', category)
+
+		for q in cat['questions']:
+
+			if not isinstance(q, dict):
+
+				add('settings', None, f'a question should be a dictionary of settings, not {q}', category)
+
+				continue
+
+			name = q.get('name')
+
+			check_question(q, lambda kind, subject, message: add(kind, subject, message, category, name), svg_files)
+
+	return res
+
+
+def check_question(settings: dict, add, svg_files: bool = True):
+	"""
+	Looks for problems in the settings of a question, and the files it refers to.
+
+	Parameters
+	----------
+	settings : dict
+		User settings for the question.
+	add : Callable[[str, str | None, str], None]
+		Function recording a problem given its kind, subject and message.
+	svg_files : bool
+		Whether svg files are required to exist.
+
+	"""
+
+	class_name = settings.get('class')
+
+	question_class = getattr(question, str(class_name), None)
+
+	if class_name is None:
+
+		add('settings', None, '"class" missing')
+
+	elif not (isinstance(question_class, type) and issubclass(question_class, question.HtmlQuestion)):
+
+		add('settings', class_name, f'unknown class of question {colors.reset}{class_name}')
+
+	else:
+
+		for problem in question_class.problems({k: v for k, v in settings.items() if k != 'class'}):
+
+			add('settings', class_name, problem)
+
+	for text in parsing.strings_in(settings):
+
+		for f in re.findall(parsing.tex_file_name, text):
+
+			if not sources.path(f + '.tex').exists():
+
+				add('missing file', f + '.tex', f'file {colors.reset}{f}.tex{colors.error} does not exist')
+
+		for f in (re.findall(parsing.url_less_svg_file, text) if svg_files else []):
+
+			if not sources.path(f).exists():
+
+				add('missing file', f, f'file {colors.reset}{f}{colors.error} does not exist')
+
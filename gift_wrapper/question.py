@@ -1,11 +1,26 @@
-import sys
 import abc
+import ast
+import inspect
+import operator
 import functools
 import pathlib
+import re
 import string
+from typing import Callable
+
+try:
+
+	import numpy as np
+
+# `numpy` is only required for parametric questions
+except ImportError:
+
+	np = None
 
 from . import gift
+from . import moodle_xml
 from . import colors
+from . import errors
 from . import parsing
 from . import transformer
 
@@ -34,6 +49,190 @@ def user_settings_to_class_init(settings: dict, name: str | None = None) -> str:
 	return settings.pop('class')
 
 
+def solution_error(value, error):
+	"""
+	Computes the tolerated error of a numerical solution.
+
+	Parameters
+	----------
+	value : int, float or numpy array
+		Value(s) of the solution.
+	error : int, float or str
+		Either an absolute error or a percentage (e.g., "5%") of `value`.
+
+	Returns
+	-------
+	out: int, float, str or numpy array
+		The error, which is an array (one element per value) if `value` is one and the error is a percentage.
+
+	"""
+
+	# try to match a percentage
+	m = parsing.re_percentage.match(str(error))
+
+	# if so...
+	if m:
+
+		# (the value might be negative, but the error cannot)
+		return abs(value * float(m.group(1)) / 100.)
+
+	else:
+
+		return error
+
+
+def sample_parameter(random_generator, settings: list | dict, n: int):
+	"""
+	Draws the values of a parameter for a number of variants.
+
+	Parameters
+	----------
+	random_generator : numpy.random.Generator
+		Random generator.
+	settings : list or dict
+		Either a list, `[low, high]`, with the range of the parameter, or a dictionary with keys "low", "high" and,
+		optionally, "decimals" (the number of decimals to round the values to). Alternatively, the dictionary can
+		provide a list of "values" to choose from. Integer values are drawn if both ends of the range are integers.
+	n : int
+		Number of values.
+
+	Returns
+	-------
+	out: numpy array
+		The values of the parameter.
+
+	"""
+
+	if isinstance(settings, list):
+
+		assert len(settings) == 2, f'a range must be given as [low, high], not {settings}'
+
+		settings = {'low': settings[0], 'high': settings[1]}
+
+	if 'values' in settings:
+
+		return random_generator.choice(np.asarray(settings['values']), size=n)
+
+	assert ('low' in settings) and ('high' in settings), '"low" and/or "high" missing in parameter'
+
+	low, high = settings['low'], settings['high']
+
+	# if both ends of the range are integers...
+	if isinstance(low, int) and isinstance(high, int):
+
+		# ...so are the values
+		return random_generator.integers(low, high, size=n, endpoint=True)
+
+	res = random_generator.uniform(low, high, size=n)
+
+	if 'decimals' in settings:
+
+		res = np.round(res, settings['decimals'])
+
+	return res
+
+
+# arithmetic operators that can be used in the expression of the solution of a parametric question
+expression_operators = {
+	ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+	ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow, ast.UAdd: operator.pos,
+	ast.USub: operator.neg}
+
+
+def evaluate(expression: str, functions: dict, variables: dict):
+	"""
+	Evaluates an arithmetic expression. Only numbers, variables, the operators in `expression_operators` and calls to
+	the given functions are allowed (Python's `eval` cannot be made safe, and the expression might come from anyone
+	with access to the build service).
+
+	Parameters
+	----------
+	expression : str
+		Expression (e.g., "sqrt(a**2 + b**2)").
+	functions : dict
+		Functions (and constants) that can be used in the expression, by name.
+	variables : dict
+		Value of every variable.
+
+	Returns
+	-------
+	out: int, float or numpy array
+		The value of the expression.
+
+	"""
+
+	try:
+
+		tree = ast.parse(str(expression), mode='eval')
+
+	except SyntaxError as e:
+
+		raise errors.BuildError(
+			'settings', str(expression),
+			f'{colors.error}cannot parse expression {colors.reset}{expression}{colors.error}: {e.msg}')
+
+	names = functions | variables
+
+	def walk(node: ast.AST):
+
+		if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+
+			# (as `numpy` numbers, which overflow rather than growing indefinitely, e.g., in "9**9**9")
+			return np.int64(node.value) if isinstance(node.value, int) else np.float64(node.value)
+
+		if isinstance(node, ast.Name) and (node.id in names):
+
+			return names[node.id]
+
+		if isinstance(node, ast.BinOp) and (type(node.op) in expression_operators):
+
+			return expression_operators[type(node.op)](walk(node.left), walk(node.right))
+
+		if isinstance(node, ast.UnaryOp) and (type(node.op) in expression_operators):
+
+			return expression_operators[type(node.op)](walk(node.operand))
+
+		if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and callable(functions.get(node.func.id)) and (
+				not node.keywords):
+
+			return functions[node.func.id](*[walk(a) for a in node.args])
+
+		raise errors.BuildError(
+			'settings', str(expression),
+			f'{colors.error}not allowed in expression {colors.reset}{expression}{colors.error}: '
+			f'{colors.reset}{ast.unparse(node)}')
+
+	return walk(tree.body)
+
+
+# the same text (e.g., "None of the above" or a shared feedback) is processed only once in a build: the side effects of
+# the transformations (compiling or copying images) only need to happen once, and errors are not cached
+@functools.lru_cache(maxsize=4096)
+def transformed(text: str, transforms: tuple) -> str:
+	"""
+	Applies a series of transformations on some text.
+
+	Parameters
+	----------
+	text : str
+		Input text.
+	transforms : tuple
+		Transformations, in the order in which they are applied.
+
+	Returns
+	-------
+	out: str
+		Processed text.
+
+	"""
+
+	for function in transforms:
+
+		text = function(text)
+
+	return text
+
+
 class HtmlQuestion(metaclass=abc.ABCMeta):
 	"""
 	Abstract class implementing an html-based question.
@@ -73,10 +272,41 @@ class HtmlQuestion(metaclass=abc.ABCMeta):
 		self.pre_transforms = pre_transforms
 		self.post_transforms = post_transforms
 
-		# transformations that depend on particular settings of this class
+		# transformations that depend on particular settings of this class...
 		self.custom_transforms = [transformer.URLs(images_settings)]
 
-	def process_text(self, text: str) -> str:
+		# ...and their counterparts for Moodle XML
+		self.xml_custom_transforms = [transformer.URLs(images_settings, escape=False)]
+
+	@classmethod
+	def problems(cls, settings: dict) -> list[str]:
+		"""
+		Checks (without building anything) the settings of a question of this class.
+
+		Parameters
+		----------
+		settings : dict
+			User settings for the question (without the "class").
+
+		Returns
+		-------
+		out: list
+			Every problem found (empty if none).
+
+		"""
+
+		parameters = {
+			n: p for n, p in inspect.signature(cls).parameters.items() if n not in ('pre_transforms', 'post_transforms')}
+
+		res = [f'"{n}" missing' for n, p in parameters.items() if (p.default is p.empty) and (n not in settings)]
+
+		if unknown := [n for n in settings if n not in parameters]:
+
+			res.append(f'unknown settings {unknown}')
+
+		return res
+
+	def process_text(self, text: str, custom_transforms: list | None = None) -> str:
 		"""
 		Functions in `self.processing_functions` are applied on the given input.
 
@@ -84,6 +314,8 @@ class HtmlQuestion(metaclass=abc.ABCMeta):
 		----------
 		text : str
 			Input text.
+		custom_transforms : list, optional
+			Transformations to be used instead of `self.custom_transforms`.
 
 		Returns
 		-------
@@ -92,21 +324,22 @@ class HtmlQuestion(metaclass=abc.ABCMeta):
 
 		"""
 
-		for function in (self.pre_transforms + self.custom_transforms + self.post_transforms):
+		if custom_transforms is None:
 
-			try:
+			custom_transforms = self.custom_transforms
 
-				text = function(text)
+		try:
 
-			except gift.NotCompliantLatexFormula as e:
+			return transformed(text, tuple(self.pre_transforms + custom_transforms + self.post_transforms))
 
-				print(
-					f'\n{colors.error}cannot compile latex formula\n {colors.extra_info}{e.formula}{colors.reset} in '
-					f'{colors.info}{self.name}')
+		except gift.NotCompliantLatexFormula as e:
 
-				sys.exit(1)
+			reason = f' ({e.reason})' if e.reason else ''
 
-		return text
+			raise errors.BuildError(
+				'formula', e.formula,
+				f'{colors.error}cannot compile latex formula{reason}\n {colors.extra_info}{e.formula}{colors.reset} in '
+				f'{colors.info}{self.name}') from e
 
 	@property
 	def gift(self):
@@ -116,7 +349,8 @@ class HtmlQuestion(metaclass=abc.ABCMeta):
 		Returns
 		-------
 		out: str
-			GIFT-ready text.
+			GIFT-ready text, with placeholders for the svg files to be embedded, if any (see `image.write`, or
+			`image.resolve` to get rid of them).
 
 		"""
 
@@ -137,6 +371,47 @@ class HtmlQuestion(metaclass=abc.ABCMeta):
 
 		return gift.from_question_name(self.name) + gift.html + self.process_text(statement) + answer
 
+	@property
+	def xml(self):
+		"""
+		Builds the question in the Moodle XML format.
+
+		Returns
+		-------
+		out: str
+			Moodle XML (with placeholders for the attached files, see `moodle_xml.write`).
+
+		"""
+
+		statement = self.statement
+
+		if self.time:
+
+			statement += '\n\n\n' + r'<i>Estimated time: ' + str(self.time) + r' minutes</i>' + '\n'
+
+		feedback = self.process_text(self.feedback.rstrip(), self.xml_custom_transforms) if self.feedback else None
+
+		return moodle_xml.from_question(
+			self.xml_type, self.name, self.process_text(statement, self.xml_custom_transforms), feedback,
+			self.xml_answer)
+
+	# type of the question in Moodle XML
+	xml_type = None
+
+	@property
+	def xml_answer(self):
+		"""
+		Yields the Moodle XML for the answer to the question (and any other settings specific to its type).
+
+		Returns
+		-------
+		out: str
+			Moodle XML.
+
+		"""
+
+		raise NotImplementedError(f'{type(self).__name__} cannot be exported to Moodle XML')
+
 	def __repr__(self):
 
 		return f'Name: {self.name}\nStatement: {self.statement}'
@@ -183,17 +458,7 @@ class Numerical(HtmlQuestion):
 
 		if 'error' in solution:
 
-			# try to match a percentage
-			m = parsing.re_percentage.match(str(solution['error']))
-
-			# if so...
-			if m:
-
-				self.solution_error = str(solution['value'] * float(m.group(1)) / 100.)
-
-			else:
-
-				self.solution_error = str(solution['error'])
+			self.solution_error = str(solution_error(solution['value'], solution['error']))
 
 		# an error was NOT provided
 		else:
@@ -206,11 +471,205 @@ class Numerical(HtmlQuestion):
 
 		return super().__repr__() + '\n' + f'Solution: {self.solution_value}' + error
 
+	@classmethod
+	def problems(cls, settings: dict) -> list[str]:
+
+		res = super().problems(settings)
+
+		if ('solution' in settings) and not (isinstance(settings['solution'], dict) and ('value' in settings['solution'])):
+
+			res.append('"value" missing in "solution"')
+
+		return res
+
 	@property
 	def answer(self):
 
 		return gift.from_numerical_solution(self.solution_value, self.solution_error)
 
+	xml_type = 'numerical'
+
+	@property
+	def xml_answer(self):
+
+		return moodle_xml.from_numerical_solution(self.solution_value, self.solution_error)
+
+
+class ParametricNumerical(HtmlQuestion):
+	"""
+	Class implementing a numerical question with several variants, every one with different values for the parameters.
+	"""
+
+	# in the statement and feedback, a parameter named, e.g., "a" is referred to as "<<a>>"
+	re_placeholder = re.compile(r'<<(@?\w+)>>')
+
+	# (`numpy`) functions and constants that can be used in the expression of the solution
+	expression_functions = [
+		'sqrt', 'exp', 'log', 'log2', 'log10', 'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'sinh', 'cosh', 'tanh',
+		'abs', 'floor', 'ceil', 'round', 'minimum', 'maximum', 'pi', 'e']
+
+	def __init__(
+			self, name: str, statement: str, parameters: dict, solution: dict, variants: int = 1,
+			seed: int | None = None, images_settings: dict | None = None, feedback: str | None = None,
+			time: int | None = None, pre_transforms: list = [], post_transforms: list = []):
+		"""
+		Initializer.
+
+		Parameters
+		----------
+		parameters : dict
+			For every parameter, the range (or set) of values it can take (see `sample_parameter`).
+		solution : dict
+			Expression of the solution in terms of the parameters and, optionally, tolerated error.
+		variants : int
+			Number of variants of the question.
+		seed : int, optional
+			Seed for the random generator, so that the same variants are obtained every time.
+		"""
+
+		super().__init__(name, statement, images_settings, feedback, time, pre_transforms, post_transforms)
+
+		if np is None:
+
+			raise errors.BuildError('missing tool', 'numpy', f'{colors.error}parametric questions require {colors.reset}numpy')
+
+		assert ('expression' in solution), '"expression" missing in "solution"'
+
+		# placeholders referring to something that is not a parameter
+		unknown = {
+			p for p in self.re_placeholder.findall(self.statement + (self.feedback or '')) if p not in parameters}
+
+		assert not unknown, f'unknown parameters in "{name}": {unknown}'
+
+		self.variants = variants
+
+		random_generator = np.random.default_rng(seed)
+
+		# the values of every parameter for *all* the variants are drawn at once...
+		self.parameters = {p: sample_parameter(random_generator, s, variants) for p, s in parameters.items()}
+
+		functions = {f: getattr(np, f) for f in self.expression_functions}
+
+		# ...and so is the solution computed (in a single vectorized pass)
+		values = evaluate(solution['expression'], functions, self.parameters)
+
+		# if the solution is requested with a given precision...
+		if 'decimals' in solution:
+
+			values = np.round(values, solution['decimals'])
+
+		# just in case the expression doesn't depend on the parameters
+		self.solution_values = np.broadcast_to(values, (variants,))
+
+		if 'error' in solution:
+
+			self.solution_errors = np.broadcast_to(solution_error(self.solution_values, solution['error']), (variants,))
+
+		# an error was NOT provided
+		else:
+
+			self.solution_errors = None
+
+	def __repr__(self):
+
+		return super().__repr__() + '\n' + f'Variants: {self.variants}'
+
+	@classmethod
+	def problems(cls, settings: dict) -> list[str]:
+
+		res = super().problems(settings)
+
+		if ('solution' in settings) and not (
+				isinstance(settings['solution'], dict) and ('expression' in settings['solution'])):
+
+			res.append('"expression" missing in "solution"')
+
+		if isinstance(settings.get('parameters'), dict):
+
+			texts = [settings.get(t) for t in ('statement', 'feedback') if isinstance(settings.get(t), str)]
+
+			# placeholders referring to something that is not a parameter
+			unknown = {p for t in texts for p in cls.re_placeholder.findall(t) if p not in settings['parameters']}
+
+			if unknown:
+
+				res.append(f'unknown parameters {unknown}')
+
+		return res
+
+	@property
+	def answer(self):
+
+		# placeholders to be replaced with the solution (and error) of every variant
+		return gift.from_numerical_solution(
+			'<<@solution>>', '<<@error>>' if self.solution_errors is not None else None)
+
+	@property
+	def gift(self):
+
+		# the question is processed only once, with the placeholders in place of the actual values
+		template = super().gift.removeprefix(gift.from_question_name(self.name))
+
+		return '\n\n'.join(self.fill_in(template, gift.from_question_name))
+
+	xml_type = 'numerical'
+
+	@property
+	def xml_answer(self):
+
+		return moodle_xml.from_numerical_solution(
+			'<<@solution>>', '<<@error>>' if self.solution_errors is not None else None)
+
+	@property
+	def xml(self):
+
+		# the question is processed only once, and the name (which comes after the opening tag) is taken out
+		head, template = super().xml.split(moodle_xml.from_question_name(self.name), 1)
+
+		return '\n\n'.join(head + variant for variant in self.fill_in(template, moodle_xml.from_question_name))
+
+	def fill_in(self, template: str, from_question_name: Callable[[str], str]) -> list[str]:
+		"""
+		Builds every variant of the question from a template.
+
+		Parameters
+		----------
+		template : str
+			The question (without the name) with placeholders in place of the actual values.
+		from_question_name : Callable[[str], str]
+			Function formatting the name of a variant.
+
+		Returns
+		-------
+		out: list
+			Every variant (preceded by its name).
+
+		"""
+
+		# the template is split into text (even positions) and placeholders (odd positions)
+		pieces = self.re_placeholder.split(template)
+
+		# every parameter (and the solution) as a list of Python numbers, one per variant
+		values = {p: v.tolist() for p, v in self.parameters.items()}
+		values['@solution'] = self.solution_values.tolist()
+
+		if self.solution_errors is not None:
+
+			values['@error'] = self.solution_errors.tolist()
+
+		# the number of digits in the variants' names
+		width = len(str(self.variants))
+
+		res = []
+
+		for i in range(self.variants):
+
+			text = [str(values[p][i]) if j % 2 else p for j, p in enumerate(pieces)]
+
+			res.append(from_question_name(f'{self.name} {i + 1:0{width}d}') + ''.join(text))
+
+		return res
+
 
 class MultipleChoice(HtmlQuestion):
 	"""
@@ -236,10 +695,37 @@ class MultipleChoice(HtmlQuestion):
 
 		self.answers = answers
 
-	@property
-	def answer(self):
+	@classmethod
+	def problems(cls, settings: dict) -> list[str]:
+
+		res = super().problems(settings)
+
+		if ('answers' in settings) and not (
+				isinstance(settings['answers'], dict) and (('wrong' in settings['answers']) or ('partial' in settings['answers']))):
+
+			res.append('either "wrong" or "partial" missing in "answers"')
+
+		return res
 
-		processed_answers = []
+	def graded_answers(self, custom_transforms: list | None = None) -> tuple[str | None, list]:
+		"""
+		Processes the answers.
+
+		Parameters
+		----------
+		custom_transforms : list, optional
+			Transformations to be used instead of `self.custom_transforms` (see `process_text`).
+
+		Returns
+		-------
+		perfect: str or None
+			The answer getting 100% credit, if any.
+		others: list
+			Every other answer as a tuple (text, grade), in which the grade is `None` if not provided.
+
+		"""
+
+		others = []
 
 		# the maximum grade allowed by partially correct answers
 		max_grade = 0.
@@ -258,7 +744,7 @@ class MultipleChoice(HtmlQuestion):
 			# if it is a list
 			if isinstance(a, list):
 
-				processed_answers.append(gift.from_wrong_answer(self.process_text(a[0]), a[1]))
+				others.append((self.process_text(a[0], custom_transforms), a[1]))
 
 				# if the grade is positive...
 				if a[1] > 0:
@@ -269,20 +755,55 @@ class MultipleChoice(HtmlQuestion):
 			# if it is a scalar
 			else:
 
-				processed_answers.append(gift.from_wrong_answer(self.process_text(a)))
+				others.append((self.process_text(a, custom_transforms), None))
 
 		# if a "perfect" (100% credit) was provided...
 		if 'perfect' in self.answers:
 
-			# ...it is added in a special way
-			processed_answers.insert(0, gift.from_perfect_answer(self.process_text(self.answers['perfect'])))
+			perfect = self.process_text(self.answers['perfect'], custom_transforms)
 
 		else:
 
+			perfect = None
+
 			# if it's not possible to get full credit...
 			if max_grade < 100.:
 				print(
 					f"{colors.extra_info}question{colors.reset} \"{self.name}\" {colors.extra_info} won't allow "
 					f"full credit {colors.reset}{max_grade}")
 
+		return perfect, others
+
+	@property
+	def answer(self):
+
+		perfect, others = self.graded_answers()
+
+		processed_answers = [gift.from_wrong_answer(text, grade) for text, grade in others]
+
+		# the "perfect" (100% credit) answer, if any, is added in a special way
+		if perfect is not None:
+
+			processed_answers.insert(0, gift.from_perfect_answer(perfect))
+
 		return '\t' + '\n\t'.join(processed_answers)
+
+	xml_type = 'multichoice'
+
+	@property
+	def xml_answer(self):
+
+		perfect, others = self.graded_answers(self.xml_custom_transforms)
+
+		answers = [moodle_xml.from_answer(text, grade or 0) for text, grade in others]
+
+		if perfect is not None:
+
+			answers.insert(0, moodle_xml.from_answer(perfect, 100))
+
+		# (as in GIFT, several answers can be picked if none of them is worth 100%)
+		single = 'true' if perfect is not None else 'false'
+
+		return (
+			f'\t<single>{single}</single>\n\t<shuffleanswers>true</shuffleanswers>\n'
+			f'\t<answernumbering>abc</answernumbering>\n' + '\n'.join(answers))
@@ -1,10 +1,27 @@
-import sys
+import io
+import os
+import time
+import shlex
+import posixpath
+import shutil
 import socket
+import tarfile
 import pathlib
+import threading
 
 import paramiko
 
+# reflinks (copy-on-write copies) are only available in Linux
+try:
+
+	import fcntl
+
+except ImportError:
+
+	fcntl = None
+
 from . import colors
+from . import errors
 
 class CannotConnectException(Exception):
 	"Raised when a connection could not be established"
@@ -14,19 +31,40 @@ class Connection:
 	connection_not_available_help = (
 		r'(you can try running the program in local mode, by passing "-l", or embedding the images, with "-e")')
 
-	def __init__(self, host: str, user: str, password: str, public_key: str | pathlib.Path):
+	# shell script that unpacks a tar archive (read from the standard input) within directory `at` (made if needed)
+	unpack_script = (
+		'at={at} && mkdir -p "$at" && cd "$at" && tmp=$(mktemp -d .gift-wrapper.XXXXXX) && trap \'rm -rf "$tmp"\' EXIT && '
+		'tar -x -f - -C "$tmp" && (cd "$tmp" && find . -type f) | while IFS= read -r f; do '
+		'mkdir -p "$(dirname "$f")" && mv -f "$tmp/$f" "$f" || exit 1; done')
+
+	def __init__(
+			self, host: str, user: str, password: str, public_key: str | pathlib.Path, bulk: bool = False,
+			port: int = 22):
 
 		self.host = host
+		self.port = port
 		self.user = user
 		self.password = password
 		self.public_key = public_key
 
+		# if `True`, files are not copied right away but rather in one go (in `flush`)
+		self.bulk = bulk
+
+		# files waiting to be copied in bulk mode, as pairs (local file, remote file)
+		self.pending = []
+
 		# to be set in `connect`
 		self.sftp = None
 
+		# contents of remote directories (only retrieved if needed)
+		self.listings = {}
+
 		# useful in `__del__` in the case the connection never gets established
 		self.connection = None
 
+		# bytes sent so far, and the time (in seconds) it took
+		self.sent = {'bytes': 0, 'seconds': 0.}
+
 	def connect(self):
 
 		# if the connection has already been established...
@@ -36,9 +74,8 @@ class Connection:
 
 		if (self.password is not None) and (self.public_key is not None):
 
-			print(f'\n{colors.error}either "password" or "public_key" must be passed, but not both')
-
-			sys.exit(1)
+			raise errors.BuildError(
+				'settings', 'ssh', f'{colors.error}either "password" or "public_key" must be passed, but not both')
 
 		if self.public_key is not None:
 
@@ -47,9 +84,9 @@ class Connection:
 
 			if not public_key.exists():
 
-				print(f'\n{colors.error}public key file, {colors.reset}{public_key}{colors.error}, does not exist')
-
-				sys.exit(1)
+				raise errors.BuildError(
+					'missing file', public_key.as_posix(),
+					f'{colors.error}public key file, {colors.reset}{public_key}{colors.error}, does not exist')
 
 			# below, an actual string is needed
 			public_key = public_key.as_posix()
@@ -68,7 +105,8 @@ class Connection:
 		try:
 
 			# connection is established
-			self.connection.connect(self.host, username=self.user, password=self.password, key_filename=public_key)
+			self.connection.connect(
+				self.host, port=self.port, username=self.user, password=self.password, key_filename=public_key)
 
 		except paramiko.ssh_exception.AuthenticationException as authentication_exception:
 
@@ -123,7 +161,9 @@ class Connection:
 
 			return self.connection.get_transport().is_active()
 
-	def copy(self, source: str | pathlib.Path, remote_directory: str):
+	def copy(
+			self, source: str | pathlib.Path, remote_directory: str, remote_name: str | None = None,
+			overwrite: bool = True):
 
 		if self.connection is None:
 
@@ -134,16 +174,198 @@ class Connection:
 
 		if not local.exists():
 
-			# first character is not visible due to tqdm
-			print(f'\n{colors.reset}file {colors.reset}{local}{colors.error} does not exist')
+			raise errors.BuildError(
+				'missing file', local.as_posix(), f'{colors.reset}file {colors.reset}{local}{colors.error} does not exist')
+
+		remote = remote_directory / (remote_name or local.name)
+
+		# if the file is already there, and it should be left alone...
+		if (not overwrite) and self.exists(remote):
+
+			return
+
+		if self.bulk:
+
+			self.pending.append((local, remote))
+
+		else:
+
+			self.put(local, remote)
+
+		# the listing of the directory (if any) is kept up to date
+		self.listings.get(remote_directory.as_posix(), set()).add(remote.name)
+
+	def put(self, local: pathlib.Path, remote: pathlib.Path):
+
+		self.make_directory_at(remote.parent.relative_to(remote.parts[0]), remote.parts[0])
+
+		started = time.perf_counter()
+
+		destination = self.sftp.normalize(remote.as_posix())
+
+		# the file is uploaded under a temporary name in the same directory...
+		temporary = posixpath.join(
+			posixpath.dirname(destination), f'.{posixpath.basename(destination)}.{os.getpid()}.tmp')
+
+		self.sftp.put(local.as_posix(), temporary)
+
+		# ...and then replaces the destination in one go (so that it is never seen half-written)
+		try:
+
+			self.sftp.posix_rename(temporary, destination)
+
+		# if the server does not support it, a plain rename (which cannot replace an existing file) must do
+		except IOError:
+
+			try:
+
+				self.sftp.remove(destination)
+
+			except IOError:
+
+				pass
+
+			self.sftp.rename(temporary, destination)
+
+		self.sent['bytes'] += local.stat().st_size
+		self.sent['seconds'] += time.perf_counter() - started
+
+	def flush(self):
+		"""
+		Copies every pending file (only meaningful in bulk mode). All the files hanging from the same (remote) root
+		directory are packed in a single tar archive, which is unpacked in the remote host by `tar` (through a single
+		SSH channel) within the deepest directory they all hang from. If that is not possible (e.g., the host doesn't
+		allow executing commands), the files are copied one by one.
+		"""
+
+		# pending files are grouped by the root of their remote path (absolute paths and relative ones are apart)...
+		roots = {}
+
+		for local, remote in self.pending:
+
+			roots.setdefault(remote.parts[0], []).append((local, remote))
+
+		self.pending = []
+
+		for files in roots.values():
+
+			# ...and unpacked as deep as possible (e.g., rather than in "/", where only the superuser can write)
+			root = posixpath.commonpath([remote.parent.as_posix() for _, remote in files]) or '.'
+
+			# the archive is assembled in memory...
+			archive = io.BytesIO()
+
+			with tarfile.open(fileobj=archive, mode='w') as tar:
+
+				for local, remote in files:
+
+					# ...with paths relative to the root
+					tar.add(local.as_posix(), arcname=remote.relative_to(root).as_posix())
+
+			started = time.perf_counter()
+
+			unpacked, output = self.unpack(archive.getvalue(), root)
+
+			if unpacked:
+
+				self.sent['bytes'] += archive.getbuffer().nbytes
+				self.sent['seconds'] += time.perf_counter() - started
+
+			else:
+
+				details = f' ({colors.reset}{output}{colors.info})' if output else ''
+
+				print(f'\n{colors.info}cannot unpack files remotely{details}: copying them one by one')
+
+				for local, remote in files:
+
+					self.put(local, remote)
+
+	def unpack(self, archive: bytes, at: str) -> tuple[bool, str]:
+		"""
+		Unpacks a tar archive in the remote host. The archive is extracted into a temporary directory, and every file
+		is then moved (renamed) into place, so that no file is ever seen half-written.
+
+		Parameters
+		----------
+		archive : bytes
+			Tar archive.
+		at : str
+			Remote directory in which the archive is unpacked.
+
+		Returns
+		-------
+		unpacked: bool
+			`True` if the archive was successfully unpacked.
+		output: str
+			Whatever the remote command printed (errors included).
+
+		"""
+
+		if self.connection is None:
+
+			self.connect()
+
+		try:
+
+			script = self.unpack_script.format(at=shlex.quote(at))
+
+			channel = self.connection.get_transport().open_session()
+
+			# errors are read along with the output so that neither can fill up the channel and stall the command
+			channel.set_combine_stderr(True)
+
+			channel.exec_command(f'sh -c {shlex.quote(script)}')
+
+			output = []
+
+			# the output is drained while the archive is being sent
+			reader = threading.Thread(target=lambda: output.append(channel.makefile('rb').read()), daemon=True)
+			reader.start()
+
+			try:
+
+				# (unlike `channel.sendall`, this does not copy what is left of the archive after every packet)
+				channel.makefile('wb').write(archive)
+
+				# end of the archive
+				channel.shutdown_write()
+
+			# (the command might have given up before reading the whole archive)
+			except OSError:
+
+				pass
+
+			reader.join()
+
+			return channel.recv_exit_status() == 0, b''.join(output).decode(errors='replace').strip()
+
+		except paramiko.ssh_exception.SSHException as e:
+
+			return False, str(e)
+
+	def exists(self, remote: str | pathlib.Path) -> bool:
+
+		if self.connection is None:
+
+			self.connect()
+
+		remote = pathlib.Path(remote)
+
+		directory = remote.parent.as_posix()
+
+		# the content of every directory is only retrieved once
+		if directory not in self.listings:
 
-			sys.exit(1)
+			try:
 
-		self.make_directory_at(remote_directory.relative_to(remote_directory.parts[0]), remote_directory.parts[0])
+				self.listings[directory] = set(self.sftp.listdir(directory))
 
-		remote = remote_directory / local.name
+			except FileNotFoundError:
 
-		self.sftp.put(local.as_posix(), self.sftp.normalize(remote.as_posix()))
+				self.listings[directory] = set()
+
+		return remote.name in self.listings[directory]
 
 	def make_directory_at(self, new: str | pathlib.Path, at: str):
 
@@ -169,6 +391,178 @@ class Connection:
 		self.sftp.chdir(None)
 
 
+class LocalConnection:
+	"""
+	For hosts that are this very machine: images are placed directly in the local filesystem (by means of hardlinks or
+	reflinks when possible, so that no data is actually copied).
+	"""
+
+	# request code of the `ioctl` for cloning a file (`FICLONE` in Linux)
+	clone_request = 0x40049409
+
+	# ways of placing a file, in order of preference
+	methods = ['hardlink', 'reflink', 'copy']
+
+	def __init__(self, host: str, link: str = 'hardlink') -> None:
+		"""
+		Initializer.
+
+		Parameters
+		----------
+		host : str
+			Name of the host (only informative).
+		link : str
+			Preferred way of placing files ("hardlink", "reflink" or "copy"); if not possible, the following ones
+			(in that order) are tried.
+
+		"""
+
+		if link not in self.methods:
+
+			raise errors.BuildError(
+				'settings', link, f'{colors.error}unknown way of placing files {colors.reset}"{link}"{colors.error}'
+				f' (it should be one of {colors.reset}{", ".join(self.methods)}{colors.error})')
+
+		self.host = host
+
+		# the methods that are (still) worth trying
+		self.methods = self.methods[self.methods.index(link):]
+
+		# bytes placed so far, and the time (in seconds) it took
+		self.sent = {'bytes': 0, 'seconds': 0.}
+
+	@staticmethod
+	def is_active():
+
+		return True
+
+	@staticmethod
+	def connect():
+
+		pass
+
+	@staticmethod
+	def local_path(path: str | pathlib.Path) -> pathlib.Path:
+
+		# relative paths are relative to the home directory (as when accessing through SSH)
+		return pathlib.Path.home() / pathlib.Path(path).expanduser()
+
+	def copy(
+			self, source: str | pathlib.Path, remote_directory: str, remote_name: str | None = None,
+			overwrite: bool = True):
+
+		local = pathlib.Path(source)
+
+		if not local.exists():
+
+			raise errors.BuildError(
+				'missing file', local.as_posix(), f'{colors.reset}file {colors.reset}{local}{colors.error} does not exist')
+
+		destination = self.local_path(remote_directory) / (remote_name or local.name)
+
+		if destination.exists():
+
+			# if the file should be left alone, or it is already the same...
+			if (not overwrite) or self.identical(local, destination):
+
+				return
+
+		started = time.perf_counter()
+
+		destination.parent.mkdir(parents=True, exist_ok=True)
+
+		# a temporary file in the same directory as the destination...
+		temporary = destination.with_name(f'.{destination.name}.{os.getpid()}.tmp')
+
+		temporary.unlink(missing_ok=True)
+
+		self.place(local, temporary)
+
+		# ...replaces it in one go (so that it is never seen half-written)
+		os.replace(temporary, destination)
+
+		self.sent['bytes'] += local.stat().st_size
+		self.sent['seconds'] += time.perf_counter() - started
+
+	@staticmethod
+	def identical(a: pathlib.Path, b: pathlib.Path) -> bool:
+		"""
+		Checks (only looking at the metadata) whether two files are the same.
+		"""
+
+		if os.path.samefile(a, b):
+
+			return True
+
+		a, b = a.stat(), b.stat()
+
+		# copies (and reflinks) keep the modification time of the original
+		return (a.st_size == b.st_size) and (a.st_mtime_ns == b.st_mtime_ns)
+
+	def place(self, source: pathlib.Path, destination: pathlib.Path):
+		"""
+		Places a file somewhere else using the first method that works.
+		"""
+
+		for method in self.methods:
+
+			try:
+
+				if method == 'hardlink':
+
+					os.link(source, destination)
+
+				elif method == 'reflink':
+
+					self.reflink(source, destination)
+
+				else:
+
+					shutil.copy2(source, destination)
+
+				return
+
+			# e.g., the files are in different filesystems, or the filesystem does not support it
+			except OSError:
+
+				destination.unlink(missing_ok=True)
+
+				# the method that failed is not tried again (unless it is the last resort)
+				if method != self.methods[-1]:
+
+					self.methods = self.methods[self.methods.index(method) + 1:]
+
+				else:
+
+					raise
+
+	def reflink(self, source: pathlib.Path, destination: pathlib.Path):
+
+		if fcntl is None:
+
+			raise OSError('reflinks are not supported')
+
+		with open(source, 'rb') as s, open(destination, 'wb') as d:
+
+			fcntl.ioctl(d.fileno(), self.clone_request, s.fileno())
+
+		# just like a copy
+		shutil.copystat(source, destination)
+
+	def exists(self, remote: str | pathlib.Path) -> bool:
+
+		return self.local_path(remote).exists()
+
+	@staticmethod
+	def flush():
+
+		pass
+
+	def make_directory_at(self, new: str | pathlib.Path, at: str):
+
+		(self.local_path(at) / new).mkdir(parents=True, exist_ok=True)
+
+
 class FakeConnection:
 	"""
 	For offline runs.
@@ -185,14 +579,29 @@ class FakeConnection:
 
 		return False
 
-	def copy(self, source: str | pathlib.Path, remote_directory: str):
+	def copy(
+			self, source: str | pathlib.Path, remote_directory: str, remote_name: str | None = None,
+			overwrite: bool = True):
 
 		source = pathlib.Path(source)
 
-		if source.as_posix() not in self.already_copied:
+		# (the same file might be copied under different names)
+		key = (source.as_posix(), pathlib.Path(remote_directory).as_posix(), remote_name or source.name)
+
+		if key not in self.already_copied:
+
+			self.already_copied.add(key)
+			self.files_to_copy.append((source, remote_directory, remote_name or source.name))
+
+	@staticmethod
+	def exists(remote: str | pathlib.Path) -> bool:
 
-			self.already_copied.add(source.as_posix())
-			self.files_to_copy.append((source, remote_directory))
+		return False
+
+	@staticmethod
+	def flush():
+
+		pass
 
 	@staticmethod
 	def make_directory_at(new: str, at: str):
@@ -0,0 +1,560 @@
+import os
+import io
+import hmac
+import json
+import time
+import socket
+import ipaddress
+import pathlib
+import argparse
+import threading
+import http.server
+import socketserver
+import multiprocessing
+import concurrent.futures
+
+import yaml
+
+from . import core
+from . import remote
+from . import colors
+from . import errors
+from . import journal
+from . import preflight
+from . import loader
+from . import validator
+
+# state that every worker process keeps across requests
+worker_state = {'connections': {}, 'histories': {}}
+
+
+def destination(parameters: dict | None, pictures_base_directory: str) -> tuple | None:
+	"""
+	Summarizes where images end up.
+
+	Parameters
+	----------
+	parameters : dict or None
+		Parameters (`None` if images are embedded).
+	pictures_base_directory : str
+		Base directory for the images in the remote host.
+
+	Returns
+	-------
+	out: tuple or None
+		Transport, host, port, user, public filesystem root, content-addressed directory and pictures base directory
+		(or `None` if images are embedded).
+
+	"""
+
+	if parameters is None:
+
+		return None
+
+	copy, ssh = parameters['images hosting']['copy'], parameters['images hosting'].get('ssh') or {}
+
+	return (
+		copy.get('transport'), copy.get('host'), ssh.get('port'), ssh.get('user'), copy.get('public filesystem root'),
+		copy.get('content-addressed directory'), pictures_base_directory)
+
+
+def history_for(directory: pathlib.Path, local_run: bool, where: tuple | None) -> tuple[dict, dict]:
+	"""
+	Returns the history (files already compiled/transferred) kept for a directory and a destination of the images,
+	after forgetting about every file that has been modified since it was processed.
+
+	Parameters
+	----------
+	directory : pathlib.Path
+		Working directory of the request.
+	local_run : bool
+		Whether images are copied over to a server (local runs only list the files to be copied).
+	where : tuple or None
+		Where images end up (see `destination`), since a file transferred to one place is not in any other.
+
+	Returns
+	-------
+	history: dict
+		Files already compiled/transferred.
+	stamps: dict
+		Modification time of every file in `history` when it was processed.
+
+	"""
+
+	history, stamps = worker_state['histories'].setdefault(
+		(directory, local_run, where), ({'already compiled': set(), 'already transferred': set()}, {}))
+
+	journal.forget_modified(history, stamps)
+
+	return history, stamps
+
+
+def confined(root: pathlib.Path, path: str | pathlib.Path) -> pathlib.Path:
+	"""
+	Resolves a path relative to a directory, making sure it does not lie outside of it.
+
+	Parameters
+	----------
+	root : pathlib.Path
+		Directory.
+	path : str or pathlib.Path
+		Path (relative to `root`, or absolute).
+
+	Returns
+	-------
+	out: pathlib.Path
+		Absolute path.
+
+	"""
+
+	# (symbolic links are followed)
+	res = (root / path).resolve()
+
+	if not res.is_relative_to(root.resolve()):
+
+		raise ValueError(f'"{path}" is outside of the directory the server was started from')
+
+	return res
+
+
+def is_loopback(host: str) -> bool:
+	"""
+	Checks whether an address (or host name) only allows connections from this very machine.
+	"""
+
+	try:
+
+		return ipaddress.ip_address(host).is_loopback
+
+	# a host name
+	except ValueError:
+
+		try:
+
+			return all(
+				ipaddress.ip_address(info[4][0]).is_loopback for info in socket.getaddrinfo(host, None))
+
+		except socket.gaierror:
+
+			return False
+
+
+def listed(report: errors.Report) -> list[dict]:
+	"""
+	Turns the errors in a report into something that can be serialized (as JSON).
+
+	Parameters
+	----------
+	report : errors.Report
+		Errors.
+
+	Returns
+	-------
+	out: list
+		The "kind", "subject", "category", "question" and "message" of every error.
+
+	"""
+
+	return [
+		{'kind': e.kind, 'subject': e.subject, 'category': c, 'question': q, 'message': e.message.strip()}
+		for e, c, q in report.errors]
+
+
+def build(request: dict) -> dict:
+	"""
+	Builds a GIFT file (as a string). It is meant to be run in a worker process.
+
+	Parameters
+	----------
+	request : dict
+		Questions (either a file, "input_file", or the contents, "bank"), "parameters", working "directory", the "root"
+		directory (files, e.g., included, cannot lie outside of it) and options
+		("local", "no_checks", "embed_images", "strict", "check_sampling", "jobs", "merge_tex",
+		"keep_going", "only_categories", "only_questions", "format").
+
+	Returns
+	-------
+	out: dict
+		Either the "gift" text (or "xml", if requested) or an "error", along with the "timing" of the request (and the "errors" skipped in
+		"keep going" mode, or found in the GIFT text, if any).
+
+	"""
+
+	started = time.time()
+
+	res = {'timing': {'queued': started - request['received']}}
+
+	# just in case something goes wrong before they are actually retrieved
+	history, stamps = {'already compiled': set(), 'already transferred': set()}, {}
+
+	try:
+
+		# relative paths to images in the questions are relative to this
+		os.chdir(request['directory'])
+
+		if 'bank' in request:
+
+			input_data = request['bank']
+
+			# if the actual YAML was passed rather than an already parsed dictionary...
+			if isinstance(input_data, str):
+
+				input_data = yaml.load(input_data, Loader=yaml.SafeLoader)
+
+			# (included files are relative to the working directory)
+			input_data, _ = loader.resolve(input_data, jobs=1, root=pathlib.Path(request['root']))
+
+		else:
+
+			# (workers are already processes of their own, and hence files are parsed one by one)
+			input_data, _ = loader.load(request['input_file'], jobs=1, root=pathlib.Path(request['root']))
+
+		output_format = request.get('format', 'gift')
+
+		# (parameters are only needed for hosting images, which is not done in Moodle XML)
+		parameters = core.read_parameters(request['parameters']) if output_format == 'gift' else None
+
+		embed_images = request.get('embed_images', False) or (parameters is None)
+		local_run = request.get('local', False)
+
+		# only the questions to be built are checked
+		input_data = core.selected(input_data, request.get('only_categories'), request.get('only_questions'))
+
+		findings = preflight.check(input_data, svg_files=embed_images or not local_run)
+
+		# every problem that can be found beforehand is reported at once
+		if findings:
+
+			res['errors'] = listed(findings)
+
+			raise errors.BuildError(
+				'settings', None, f'{len(findings)} problem(s) found in the bank before building (see "errors")')
+
+		history, stamps = history_for(
+			pathlib.Path.cwd(), local_run,
+			None if embed_images else destination(parameters, input_data['pictures base directory']))
+
+		# the key of the connection that can be reused, if any
+		host = None if parameters is None else (
+			parameters['images hosting']['copy'].get('host'), parameters['images hosting'].get('ssh', {}).get('user'))
+
+		pre_transforms, post_transforms, connection = core.make_transforms(
+			parameters, input_data['pictures base directory'], history, local_run, request.get('no_checks', False),
+			embed_images, worker_state['connections'].get(host), request.get('strict', False),
+			request.get('check_sampling', 0.), output_format)
+
+		# a *real* connection is kept for subsequent requests
+		if isinstance(connection, remote.Connection):
+
+			worker_state['connections'][host] = connection
+
+		keep_going = request.get('keep_going', False)
+
+		report = errors.Report() if keep_going else None
+
+		categories = input_data['categories']
+
+		core.compile_figures(
+			categories, core.tex_compiler(pre_transforms), request.get('jobs'), keep_going,
+			request.get('merge_tex', False))
+
+		output = io.StringIO()
+
+		core.write_categories(categories, pre_transforms, post_transforms, output, report, output_format=output_format)
+
+		if connection is not None:
+
+			connection.flush()
+
+		res[output_format] = output.getvalue()
+
+		if report:
+
+			res['errors'] = listed(report)
+
+		# the output is checked for anything that would break, or be mangled by, a Moodle import (as in `core.wrap`)
+		if (output_format == 'gift') and (problems := validator.validate(res['gift'].encode())):
+
+			res['errors'] = res.get('errors', []) + listed(problems)
+
+		if isinstance(connection, remote.FakeConnection):
+
+			res['files to copy'] = [[s.as_posix(), (d / n).as_posix()] for s, d, n in connection.files_to_copy]
+
+	# `errors.BuildError` (a `SystemExit`) is raised when something goes wrong...
+	except SystemExit as e:
+
+		# the actual error message is printed (by the worker) on the server's console
+		res['error'] = str(e.code) if isinstance(e.code, str) else 'processing failed (see the output of the server)'
+
+	except Exception as e:
+
+		res['error'] = f'{type(e).__name__}: {e}'
+
+	# the modification times of files processed for the first time are recorded
+	journal.record_modification_times(history, stamps)
+
+	res['timing']['build'] = time.time() - started
+
+	return res
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+	"""
+	Handles requests to build GIFT files.
+	"""
+
+	def send_json(self, status: int, content: dict):
+
+		body = json.dumps(content).encode()
+
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+
+		self.wfile.write(body)
+
+	def authorized(self) -> bool:
+
+		# if no token was set, only connections from this very machine are accepted (see `serve`)
+		if self.server.token is None:
+
+			return True
+
+		return hmac.compare_digest(self.headers.get('Authorization', ''), f'Bearer {self.server.token}')
+
+	def do_GET(self):
+
+		if self.path != '/health':
+
+			self.send_json(404, {'error': f'unknown path {self.path}'})
+
+			return
+
+		self.send_json(200, {'status': 'ok', 'workers': self.server.workers})
+
+	def do_POST(self):
+
+		received = time.time()
+
+		if self.path != '/build':
+
+			self.send_json(404, {'error': f'unknown path {self.path}'})
+
+			return
+
+		if not self.authorized():
+
+			self.send_json(401, {'error': 'missing or wrong token'})
+
+			return
+
+		try:
+
+			request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+		except json.JSONDecodeError as e:
+
+			self.send_json(400, {'error': f'invalid JSON: {e}'})
+
+			return
+
+		if ('bank' not in request) and ('input_file' not in request):
+
+			self.send_json(400, {'error': 'either "bank" or "input_file" must be passed'})
+
+			return
+
+		if request.get('format', 'gift') not in ('gift', 'xml'):
+
+			self.send_json(400, {'error': '"format" must be either "gift" or "xml"'})
+
+			return
+
+		# (parameters passed as such could, e.g., put images anywhere, or use any SSH key of the server)
+		if ('parameters' in request) and not isinstance(request['parameters'], str):
+
+			self.send_json(400, {'error': '"parameters" must be a file (within the directory of the server)'})
+
+			return
+
+		# relative paths are relative to the directory the server was started from, and no file outside of it is
+		# accessible
+		try:
+
+			request['directory'] = confined(self.server.directory, request.get('directory', '.')).as_posix()
+
+			if 'input_file' in request:
+
+				request['input_file'] = confined(
+					self.server.directory, pathlib.Path(request['directory']) / request['input_file']).as_posix()
+
+			if 'parameters' in request:
+
+				request['parameters'] = confined(self.server.directory, request['parameters']).as_posix()
+
+		except ValueError as e:
+
+			self.send_json(403, {'error': str(e)})
+
+			return
+
+		# (that of the server is trusted)
+		if 'parameters' not in request:
+
+			request['parameters'] = (self.server.directory / self.server.parameters).as_posix()
+
+		request['root'] = self.server.directory.as_posix()
+
+		request['received'] = received
+
+		# if too many requests are already waiting...
+		if not self.server.slots.acquire(blocking=False):
+
+			self.send_json(503, {'error': 'too many pending requests'})
+
+			return
+
+		try:
+
+			response = self.server.executor.submit(build, request).result()
+
+		finally:
+
+			self.server.slots.release()
+
+		response['timing']['total'] = time.time() - received
+
+		self.send_json(422 if 'error' in response else 200, response)
+
+	def address_string(self):
+
+		# for Unix sockets, there is no client address
+		return self.client_address[0] if self.client_address else 'local'
+
+
+class HttpServer(http.server.ThreadingHTTPServer):
+
+	daemon_threads = True
+
+
+class UnixSocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+	daemon_threads = True
+
+
+def serve(
+		parameters: str, host: str = '127.0.0.1', port: int = 8520, socket_file: str | None = None,
+		workers: int | None = None, max_pending: int = 16, token: str | None = None):
+	"""
+	Serves requests to build GIFT files until interrupted.
+
+	Parameters
+	----------
+	parameters : str
+		Default parameters file.
+	host : str
+		Address to listen at.
+	port : int
+		Port to listen at.
+	socket_file : str, optional
+		If passed, a Unix socket is used instead of `host` and `port`.
+	workers : int, optional
+		Number of processes building GIFT files simultaneously (the number of processors by default).
+	max_pending : int
+		Maximum number of requests waiting for a worker (beyond that, they are rejected).
+	token : str, optional
+		If passed, every request must carry it (as "Authorization: Bearer <token>"). It is required to listen at an
+		address other than a loopback one.
+
+	"""
+
+	# anyone who can reach the server can read files and use the credentials in the parameters
+	if (not socket_file) and (token is None) and not is_loopback(host):
+
+		raise errors.BuildError(
+			'settings', host,
+			f'{colors.error}a token (`--token` or the {colors.reset}GIFT_WRAPPER_TOKEN{colors.error} environment variable) '
+			f'is required to listen at {colors.reset}{host}')
+
+	workers = workers or os.cpu_count()
+
+	if socket_file:
+
+		# a stale socket is removed
+		pathlib.Path(socket_file).unlink(missing_ok=True)
+
+		server = UnixSocketServer(socket_file, RequestHandler)
+
+		address = socket_file
+
+	else:
+
+		server = HttpServer((host, port), RequestHandler)
+
+		address = f'http://{host}:{port}'
+
+	server.directory = pathlib.Path.cwd().resolve()
+	server.parameters = parameters
+	server.token = token
+	server.workers = workers
+	server.slots = threading.BoundedSemaphore(workers + max_pending)
+
+	# worker processes are spawned (rather than forked) since the server is multithreaded
+	server.executor = concurrent.futures.ProcessPoolExecutor(
+		max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+	print(f'{colors.info}serving at {colors.reset}{address}{colors.info} with {colors.reset}{workers}{colors.info} workers')
+
+	try:
+
+		server.serve_forever()
+
+	except KeyboardInterrupt:
+
+		pass
+
+	finally:
+
+		server.server_close()
+		server.executor.shutdown(cancel_futures=True)
+
+		if socket_file:
+
+			pathlib.Path(socket_file).unlink(missing_ok=True)
+
+
+def main(arguments: list[str] | None = None):
+	"""Processes command-line arguments and feeds them to `serve`.
+	"""
+
+	parser = argparse.ArgumentParser(
+		prog='gift-wrapper serve', description='Serve (locally) requests to build GIFT files')
+
+	parser.add_argument(
+		'-p', '--parameters_file', default='parameters.yaml', help='default parameters file', nargs='?')
+
+	parser.add_argument('--host', default='127.0.0.1', help='address to listen at')
+
+	parser.add_argument('--port', default=8520, type=int, help='port to listen at')
+
+	parser.add_argument('--socket', default=None, help='Unix socket to listen at (instead of a host and port)')
+
+	parser.add_argument(
+		'-w', '--workers', default=None, type=int, help='number of worker processes (default: number of processors)')
+
+	parser.add_argument(
+		'--max-pending', default=16, type=int, help='requests allowed to wait for a worker before being rejected')
+
+	parser.add_argument(
+		'--token', default=os.environ.get('GIFT_WRAPPER_TOKEN'),
+		help='token every request must carry (required for a non-loopback address); GIFT_WRAPPER_TOKEN by default')
+
+	command_line_arguments = parser.parse_args(arguments)
+
+	serve(
+		parameters=command_line_arguments.parameters_file, host=command_line_arguments.host,
+		port=command_line_arguments.port, socket_file=command_line_arguments.socket,
+		workers=command_line_arguments.workers, max_pending=command_line_arguments.max_pending,
+		token=command_line_arguments.token)
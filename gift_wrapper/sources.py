@@ -0,0 +1,51 @@
+import pathlib
+import contextlib
+import contextvars
+
+# directory relative to which files referenced in the questions are found (the current one if not set)
+directory = contextvars.ContextVar('directory', default=None)
+
+
+def path(file: str | pathlib.Path) -> pathlib.Path:
+	"""
+	Locates a file referenced in the questions.
+
+	Parameters
+	----------
+	file : str or pathlib.Path
+		File, as referenced in the questions.
+
+	Returns
+	-------
+	out: pathlib.Path
+		The file, relative to `directory` if set (and it is not absolute).
+
+	"""
+
+	base = directory.get()
+
+	return pathlib.Path(file) if base is None else base / file
+
+
+@contextlib.contextmanager
+def relative_to(new: str | pathlib.Path):
+	"""
+	Makes files referenced in the questions relative to a directory (rather than the current one) within a context,
+	without affecting other threads.
+
+	Parameters
+	----------
+	new : str or pathlib.Path
+		Directory.
+
+	"""
+
+	token = directory.set(pathlib.Path(new))
+
+	try:
+
+		yield
+
+	finally:
+
+		directory.reset(token)
@@ -1,6 +1,8 @@
 import re
+import time
 import pathlib
 import functools
+import threading
 from typing import Callable
 
 from . import image
@@ -8,6 +10,12 @@ from . import parsing
 from . import remote
 from . import gift
 from . import latex
+from . import formula
+from . import colors
+from . import errors
+from . import workspace
+from . import sources
+from . import moodle_xml
 
 
 def process_paths(
@@ -73,20 +81,167 @@ class TexToSvg(Transformer):
 
 		self.history = history
 
-		def process_match(f):
-
-			# if this file has not been already compiled-converted...
-			if f not in self.history['already compiled']:
-
-				# ...it is...
-				image.pdf_to_svg(image.tex_to_pdf(f))
+		# errors found when compiling files, so that they are not compiled again
+		self.failures = {}
 
-				# ...and a note is made of it
-				self.history['already compiled'].add(f)
+		# time (in seconds) spent compiling (files can be compiled from different threads)
+		self.seconds = 0.
+		self.lock = threading.Lock()
 
 		# (the "\1" in `replacement` refers to matches in `pattern`)
 		self.function = functools.partial(
-			process_paths, pattern=parsing.tex_file_name, process_match=process_match, replacement=r'\1.svg')
+			process_paths, pattern=parsing.tex_file_name, process_match=self.compile, replacement=r'\1.svg')
+
+	def compile(self, f: str):
+		"""
+		Compiles a TeX file (if not already done) into an svg.
+
+		Parameters
+		----------
+		f : str
+			TeX file *without* the ".tex" suffix.
+
+		"""
+
+		# if this file could not be compiled before...
+		if f in self.failures:
+
+			# ...it is not even tried
+			raise self.failures[f]
+
+		# if this file has not been already compiled-converted...
+		if f not in self.history['already compiled']:
+
+			# (the file as found in the filesystem)
+			local = sources.path(f).as_posix()
+
+			before = workspace.stamp(local + '.svg')
+
+			started = time.perf_counter()
+
+			try:
+
+				# ...and no other process is compiling it...
+				with workspace.locked(local + '.tex'):
+
+					# ...nor did it while waiting...
+					if not self.published_meanwhile(local, before):
+
+						# ...it is (in a scratch directory so that no auxiliary files are left behind)...
+						with workspace.get().job() as directory:
+
+							svg = image.pdf_to_svg(image.tex_to_pdf(local, output_directory=directory))
+
+							# ...the svg is (atomically) put next to the source...
+							workspace.publish(svg, local + '.svg')
+
+			except errors.BuildError as e:
+
+				self.failures[f] = e
+
+				raise
+
+			finally:
+
+				with self.lock:
+
+					self.seconds += time.perf_counter() - started
+
+			# ...and a note is made of it
+			self.history['already compiled'].add(f)
+
+	@staticmethod
+	def published_meanwhile(f: str, before: tuple[int, int] | None) -> bool:
+		"""
+		Checks whether the svg of a TeX file was replaced (by another process) since it was stamped.
+
+		Parameters
+		----------
+		f : str
+			TeX file *without* the ".tex" suffix.
+		before : tuple or None
+			Stamp (see `workspace.stamp`) of the svg.
+
+		Returns
+		-------
+		out: bool
+			`True` if there is a new svg, and it is not older than the source.
+
+		"""
+
+		after = workspace.stamp(f + '.svg')
+
+		if (after is None) or (after == before):
+
+			return False
+
+		source = workspace.stamp(f + '.tex')
+
+		return (source is not None) and (after[1] >= source[1])
+
+	def compile_merged(self, files: list[str]):
+		"""
+		Compiles several TeX files (with the same preamble) at once, as the pages of a single document, or one by one
+		if that fails.
+
+		Parameters
+		----------
+		files : list
+			TeX files *without* the ".tex" suffix.
+
+		"""
+
+		files = [f for f in files if (f not in self.history['already compiled']) and (f not in self.failures)]
+
+		if len(files) > 1:
+
+			# (the files as found in the filesystem)
+			local = {f: sources.path(f).as_posix() for f in files}
+
+			before = {f: workspace.stamp(local[f] + '.svg') for f in files}
+
+			started = time.perf_counter()
+
+			try:
+
+				# (as in `compile`)
+				with workspace.locked(*(local[f] + '.tex' for f in files)):
+
+					for f in files:
+
+						if self.published_meanwhile(local[f], before[f]):
+
+							self.history['already compiled'].add(f)
+
+					remaining = [f for f in files if f not in self.history['already compiled']]
+
+					if len(remaining) > 1:
+
+						with workspace.get().job() as directory:
+
+							pdf = image.merged_tex_to_pdf([local[f] for f in remaining], output_directory=directory)
+
+							# every page is turned into the svg of the corresponding file
+							for page, f in enumerate(remaining, start=1):
+
+								svg = image.pdf_to_svg(pdf, directory / f'{page}.svg', page=page)
+
+								workspace.publish(svg, local[f] + '.svg')
+
+								self.history['already compiled'].add(f)
+
+			# if anything goes wrong, (the rest of) the files are compiled separately
+			except errors.BuildError:
+
+				pass
+
+			with self.lock:
+
+				self.seconds += time.perf_counter() - started
+
+		for f in files:
+
+			self.compile(f)
 
 
 class SvgToHttp(Transformer):
@@ -96,28 +251,79 @@ class SvgToHttp(Transformer):
 
 	def __init__(
 			self, history: dict, connection: remote.Connection, public_filesystem_root: str,
-			pictures_base_directory: str, public_url: str):
+			pictures_base_directory: str, public_url: str, content_addressed_directory: str | None = None,
+			precompressed: bool = False):
 
 		super().__init__()
 
 		self.history = history
 
-		# assembled remote path
-		remote_subdirectory = pathlib.Path(public_filesystem_root).joinpath(pictures_base_directory)
+		# if images are to be named after their content...
+		if content_addressed_directory:
+
+			# ...they are all put together in a directory that is shared by every bank
+			remote_subdirectory = pathlib.Path(public_filesystem_root).joinpath(content_addressed_directory)
+
+		else:
+
+			# assembled remote path
+			remote_subdirectory = pathlib.Path(public_filesystem_root).joinpath(pictures_base_directory)
+
+		# the name of every (local) file after its content (if needed)
+		self.content_names = {}
 
 		def replacement_function(m: re.Match) -> str:
 
 			file = pathlib.Path(m.group(0))
 
+			if content_addressed_directory:
+
+				return public_url + content_addressed_directory + '/' + self.content_names[m.group(0)]
+
 			return public_url + pictures_base_directory + '/' + file.as_posix()
 
 		def process_match(f):
 
+			if (content_addressed_directory or precompressed) and (f not in self.content_names):
+
+				if not sources.path(f).exists():
+
+					raise errors.BuildError(
+						'missing file', f, f'{colors.reset}file {colors.reset}{f}{colors.error} does not exist')
+
+				self.content_names[f] = image.content_name(sources.path(f))
+
 			# if this file has not been already transferred...
 			if f not in self.history['already transferred']:
 
 				# ...it is...
-				connection.copy(f, remote_directory=remote_subdirectory / pathlib.Path(f).parent)
+				if content_addressed_directory:
+
+					# (a file with the same name has, by construction, the same content)
+					connection.copy(
+						sources.path(f), remote_directory=remote_subdirectory, remote_name=self.content_names[f],
+						overwrite=False)
+
+				else:
+
+					connection.copy(sources.path(f), remote_directory=remote_subdirectory / pathlib.Path(f).parent)
+
+				# if requested, a compressed version is put next to it (for the web server to serve it as is)
+				if precompressed:
+
+					compressed = image.compressed(sources.path(f), self.content_names[f])
+
+					if content_addressed_directory:
+
+						connection.copy(
+							compressed, remote_directory=remote_subdirectory, remote_name=self.content_names[f] + '.gz',
+							overwrite=False)
+
+					else:
+
+						connection.copy(
+							compressed, remote_directory=remote_subdirectory / pathlib.Path(f).parent,
+							remote_name=pathlib.Path(f).name + '.gz')
 
 				# ...and a note is made of the fact
 				self.history['already transferred'].add(f)
@@ -136,14 +342,45 @@ class SvgToInline(Transformer):
 
 		super().__init__()
 
+		def process_match(f):
+
+			if not sources.path(f).exists():
+
+				raise errors.BuildError(
+					'missing file', f, f'{colors.reset}file {colors.reset}{f}{colors.error} does not exist')
+
 		def replacement_function(m: re.Match) -> str:
 
-			file = pathlib.Path(m.group(1))
+			# the svg is only actually read when the output is written (see `image.write`)
+			return image.inline_svg_marker(m.group(1))
+
+		self.function = functools.partial(
+			process_paths, pattern=parsing.svg_file, process_match=process_match, replacement=replacement_function)
+
+
+class SvgToFile(Transformer):
+	"""
+	Transformer to attach svg files to the questions (only meaningful in Moodle XML).
+	"""
+
+	def __init__(self):
+
+		super().__init__()
+
+		def process_match(f):
+
+			if not sources.path(f).exists():
+
+				raise errors.BuildError(
+					'missing file', f, f'{colors.reset}file {colors.reset}{f}{colors.error} does not exist')
 
-			return image.svg_to_html(file)
+		def replacement_function(m: re.Match) -> str:
+
+			return moodle_xml.plugin_file + moodle_xml.attach(m.group(0))
 
 		self.function = functools.partial(
-			process_paths, pattern=parsing.svg_file, process_match=lambda x: None, replacement=replacement_function)
+			process_paths, pattern=parsing.url_less_svg_file, process_match=process_match,
+			replacement=replacement_function)
 
 
 class URLs(Transformer):
@@ -151,12 +388,18 @@ class URLs(Transformer):
 	Transformer to arrange URLs into a GIFT-appropriate format.
 	"""
 
-	url = f'http({parsing.regex_url_valid_character}+)(?!{parsing.regex_url_valid_character})'
+	# (files attached to a question in Moodle XML are also referred to by a URL of sorts)
+	url = (
+		f'(?:http|{moodle_xml.plugin_file})({parsing.regex_url_valid_character}+)'
+		f'(?!{parsing.regex_url_valid_character})')
 
-	def __init__(self, images_settings: dict | None = None):
+	def __init__(self, images_settings: dict | None = None, escape: bool = True):
 
 		super().__init__()
 
+		# whether characters that are special in GIFT are escaped
+		self.escape = escape
+
 		if images_settings is None:
 
 			self.images_width, self.images_height = None, None
@@ -170,9 +413,20 @@ class URLs(Transformer):
 
 		self.function = lambda text: re.sub(self.url, self.replacement, text)
 
+	# transformers with the same settings are interchangeable (e.g., when looking up text already processed)
+	def __eq__(self, other) -> bool:
+
+		return isinstance(other, URLs) and (
+			(self.images_width, self.images_height, self.escape) == (other.images_width, other.images_height, other.escape))
+
+	def __hash__(self) -> int:
+
+		return hash((self.images_width, self.images_height, self.escape))
+
 	def replacement(self, m: re.Match) -> str:
 
-		return '<p>' + gift.from_image_url(m.group(0), width=self.images_width, height=self.images_height) + '<br></p>'
+		return '<p>' + gift.from_image_url(
+			m.group(0), width=self.images_width, height=self.images_height, escape=self.escape) + '<br></p>'
 
 
 class LatexCommandsWithinText(Transformer):
@@ -208,13 +462,53 @@ class LatexFormulas(Transformer):
 
 	latex_formula = r'\$([^\$]*)\$'
 
-	def __init__(self, check_compliance: bool) -> None:
+	# a "$" that is not escaped
+	dollar = r'(?<!\\)\$'
+
+	# LaTeX markup (a command, a subscript or a superscript)
+	markup = r'\\[a-zA-Z]|[_^]'
+
+	def __init__(
+			self, check_compliance: bool, strict: bool = False, sampling: float = 0.,
+			formatter: Callable[[str], str] = gift.from_latex_formula) -> None:
+		"""
+		Initializer.
+
+		Parameters
+		----------
+		check_compliance : bool
+			Whether formulas are checked.
+		strict : bool
+			If `True`, every formula is compiled; otherwise, only those that cannot be proven fine by
+			`formula.check` (or sampled) are.
+		sampling : float
+			Fraction of the formulas proven fine that are compiled anyway.
+		formatter : Callable[[str], str]
+			Function adapting a formula to the output format.
+		"""
 
 		super().__init__()
 
 		self.check_compliance = check_compliance
+		self.formatter = formatter
+		self.strict = strict
+		self.sampling = sampling
 
-		self.function = lambda text: re.sub(self.latex_formula, self.replacement, text)
+		def f(text: str) -> str:
+
+			if self.check_compliance:
+
+				dollars = [m.start() for m in re.finditer(self.dollar, text)]
+
+				# an odd number of (unescaped) "$"s means a formula is not closed, as long as the last one is followed
+				# by LaTeX (rather than being, e.g., part of an amount of money)
+				if (len(dollars) % 2) and re.search(self.markup, text[dollars[-1] + 1:]):
+
+					raise gift.NotCompliantLatexFormula(text[dollars[-1]:], 'unbalanced "$"')
+
+			return re.sub(self.latex_formula, self.replacement, text)
+
+		self.function = f
 
 	def replacement(self, m: re.Match) -> str:
 
@@ -222,7 +516,23 @@ class LatexFormulas(Transformer):
 
 		if self.check_compliance:
 
-			if not latex.formula_can_be_compiled(latex_source):
+			if self.strict:
+
+				compile_formula = True
+
+			else:
+
+				verdict = formula.check(latex_source)
+
+				# a formula that cannot be compiled for sure doesn't need to be compiled
+				if verdict is False:
+
+					raise gift.NotCompliantLatexFormula(latex_source, formula.problem(latex_source))
+
+				compile_formula = (verdict is None) or formula.sampled(latex_source, self.sampling)
+
+			if compile_formula and (not latex.formula_can_be_compiled(latex_source)):
+
 				raise gift.NotCompliantLatexFormula(latex_source)
 
-		return gift.from_latex_formula(latex_source)
+		return self.formatter(latex_source)
@@ -0,0 +1,345 @@
+import os
+import mmap
+import pathlib
+
+from . import colors
+from . import errors
+from . import parsing
+
+
+def validate_file(input_file: str | pathlib.Path) -> errors.Report:
+	"""
+	Checks a GIFT file (see `validate`). The file is memory-mapped, and hence it is never loaded in memory as a whole.
+
+	Parameters
+	----------
+	input_file : str or pathlib.Path
+		GIFT file.
+
+	Returns
+	-------
+	out: errors.Report
+		Every problem found.
+
+	"""
+
+	with open(input_file, 'rb') as f:
+
+		# an empty file cannot be memory-mapped
+		if os.fstat(f.fileno()).st_size == 0:
+
+			return errors.Report()
+
+		with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+
+			return validate(content)
+
+
+def validate(content: bytes | mmap.mmap) -> errors.Report:
+	"""
+	Checks GIFT text, in a single pass, for anything that would make a Moodle import fail (or silently mangle some
+	questions): characters that are special in GIFT and not escaped (in the text, the answers or the feedback),
+	unbalanced braces, and answers with a wrong syntax.
+
+	Parameters
+	----------
+	content : bytes or mmap.mmap
+		GIFT text (encoded).
+
+	Returns
+	-------
+	out: errors.Report
+		Every problem found, along with the category and question in which it was found, and its offset (in bytes).
+
+	"""
+
+	res = errors.Report()
+
+	# the current category and question
+	where = {'category': None, 'question': None}
+
+	# line numbers are counted incrementally, from the last problem found (usually right before)
+	lines = {'offset': 0, 'line': 1}
+
+	def add(offset: int, message: str):
+
+		if offset >= lines['offset']:
+
+			lines['line'] += content[lines['offset']:offset].count(b'\n')
+
+		else:
+
+			lines['line'] -= content[offset:lines['offset']].count(b'\n')
+
+		lines['offset'] = offset
+
+		res.add(
+			errors.BuildError(
+				'gift', f'offset {offset}',
+				f'{colors.error}{message} {colors.reset}(line {lines["line"]}, offset {offset})'),
+			where['category'], where['question'])
+
+	position = 0
+
+	while True:
+
+		between = parsing.re_gift_between.match(content, position)
+
+		# the last category (if any) applies to the questions that follow
+		for m in parsing.re_gift_category.finditer(content, between.start(), between.end()):
+
+			where['category'] = m.group(1).strip().decode(errors='replace')
+
+		position = between.end()
+
+		if position >= len(content):
+
+			break
+
+		name = parsing.re_gift_question_name.match(content, position)
+
+		if name is None:
+
+			where['question'] = None
+
+			add(position, 'expected a question (starting with "::<name>::")')
+
+			# the next question is looked for
+			position = content.find(b'\n::', position)
+
+			if position < 0:
+
+				break
+
+			continue
+
+		where['question'] = name.group(1).decode(errors='replace')
+
+		position = check_question(content, name.end(), add)
+
+	return res
+
+
+def check_question(content: bytes | mmap.mmap, start: int, add) -> int:
+	"""
+	Checks the text and the answers of a question.
+
+	Parameters
+	----------
+	content : bytes or mmap.mmap
+		GIFT text.
+	start : int
+		Offset of the text of the question (right after its name).
+	add : Callable[[int, str], None]
+		Function recording a problem given its offset and message.
+
+	Returns
+	-------
+	out: int
+		Offset right after the question.
+
+	"""
+
+	specials = unescaped_specials(content, start)
+
+	# characters in the text that should have been escaped (only the first one is reported)
+	unescaped = []
+
+	for c, offset in specials:
+
+		if c == b'{':
+
+			opening = offset
+
+			break
+
+		unescaped.append((c, offset))
+
+	else:
+
+		opening = None
+
+	if unescaped:
+
+		report_unescaped(unescaped, 'the text', add)
+
+	if opening is None:
+
+		add(start, 'missing answers (no "{")')
+
+		return len(content)
+
+	# unescaped "=", "~" and "#" within the answers
+	tokens = []
+
+	for c, offset in specials:
+
+		if c == b'}':
+
+			check_answers(content, opening, offset, tokens, add)
+
+			return offset + 1
+
+		if c == b'{':
+
+			add(offset, 'unescaped "{" within the answers (or missing "}" before it)')
+
+			continue
+
+		tokens.append((c, offset))
+
+	add(opening, 'unbalanced "{" (no "}" after it)')
+
+	return len(content)
+
+
+def unescaped_specials(content: bytes | mmap.mmap, start: int):
+	"""
+	Goes through every character that is special in GIFT and not escaped.
+
+	Parameters
+	----------
+	content : bytes or mmap.mmap
+		GIFT text.
+	start : int
+		Offset from which characters are looked for.
+
+	Yields
+	------
+	out: tuple
+		Character and offset.
+
+	"""
+
+	for m in parsing.re_gift_special.finditer(content, start):
+
+		offset = m.start()
+
+		# if preceded by (two or more) backslashes...
+		if (offset > 0) and (content[offset - 1] == ord('\\')):
+
+			first = offset - 1
+
+			while (first > 0) and (content[first - 1] == ord('\\')):
+
+				first -= 1
+
+			# ...it is escaped if their number is odd
+			if (offset - first) % 2:
+
+				continue
+
+		yield m.group(), offset
+
+
+def report_unescaped(tokens: list, where: str, add):
+
+	others = f' (and {len(tokens) - 1} more)' if len(tokens) > 1 else ''
+
+	add(tokens[0][1], f'unescaped "{tokens[0][0].decode()}" in {where}{others}')
+
+
+def check_answers(content: bytes | mmap.mmap, opening: int, closing: int, tokens: list, add):
+	"""
+	Checks the syntax of the answers of a question.
+
+	Parameters
+	----------
+	content : bytes or mmap.mmap
+		GIFT text.
+	opening : int
+		Offset of the "{" opening the answers.
+	closing : int
+		Offset of the "}" closing the answers.
+	tokens : list
+		Every (unescaped) "=", "~" and "#" in between, along with its offset.
+
+	"""
+
+	# the general feedback ("####"), if any, goes last
+	for i in range(len(tokens) - 3):
+
+		if all((c == b'#') and (offset == tokens[i][1] + j) for j, (c, offset) in enumerate(tokens[i:i + 4])):
+
+			if tokens[i + 4:]:
+
+				report_unescaped(tokens[i + 4:], 'the feedback', add)
+
+			# the answers end where the feedback starts
+			tokens, closing = tokens[:i], tokens[i][1]
+
+			break
+
+	def segment(i: int) -> bytes:
+
+		# the text between a token and the next one
+		return content[tokens[i][1] + 1:tokens[i + 1][1] if i + 1 < len(tokens) else closing]
+
+	leading = content[opening + 1:tokens[0][1] if tokens else closing]
+
+	# an essay (nothing at all) or a true/false question
+	if (not leading.strip()) and (not tokens):
+
+		return
+
+	if parsing.re_gift_true_false.fullmatch(leading):
+
+		# up to two pieces of feedback (one for every answer) can follow
+		for _ in range(2):
+
+			if tokens and (tokens[0][0] == b'#'):
+
+				tokens = tokens[1:]
+
+		if tokens:
+
+			report_unescaped(tokens, 'the feedback', add)
+
+		return
+
+	if leading.strip():
+
+		add(opening + 1, 'answers should start with "=", "~" or "#"')
+
+		return
+
+	numerical = tokens[0][0] == b'#'
+
+	# (in a numerical question, the first "#" is not a feedback)
+	first = 1 if numerical else 0
+
+	# a numerical question can have a single answer with no "="
+	if numerical and all(c == b'#' for c, _ in tokens):
+
+		if not parsing.re_gift_numerical_answer.fullmatch(segment(0)):
+
+			add(tokens[0][1] + 1, 'wrong numerical answer')
+
+		return
+
+	previous = None
+
+	for i in range(first, len(tokens)):
+
+		c, offset = tokens[i]
+
+		if c == b'#':
+
+			# a "#" (feedback) can only come right after an answer
+			if previous != 'answer':
+
+				add(offset, 'unescaped "#" (feedback) not following an answer')
+
+			previous = 'feedback'
+
+			continue
+
+		previous = 'answer'
+
+		if numerical and not parsing.re_gift_numerical_answer.fullmatch(segment(i)):
+
+			add(offset + 1, 'wrong numerical answer')
+
+		elif (not numerical) and segment(i).lstrip().startswith(b'%') and not parsing.re_gift_grade.match(segment(i)):
+
+			add(offset + 1, 'wrong grade (it should be a number between "%"s)')
@@ -0,0 +1,296 @@
+import os
+import atexit
+import shutil
+import getpass
+import pathlib
+import tempfile
+import threading
+import contextlib
+
+# file locking is only available in Unix
+try:
+
+	import fcntl
+
+except ImportError:
+
+	fcntl = None
+
+# environment variable that can be used to set the root of the workspace
+root_variable = 'GIFT_WRAPPER_WORKSPACE'
+
+# the workspace used by this process (set up in `get` or `configure`)
+current = None
+
+
+def default_root() -> pathlib.Path:
+	"""
+	Picks the directory in which the workspace is made.
+
+	Returns
+	-------
+	out: pathlib.Path
+		The directory given by the environment variable `root_variable` if set, or a memory-backed (tmpfs) directory
+		if available, or the system's temporary directory otherwise.
+
+	"""
+
+	if root_variable in os.environ:
+
+		return pathlib.Path(os.environ[root_variable])
+
+	shared_memory = pathlib.Path('/dev/shm')
+
+	if shared_memory.is_dir() and os.access(shared_memory, os.W_OK):
+
+		return shared_memory
+
+	return pathlib.Path(tempfile.gettempdir())
+
+
+def process_is_alive(pid: int) -> bool:
+	"""
+	Checks whether a process is running.
+
+	Parameters
+	----------
+	pid : int
+		Process identifier.
+
+	Returns
+	-------
+	out: bool
+		`False` only if the process is known *not* to be running.
+
+	"""
+
+	try:
+
+		os.kill(pid, 0)
+
+	except ProcessLookupError:
+
+		return False
+
+	# e.g., the process belongs to another user, or signals cannot be sent (Windows)
+	except OSError:
+
+		return True
+
+	return True
+
+
+class Workspace:
+	"""
+	Scratch directories in which TeX files are compiled.
+
+	Every process gets its own directory, inside of which every compilation job gets a subdirectory that is emptied
+	and reused afterwards. Directories left behind by processes that are no longer running are removed.
+	"""
+
+	def __init__(self, root: str | pathlib.Path | None = None) -> None:
+
+		root = pathlib.Path(root).expanduser() if root else default_root()
+
+		# shared by every process of the user
+		self.base = root / f'gift-wrapper-{getpass.getuser()}'
+
+		# only for this process
+		self.directory = self.base / str(os.getpid())
+
+		self.directory.mkdir(parents=True, exist_ok=True)
+
+		self.remove_stale()
+
+		# subdirectories that can be reused
+		self.free = []
+
+		# number of subdirectories made so far
+		self.count = 0
+
+		# jobs can be requested from different threads
+		self.lock = threading.Lock()
+
+		atexit.register(self.remove)
+
+	def remove_stale(self):
+
+		for directory in self.base.iterdir():
+
+			# if the directory belongs to a process that is not running anymore...
+			if directory.name.isdigit() and not process_is_alive(int(directory.name)):
+
+				# ...it is removed
+				shutil.rmtree(directory, ignore_errors=True)
+
+	def remove(self):
+
+		shutil.rmtree(self.directory, ignore_errors=True)
+
+	@contextlib.contextmanager
+	def job(self):
+		"""
+		Provides an empty directory for the exclusive use of a compilation job.
+
+		Yields
+		------
+		out: pathlib.Path
+			Directory.
+
+		"""
+
+		with self.lock:
+
+			if self.free:
+
+				directory = self.free.pop()
+
+			else:
+
+				self.count += 1
+
+				directory = self.directory / str(self.count)
+
+		directory.mkdir(parents=True, exist_ok=True)
+
+		try:
+
+			yield directory
+
+		finally:
+
+			# the directory is emptied...
+			for f in directory.iterdir():
+
+				if f.is_dir():
+
+					shutil.rmtree(f, ignore_errors=True)
+
+				else:
+
+					f.unlink(missing_ok=True)
+
+			# ...and can be reused
+			with self.lock:
+
+				self.free.append(directory)
+
+
+def get() -> Workspace:
+	"""
+	Returns the workspace of this process.
+
+	Returns
+	-------
+	out: Workspace
+		The workspace, which is made on first use.
+
+	"""
+
+	global current
+
+	if current is None:
+
+		current = Workspace()
+
+	return current
+
+
+def configure(root: str | pathlib.Path | None):
+	"""
+	Sets the directory in which the workspace is made.
+
+	Parameters
+	----------
+	root : str or pathlib.Path or None
+		Directory (`None` for the default, see `default_root`).
+
+	"""
+
+	global current
+
+	if current is not None:
+
+		current.remove()
+
+	current = Workspace(root)
+
+
+def publish(source: str | pathlib.Path, destination: str | pathlib.Path) -> pathlib.Path:
+	"""
+	Copies a file atomically, i.e., `destination` is never seen half-written.
+
+	Parameters
+	----------
+	source : str or pathlib.Path
+		File to be copied.
+	destination : str or pathlib.Path
+		Copy.
+
+	Returns
+	-------
+	out: pathlib.Path
+		The copy.
+
+	"""
+
+	destination = pathlib.Path(destination)
+
+	# a temporary file in the same directory (and hence filesystem) as the destination...
+	temporary = destination.with_name(f'.{destination.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+
+	shutil.copyfile(source, temporary)
+
+	# ...replaces it in one go
+	os.replace(temporary, destination)
+
+	return destination
+
+
+@contextlib.contextmanager
+def locked(*files: str | pathlib.Path):
+	"""
+	Holds an exclusive lock on some files, so that no other process (e.g., one building another bank that shares the
+	same figures) can work on them at the same time. Files that do not exist (or if locking is not available) are
+	ignored.
+
+	Parameters
+	----------
+	*files : str or pathlib.Path
+		Files to be locked (always in the same order, so that two processes never wait for each other).
+
+	"""
+
+	with contextlib.ExitStack() as stack:
+
+		for f in (sorted(set(pathlib.Path(f).resolve() for f in files)) if fcntl is not None else []):
+
+			try:
+
+				handle = stack.enter_context(open(f, 'rb'))
+
+			except FileNotFoundError:
+
+				continue
+
+			# (the lock is released when the file is closed)
+			fcntl.flock(handle, fcntl.LOCK_EX)
+
+		yield
+
+
+def stamp(f: str | pathlib.Path) -> tuple[int, int] | None:
+	"""
+	Returns the inode and modification time (in nanoseconds) of a file, which change whenever it is replaced (e.g.,
+	by `publish`), or `None` if it does not exist.
+	"""
+
+	try:
+
+		status = os.stat(f)
+
+	except FileNotFoundError:
+
+		return None
+
+	return status.st_ino, status.st_mtime_ns
@@ -14,6 +14,7 @@ setuptools.setup(
     url="https://github.com/manuvazquez/gift-wrapper",
     packages=setuptools.find_packages(),
     install_requires=['paramiko>=2.7.1', 'colorama>=0.4.3', 'PyYAML>=5.3.1', 'tqdm>=4.44.1'],
+    extras_require={'parametric': ['numpy>=1.17'], 'pdf': ['pymupdf>=1.24']},
     classifiers=[
         "Programming Language :: Python :: 3",
         "Environment :: Console",
@@ -22,6 +23,6 @@ setuptools.setup(
     ],
     python_requires='>=3.10',
     entry_points={
-        'console_scripts': ['wrap.py=gift_wrapper.core:main'],
+        'console_scripts': ['wrap.py=gift_wrapper.core:main', 'gift-wrapper=gift_wrapper.core:main'],
     }
 )
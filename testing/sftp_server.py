@@ -0,0 +1,518 @@
+"""
+A local stand-in for the host images are copied to: an SFTP (over SSH) server, built on paramiko, that stores files in
+a local directory and (optionally) simulates a slow network.
+
+It can be run on its own, e.g.,
+```
+python sftp_server.py --root /tmp/remote --latency 20 --bandwidth 10
+```
+and then reached by setting `host: 127.0.0.1` (under `copy`) and `port`, `user` and `password` (under `ssh`) in the
+parameters file, or used from Python (see `upload_benchmark.py`).
+"""
+
+import io
+import os
+import sys
+import time
+import shlex
+import socket
+import tarfile
+import pathlib
+import argparse
+import tempfile
+import threading
+
+import paramiko
+
+# so that the package can be imported from this directory
+sys.path.insert(0, pathlib.Path(__file__).resolve().parent.parent.as_posix())
+
+import gift_wrapper.remote
+
+
+def unpack_directory(script: str) -> str | None:
+	"""
+	Extracts the directory from the script used to unpack archives (see `remote.Connection.unpack_script`).
+
+	Parameters
+	----------
+	script : str
+		Shell script.
+
+	Returns
+	-------
+	out: str or None
+		The directory in which the archive is unpacked, or `None` if the script is not the expected one.
+
+	"""
+
+	prefix, suffix = gift_wrapper.remote.Connection.unpack_script.split('{at}')
+
+	if not (script.startswith(prefix) and script.endswith(suffix)):
+
+		return None
+
+	try:
+
+		arguments = shlex.split(script[len(prefix):len(script) - len(suffix)])
+
+	except ValueError:
+
+		return None
+
+	return arguments[0] if len(arguments) == 1 else None
+
+
+class Server:
+	"""
+	SFTP server listening in a local port.
+	"""
+
+	def __init__(
+			self, root: str | pathlib.Path, user: str = 'gift', password: str = 'wrapper', port: int = 0,
+			latency: float = 0., bandwidth: float | None = None) -> None:
+		"""
+		Initializer.
+
+		Parameters
+		----------
+		root : str or pathlib.Path
+			Local directory playing the role of the remote filesystem (remote paths are relative to it).
+		user : str
+			The only user accepted.
+		password : str
+			Password of the user.
+		port : int
+			Port to listen at (0 for any free port, see `port` after `start`).
+		latency : float
+			Delay (in seconds) added to every request that needs a round trip.
+		bandwidth : float, optional
+			Maximum transfer rate (in bytes per second) of file contents.
+
+		"""
+
+		self.root = pathlib.Path(root).resolve()
+		self.user = user
+		self.password = password
+		self.latency = latency
+		self.bandwidth = bandwidth
+
+		self.root.mkdir(parents=True, exist_ok=True)
+
+		self.host_key = paramiko.ECDSAKey.generate()
+
+		self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.socket.bind(('127.0.0.1', port))
+
+		self.port = self.socket.getsockname()[1]
+
+		self.transports = []
+
+		self.thread = None
+
+	def start(self) -> 'Server':
+
+		self.socket.listen(16)
+
+		self.thread = threading.Thread(target=self.accept, daemon=True)
+		self.thread.start()
+
+		return self
+
+	def stop(self):
+
+		self.socket.close()
+
+		for transport in self.transports:
+
+			transport.close()
+
+	def __enter__(self) -> 'Server':
+
+		return self.start()
+
+	def __exit__(self, *exception):
+
+		self.stop()
+
+	def accept(self):
+
+		while True:
+
+			try:
+
+				client, _ = self.socket.accept()
+
+			# the socket was closed
+			except OSError:
+
+				return
+
+			transport = paramiko.Transport(client)
+			transport.add_server_key(self.host_key)
+			transport.set_subsystem_handler('sftp', paramiko.SFTPServer, FileSystem)
+			transport.start_server(server=Authorization(self))
+
+			self.transports.append(transport)
+
+	def wait(self):
+		"""
+		Simulates a round trip.
+		"""
+
+		if self.latency:
+
+			time.sleep(self.latency)
+
+	def throttle(self, n_bytes: int):
+		"""
+		Simulates the time it takes to transfer some bytes.
+		"""
+
+		if self.bandwidth:
+
+			time.sleep(n_bytes / self.bandwidth)
+
+	def local(self, path: str) -> pathlib.Path:
+		"""
+		Maps a remote path into the local filesystem.
+		"""
+
+		# every path is relative to the root
+		return self.root / os.path.normpath('/' + path).lstrip('/')
+
+
+class Authorization(paramiko.ServerInterface):
+
+	def __init__(self, server: Server) -> None:
+
+		self.server = server
+
+	def get_allowed_auths(self, username: str) -> str:
+
+		return 'password'
+
+	def check_auth_password(self, username: str, password: str) -> int:
+
+		if (username, password) == (self.server.user, self.server.password):
+
+			return paramiko.AUTH_SUCCESSFUL
+
+		return paramiko.AUTH_FAILED
+
+	def check_channel_request(self, kind: str, chanid: int) -> int:
+
+		if kind == 'session':
+
+			return paramiko.OPEN_SUCCEEDED
+
+		return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+	def check_channel_exec_request(self, channel: paramiko.Channel, command: bytes) -> bool:
+
+		arguments = shlex.split(command.decode())
+
+		# only the script used to unpack archives (see `remote.Connection.unpack`) is supported
+		if (len(arguments) != 3) or (arguments[:2] != ['sh', '-c']):
+
+			return False
+
+		directory = unpack_directory(arguments[2])
+
+		if directory is None:
+
+			return False
+
+		threading.Thread(target=self.unpack, args=(channel, directory), daemon=True).start()
+
+		return True
+
+	def unpack(self, channel: paramiko.Channel, directory: str):
+
+		archive = io.BytesIO()
+
+		while data := channel.recv(1 << 16):
+
+			self.server.throttle(len(data))
+
+			archive.write(data)
+
+		archive.seek(0)
+
+		try:
+
+			# as for any user but the superuser in an actual host, nothing can be made right in "/"
+			if os.path.normpath(directory) == '/':
+
+				raise PermissionError(f'cannot write in "{directory}": permission denied')
+
+			directory = self.server.local(directory)
+
+			directory.mkdir(parents=True, exist_ok=True)
+
+			# as the script does, the archive is extracted into a temporary directory...
+			with tempfile.TemporaryDirectory(prefix='.gift-wrapper.', dir=directory) as scratch:
+
+				with tarfile.open(fileobj=archive) as tar:
+
+					tar.extractall(scratch, filter='data')
+
+				# ...and every file is then moved into place
+				for f in [f for f in pathlib.Path(scratch).rglob('*') if f.is_file()]:
+
+					destination = directory / f.relative_to(scratch)
+
+					destination.parent.mkdir(parents=True, exist_ok=True)
+
+					os.replace(f, destination)
+
+			status = 0
+
+		except (tarfile.TarError, OSError) as e:
+
+			channel.send_stderr(f'{e}\n'.encode())
+
+			status = 2
+
+		self.server.wait()
+
+		channel.send_exit_status(status)
+		channel.close()
+
+
+class File(paramiko.SFTPHandle):
+
+	def __init__(self, server: Server, f: io.FileIO, flags: int) -> None:
+
+		super().__init__(flags)
+
+		self.server = server
+
+		# the base class reads from and writes to these
+		self.readfile = f
+		self.writefile = f
+
+	def write(self, offset: int, data: bytes) -> int:
+
+		self.server.throttle(len(data))
+
+		return super().write(offset, data)
+
+	def read(self, offset: int, length: int) -> bytes | int:
+
+		data = super().read(offset, length)
+
+		if isinstance(data, bytes):
+
+			self.server.throttle(len(data))
+
+		return data
+
+	def stat(self) -> paramiko.SFTPAttributes | int:
+
+		try:
+
+			return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+		except OSError as e:
+
+			return paramiko.SFTPServer.convert_errno(e.errno)
+
+	def close(self):
+
+		self.server.wait()
+
+		super().close()
+
+
+class FileSystem(paramiko.SFTPServerInterface):
+	"""
+	Every SFTP request is served from the root directory of the server.
+	"""
+
+	def __init__(self, authorization: Authorization, *args, **kwargs) -> None:
+
+		super().__init__(authorization, *args, **kwargs)
+
+		self.server = authorization.server
+
+	def list_folder(self, path: str) -> list | int:
+
+		self.server.wait()
+
+		directory = self.server.local(path)
+
+		try:
+
+			res = []
+
+			for name in os.listdir(directory):
+
+				attributes = paramiko.SFTPAttributes.from_stat(os.lstat(directory / name))
+				attributes.filename = name
+
+				res.append(attributes)
+
+			return res
+
+		except OSError as e:
+
+			return paramiko.SFTPServer.convert_errno(e.errno)
+
+	def stat(self, path: str) -> paramiko.SFTPAttributes | int:
+
+		self.server.wait()
+
+		try:
+
+			return paramiko.SFTPAttributes.from_stat(os.stat(self.server.local(path)))
+
+		except OSError as e:
+
+			return paramiko.SFTPServer.convert_errno(e.errno)
+
+	lstat = stat
+
+	def open(self, path: str, flags: int, attr: paramiko.SFTPAttributes) -> File | int:
+
+		self.server.wait()
+
+		if flags & os.O_WRONLY:
+
+			mode = 'ab' if flags & os.O_APPEND else 'wb'
+
+		elif flags & os.O_RDWR:
+
+			mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+
+		else:
+
+			mode = 'rb'
+
+		try:
+
+			f = open(self.server.local(path), mode)
+
+		except OSError as e:
+
+			return paramiko.SFTPServer.convert_errno(e.errno)
+
+		return File(self.server, f, flags)
+
+	def remove(self, path: str) -> int:
+
+		self.server.wait()
+
+		try:
+
+			os.remove(self.server.local(path))
+
+		except OSError as e:
+
+			return paramiko.SFTPServer.convert_errno(e.errno)
+
+		return paramiko.SFTP_OK
+
+	def rename(self, oldpath: str, newpath: str) -> int:
+
+		self.server.wait()
+
+		try:
+
+			os.rename(self.server.local(oldpath), self.server.local(newpath))
+
+		except OSError as e:
+
+			return paramiko.SFTPServer.convert_errno(e.errno)
+
+		return paramiko.SFTP_OK
+
+	def posix_rename(self, oldpath: str, newpath: str) -> int:
+
+		self.server.wait()
+
+		try:
+
+			os.replace(self.server.local(oldpath), self.server.local(newpath))
+
+		except OSError as e:
+
+			return paramiko.SFTPServer.convert_errno(e.errno)
+
+		return paramiko.SFTP_OK
+
+	def mkdir(self, path: str, attr: paramiko.SFTPAttributes) -> int:
+
+		self.server.wait()
+
+		try:
+
+			os.mkdir(self.server.local(path))
+
+		except OSError as e:
+
+			return paramiko.SFTPServer.convert_errno(e.errno)
+
+		return paramiko.SFTP_OK
+
+	def rmdir(self, path: str) -> int:
+
+		self.server.wait()
+
+		try:
+
+			os.rmdir(self.server.local(path))
+
+		except OSError as e:
+
+			return paramiko.SFTPServer.convert_errno(e.errno)
+
+		return paramiko.SFTP_OK
+
+	def chattr(self, path: str, attr: paramiko.SFTPAttributes) -> int:
+
+		return paramiko.SFTP_OK
+
+	def canonicalize(self, path: str) -> str:
+
+		self.server.wait()
+
+		# (the root directory plays the role of the home directory)
+		return os.path.normpath('/' + path)
+
+
+def main():
+
+	parser = argparse.ArgumentParser(description='Local SFTP server for testing')
+
+	parser.add_argument('--root', required=True, help='directory in which files are stored')
+	parser.add_argument('--port', default=2222, type=int, help='port to listen at')
+	parser.add_argument('--user', default='gift', help='user name')
+	parser.add_argument('--password', default='wrapper', help='password')
+	parser.add_argument('--latency', default=0., type=float, help='delay (in milliseconds) of every round trip')
+	parser.add_argument('--bandwidth', default=None, type=float, help='transfer rate (in MB/s)')
+
+	command_line_arguments = parser.parse_args()
+
+	server = Server(
+		command_line_arguments.root, command_line_arguments.user, command_line_arguments.password,
+		command_line_arguments.port, command_line_arguments.latency / 1e3,
+		command_line_arguments.bandwidth and command_line_arguments.bandwidth * 1e6)
+
+	print(f'serving {server.root} at 127.0.0.1:{server.port} (press Ctrl+C to stop)')
+
+	with server:
+
+		try:
+
+			server.thread.join()
+
+		except KeyboardInterrupt:
+
+			pass
+
+
+if __name__ == '__main__':
+
+	main()
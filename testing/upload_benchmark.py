@@ -0,0 +1,198 @@
+"""
+Measures how fast images are copied over to the remote host, by running `transformer.SvgToHttp` end to end against
+a local SFTP server (see `sftp_server.py`) that simulates a slow network, e.g.,
+```
+python upload_benchmark.py --latency 20 --bandwidth 10
+```
+For every set of images, files are copied both one by one and in bulk mode, and it is checked that every one of them
+reaches the server unchanged.
+"""
+
+import os
+import sys
+import time
+import pathlib
+import argparse
+import tempfile
+import filecmp
+
+# so that the package can be imported from this directory
+sys.path.insert(0, pathlib.Path(__file__).resolve().parent.parent.as_posix())
+
+import gift_wrapper.remote
+import gift_wrapper.transformer
+
+import sftp_server
+
+# every set of images as (number of files, size of each file in bytes, depth of the directories they are in)
+image_sets = {
+	'small': (200, 2_000, 0),
+	'large': (8, 2_000_000, 0),
+	'deep': (200, 4_000, 6),
+}
+
+
+class CheckedConnection(gift_wrapper.remote.Connection):
+	"""
+	Connection that fails, rather than falling back to copying files one by one, if an archive cannot be unpacked.
+	"""
+
+	def unpack(self, archive: bytes, at: str) -> tuple[bool, str]:
+
+		unpacked, output = super().unpack(archive, at)
+
+		assert unpacked, f'bulk mode fell back to copying files one by one: {output}'
+
+		return unpacked, output
+
+
+def make_images(directory: pathlib.Path, n_files: int, size: int, depth: int) -> list[str]:
+	"""
+	Makes a set of (fake) svg files.
+
+	Parameters
+	----------
+	directory : pathlib.Path
+		Directory in which the images are made.
+	n_files : int
+		Number of files.
+	size : int
+		Size (in bytes) of every file.
+	depth : int
+		Number of nested directories every file is in (there are 4 of them at every level).
+
+	Returns
+	-------
+	out: list
+		Path of every file relative to `directory`.
+
+	"""
+
+	res = []
+
+	for i in range(n_files):
+
+		subdirectory = pathlib.Path(*[f'd{(i >> (2 * level)) & 3}' for level in range(depth)])
+
+		file = directory / subdirectory / f'image_{i}.svg'
+
+		file.parent.mkdir(parents=True, exist_ok=True)
+
+		# (random content so that the files cannot be compressed away)
+		file.write_bytes(os.urandom(size))
+
+		res.append((subdirectory / file.name).as_posix())
+
+	return res
+
+
+def upload(
+		server: sftp_server.Server, images_directory: pathlib.Path, files: list[str], bulk: bool,
+		public_root: str) -> float:
+	"""
+	Copies images over to the server through `transformer.SvgToHttp`.
+
+	Parameters
+	----------
+	server : sftp_server.Server
+		The server.
+	images_directory : pathlib.Path
+		Directory the images hang from.
+	files : list
+		Images (relative to `images_directory`).
+	bulk : bool
+		Whether images are copied in bulk mode.
+	public_root : str
+		Public filesystem root in the server.
+
+	Returns
+	-------
+	out: float
+		Elapsed time (in seconds), including establishing the connection.
+
+	"""
+
+	history = {'already compiled': set(), 'already transferred': set()}
+
+	# images are referred to by relative paths
+	os.chdir(images_directory)
+
+	start = time.perf_counter()
+
+	connection = CheckedConnection(
+		'127.0.0.1', server.user, server.password, None, bulk=bulk, port=server.port)
+
+	svg_to_http = gift_wrapper.transformer.SvgToHttp(
+		history, connection, public_root, 'bank', 'http://localhost/')
+
+	# every image is referred to in a separate piece of text (as it happens with questions)
+	for f in files:
+
+		svg_to_http(f'<img src="{f}">')
+
+	connection.flush()
+
+	elapsed = time.perf_counter() - start
+
+	connection.connection.close()
+
+	return elapsed
+
+
+def main():
+
+	parser = argparse.ArgumentParser(description='Benchmark for copying images to a (local) remote host')
+
+	parser.add_argument('--latency', default=0., type=float, help='delay (in milliseconds) of every round trip')
+	parser.add_argument('--bandwidth', default=None, type=float, help='transfer rate (in MB/s)')
+	parser.add_argument(
+		'--public-root', default='/srv/www',
+		help='public filesystem root in the server (relative to the directory it is run from if not absolute)')
+	parser.add_argument(
+		'--sets', default=list(image_sets), nargs='+', choices=list(image_sets), help='sets of images to be used')
+
+	command_line_arguments = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as scratch:
+
+		scratch = pathlib.Path(scratch)
+
+		print(f'{"set":>6} {"mode":>12} {"files":>6} {"MB":>8} {"seconds":>8} {"files/s":>9} {"MB/s":>8}')
+
+		for name in command_line_arguments.sets:
+
+			images_directory = scratch / 'images' / name
+
+			files = make_images(images_directory, *image_sets[name])
+
+			megabytes = sum((images_directory / f).stat().st_size for f in files) / 1e6
+
+			for bulk in (False, True):
+
+				root = scratch / 'remote' / f'{name}-{bulk}'
+
+				# (the server maps absolute paths into its directory too)
+				public_root = root / command_line_arguments.public_root.lstrip('/')
+
+				public_root.mkdir(parents=True)
+
+				with sftp_server.Server(
+						root, latency=command_line_arguments.latency / 1e3,
+						bandwidth=command_line_arguments.bandwidth and command_line_arguments.bandwidth * 1e6) as server:
+
+					elapsed = upload(server, images_directory, files, bulk, command_line_arguments.public_root)
+
+				# every file should be in the server, with the same content
+				_, mismatch, missing = filecmp.cmpfiles(
+					images_directory, public_root / 'bank', files, shallow=False)
+
+				assert not (mismatch or missing), f'{len(mismatch)} different and {len(missing)} missing files'
+
+				print(
+					f'{name:>6} {"bulk" if bulk else "one by one":>12} {len(files):>6} {megabytes:>8.2f} {elapsed:>8.2f}'
+					f' {len(files) / elapsed:>9.1f} {megabytes / elapsed:>8.2f}')
+
+
+if __name__ == '__main__':
+
+	main()
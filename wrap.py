@@ -2,4 +2,7 @@
 
 import gift_wrapper.core
 
-gift_wrapper.core.main()
+# the guard is required by the worker processes of `gift_wrapper.server`
+if __name__ == '__main__':
+
+	gift_wrapper.core.main()